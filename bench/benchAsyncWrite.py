@@ -0,0 +1,74 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchAsyncWrite.py                                           #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of creating assets with many shapefile parts,      #
+# writing files when added or in the background                #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import random
+import shutil
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+
+def createSources(dirname, layers, size):
+    sources = []
+    for i in xrange(layers):
+        parts = []
+        for ext in ['shp','shx','dbf','xml']:
+            fn = os.path.join(dirname,'layer%d.%s'%(i,ext))
+            with open(fn,'wb') as fid:
+                # Records of numbers, compressing like real attribute data
+                fid.write(''.join('%12.6f'%random.gauss(0,100)
+                                  for j in xrange(size//12)))
+            parts.append(fn)
+        sources.append(parts)
+    return sources
+
+def createAsset(fn, sources, compression, writeWorkers):
+    with Aptofile.create(fn,'asset',validate='on_close',compression=compression,
+                         writeWorkers=writeWorkers) as af:
+        af.setDescription("Asynchronous write benchmark")
+        af.setGenerator("benchAsyncWrite.py", "Aptomar AS")
+        for i, parts in enumerate(sources):
+            af.addLayer('layer%d'%i,
+                        geometry_data=[(p,'layers/'+os.path.basename(p))
+                                       for p in parts[:3]],
+                        style_data=[(parts[3],'styles/layer%d.xml'%i)])
+        af.addGroup('group1',layers=['layer0'])
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Asynchronous write benchmark")
+    parser.add_argument('-l', '--layers', type=int, default=500,
+                        help="number of layers")
+    parser.add_argument('-s', '--size', type=int, default=64,
+                        help="size of each file in kB")
+    parser.add_argument('-w', '--workers', type=int, nargs='+',
+                        default=[2,4,8], help="write worker counts")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sources = createSources(tmpdir, args.layers, args.size*1024)
+        print "%d layers with 4 files of %d kB"%(args.layers,args.size)
+        fn = os.path.join(tmpdir,'asset.apt')
+        for compression in [None,'auto']:
+            for workers in [None]+args.workers:
+                t0 = time.time()
+                createAsset(fn, sources, compression, workers)
+                dt = time.time()-t0
+                print "compression %-5s %-9s %8.3f s %8.1f files/s"%(
+                    compression, '%s workers'%workers if workers else 'sync',
+                    dt, 4*args.layers/dt)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,74 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchCatalog.py                                              #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of finding files by metadata, opening every file   #
+# or querying a catalog                                        #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import shutil
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+from catalog import Catalog
+import scanner
+
+def createFiles(dirname, files):
+    # Images from a few vessels over a month, in directories of 1000 files
+    for i in xrange(files):
+        sub = os.path.join(dirname,'files','%d'%(i//1000))
+        if not os.path.exists(sub): os.makedirs(sub)
+        with Aptofile.create(os.path.join(sub,'%d.apt'%i),'image',
+                             validate='on_close') as af:
+            af.setGenerator('benchCatalog.py','Vessel %d'%(i%5))
+            af.setDescription('Image %d'%i)
+            af.setImageName('Image %d'%i)
+            af.setImageCreated('2013-07-%02dT%02d:00:00Z'%(1+i%30,i%24))
+            af.setImageGeoreference(10.4344, 63.4181, 150.60)
+            af.addImageFile((bytearray(os.urandom(2**12)),'image.jpg'))
+    return os.path.join(dirname,'files')
+
+def openFiles(path):
+    found = []
+    for fn in scanner.findFiles([path]):
+        manifest = Aptofile.getManifestFromFile(fn)
+        image = manifest.get('image') or {}
+        if manifest['generator']['creator'] == 'Vessel 3' and \
+                image.get('created') >= '2013-07-24':
+            found.append(fn)
+    return found
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Catalog benchmark")
+    parser.add_argument('-f', '--files', type=int, default=10000,
+                        help="number of files")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = createFiles(tmpdir, args.files)
+        catalog = Catalog(os.path.join(tmpdir,'catalog.sqlite'))
+        print "%d files:"%args.files
+        steps = [('open every file', lambda: openFiles(path)),
+                 ('catalog update', lambda: catalog.update([path])),
+                 ('unchanged update', lambda: catalog.update([path])),
+                 ('catalog query', lambda: catalog.query(
+                     type='image', creator='Vessel 3', since='2013-07-24'))]
+        for label, step in steps:
+            t0 = time.time()
+            result = step()
+            dt = time.time()-t0
+            print "%-17s %10.3f ms"%(label,dt*1000)
+        assert sorted(e['path'] for e in result) == sorted(openFiles(path))
+        catalog.close()
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,65 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchCompiledSchema.py                                       #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of compiled schema validation on large assets      #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+import jsonschema
+
+def assetManifest(nLayers):
+    layers = {}
+    groups = {}
+    for i in xrange(nLayers):
+        key = 'layer%d'%i
+        layers[key] = {'name': key,
+                       'geometry': {'type': 'text/x-shapefile',
+                                    'data': ['layers/%s.shp'%key,
+                                             'layers/%s.shx'%key,
+                                             'layers/%s.dbf'%key]},
+                       'style': {'type': 'text/x-sld',
+                                 'data': ['styles/%s.xml'%key]},
+                       'resources': {'data': ['icon.png']}}
+        if i%10 == 0:
+            groups['group%d'%i] = {'name': 'group%d'%i, 'layers': [key]}
+    return {'date': '2013-05-23T12:00:00Z',
+            'description': 'Benchmark asset',
+            'generator': {'program': 'benchCompiledSchema.py',
+                          'creator': 'Aptomar AS'},
+            'manifest_version': 1,
+            'asset': {'layers': layers, 'groups': groups}}
+
+def timeit(validator, manifest, repeat):
+    t0 = time.time()
+    for i in xrange(repeat):
+        validator.validate(manifest)
+    return (time.time()-t0)/repeat
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Compiled schema benchmark")
+    parser.add_argument('-l', '--layers', type=int, nargs='+',
+                        default=[100,1000,5000], help="layer counts")
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    interpreted = Aptofile.VALIDATOR(Aptofile.SCHEMA,
+                                     format_checker=jsonschema.FormatChecker())
+    compiled = jsonschema.compile_validator(Aptofile.SCHEMA,
+                                            format_checker=jsonschema.FormatChecker())
+    print "%8s %14s %14s %8s"%('layers','interpreted','compiled','speedup')
+    for n in args.layers:
+        manifest = assetManifest(n)
+        a = timeit(interpreted, manifest, args.repeat)
+        b = timeit(compiled, manifest, args.repeat)
+        print "%8d %12.2fms %12.2fms %7.1fx"%(n, a*1000, b*1000, a/b)
@@ -0,0 +1,103 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchCompression.py                                          #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of archive size and creation time with different   #
+# compression policies                                         #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import random
+import shutil
+import struct
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+
+SLD = """<StyledLayerDescriptor version="1.0.0">
+  <NamedLayer><Name>layer%d</Name><UserStyle><FeatureTypeStyle><Rule>
+    <LineSymbolizer><Stroke>
+      <CssParameter name="stroke">#%06x</CssParameter>
+      <CssParameter name="stroke-width">%d</CssParameter>
+    </Stroke></LineSymbolizer>
+  </Rule></FeatureTypeStyle></UserStyle></NamedLayer>
+</StyledLayerDescriptor>
+"""
+
+def createSources(dirname, layers, size):
+    # Shapefile parts with a random walk of points, SLD styles and
+    # incompressible images, like the layers of a real asset
+    files = []
+    for i in xrange(layers):
+        shp = os.path.join(dirname,'layer%d.shp'%i)
+        dbf = os.path.join(dirname,'layer%d.dbf'%i)
+        sld = os.path.join(dirname,'layer%d.xml'%i)
+        png = os.path.join(dirname,'layer%d.png'%i)
+        x, y = 10.0, 63.0
+        points = []
+        for j in xrange(size//16):
+            x += random.gauss(0,1e-4)
+            y += random.gauss(0,1e-4)
+            points.append(struct.pack('<2d',round(x,6),round(y,6)))
+        with open(shp,'wb') as fid: fid.write(''.join(points))
+        with open(dbf,'wb') as fid:
+            fid.write(''.join('%10d%-30s%12.6f'%(j,'feature%d'%(j%50),j*0.5)
+                              for j in xrange(size//52)))
+        with open(sld,'w') as fid:
+            fid.write(SLD%(i,random.randint(0,2**24),random.randint(1,5)))
+        with open(png,'wb') as fid: fid.write(os.urandom(size//2))
+        files.append((shp,dbf,sld,png))
+    return files
+
+def createAsset(fn, sources, compression):
+    with Aptofile.create(fn,'asset',validate='on_close',
+                         compression=compression) as af:
+        af.setDescription("Compression benchmark")
+        af.setGenerator("benchCompression.py", "Aptomar AS")
+        for i, (shp,dbf,sld,png) in enumerate(sources):
+            af.addLayer('layer%d'%i,
+                        geometry_data=[(shp,'layers/layer%d.shp'%i),
+                                       (dbf,'layers/layer%d.dbf'%i)],
+                        style_data=[(sld,'styles/layer%d.xml'%i)],
+                        resources_data=[(png,'resources/layer%d.png'%i)])
+            af.addGroup('group%d'%i,layers=['layer%d'%i])
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Compression benchmark")
+    parser.add_argument('-l', '--layers', type=int, default=20,
+                        help="number of layers")
+    parser.add_argument('-s', '--size', type=int, default=4096,
+                        help="size of the files of a layer in kB")
+    parser.add_argument('-w', '--workers', type=int, nargs='+',
+                        default=[1,4], help="compression worker counts")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sources = createSources(tmpdir, args.layers, args.size*1024)
+        total = sum(os.path.getsize(f) for s in sources for f in s)
+        print "%d layers, %.1f MB of files"%(args.layers,total/2.**20)
+        fn = os.path.join(tmpdir,'asset.apt')
+        for name, compression in [('stored',None),
+                                  ('auto','auto'),
+                                  ('level 1',{'text/x-shapefile':1,'default':1}),
+                                  ('level 9',{'text/x-shapefile':9,'default':9})]:
+            for workers in args.workers:
+                if compression is None and workers != args.workers[0]: continue
+                Aptofile.COMPRESS_WORKERS = workers
+                t0 = time.time()
+                createAsset(fn, sources, compression)
+                dt = time.time()-t0
+                size = os.path.getsize(fn)
+                print "%-8s %2d workers %8.3f s %8.1f MB %6.1f%%"%(
+                    name,workers,dt,size/2.**20,100.*size/total)
+    finally:
+        shutil.rmtree(tmpdir)
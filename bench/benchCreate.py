@@ -0,0 +1,79 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchCreate.py                                               #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of creating asset archives with many layers        #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import shutil
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+
+ASSETDIR = os.path.join(BENCHDIR,'..','test','tests','asset')
+
+def addLayers(af, nLayers):
+    af.setDescription("Benchmark asset")
+    af.setGenerator("benchCreate.py", "Aptomar AS")
+    for i in xrange(nLayers):
+        key = 'layer%d'%i
+        af.addLayer(key,
+                    geometry_data=[(os.path.join(ASSETDIR,'layers','layer1.'+ext),
+                                    'layers/%s.%s'%(key,ext))
+                                   for ext in ['shp','shx','dbf']],
+                    style_data=[(os.path.join(ASSETDIR,'styles','layer1.xml'),
+                                 'styles/%s.xml'%key)])
+        if i%10 == 0:
+            af.addGroup('group%d'%i,layers=[key])
+
+def always(fn, nLayers):
+    with Aptofile.create(fn,'asset') as af:
+        addLayers(af, nLayers)
+    return af.valid
+
+def batch(fn, nLayers):
+    with Aptofile.create(fn,'asset') as af:
+        with af.batch():
+            addLayers(af, nLayers)
+    return af.valid
+
+def onClose(fn, nLayers):
+    with Aptofile.create(fn,'asset',validate='on_close') as af:
+        addLayers(af, nLayers)
+    return af.valid
+
+MODES = [('always',always), ('batch',batch), ('on_close',onClose)]
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Archive creation benchmark")
+    parser.add_argument('-l', '--layers', type=int, nargs='+',
+                        default=[50,100,500,1000], help="layer counts")
+    parser.add_argument('--max-always', type=int, default=100,
+                        help="largest layer count run with validate='always'")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tmpdir,'bench.apt')
+        print "%8s"%'layers' + ''.join("%12s"%m for m,f in MODES)
+        for n in args.layers:
+            line = "%8d"%n
+            for mode, f in MODES:
+                if mode == 'always' and n > args.max_always:
+                    line += "%12s"%'-'
+                    continue
+                t0 = time.time()
+                if not f(fn, n): raise Exception("Invalid archive")
+                line += "%11.2fs"%(time.time()-t0)
+            print line
+    finally:
+        shutil.rmtree(tmpdir)
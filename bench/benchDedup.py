@@ -0,0 +1,77 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchDedup.py                                                #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of creating assets whose layers share styles,      #
+# projections and icons, with and without deduplication        #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import random
+import shutil
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+
+def createSources(dirname, layers, size):
+    # A unique shapefile per layer, the same style, projection and icon
+    shared = []
+    for name, data in [('style.xml','<sld/>'*(size//6)),
+                       ('layer.prj','GEOGCS["WGS 84"]'),
+                       ('icon.png',os.urandom(size))]:
+        shared.append(os.path.join(dirname,name))
+        with open(shared[-1],'wb') as fid: fid.write(data)
+    shps = []
+    for i in xrange(layers):
+        shps.append(os.path.join(dirname,'layer%d.shp'%i))
+        with open(shps[-1],'wb') as fid:
+            fid.write(os.urandom(size+random.randint(-size//2,size//2)))
+    return shps, shared
+
+def createAsset(fn, shps, shared, dedup):
+    style, prj, icon = shared
+    with Aptofile.create(fn,'asset',validate='on_close',dedup=dedup) as af:
+        af.setDescription("Deduplication benchmark")
+        af.setGenerator("benchDedup.py", "Aptomar AS")
+        for i, shp in enumerate(shps):
+            af.addLayer('layer%d'%i,
+                        geometry_data=[(shp,'layers/layer%d.shp'%i),
+                                       (prj,'layers/layer%d.prj'%i)],
+                        style_data=[(style,'styles/layer%d.xml'%i)],
+                        resources_data=[(icon,'icons/layer%d.png'%i)])
+        af.addGroup('group1',layers=['layer0'])
+        return af
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Deduplication benchmark")
+    parser.add_argument('-l', '--layers', type=int, default=500,
+                        help="number of layers")
+    parser.add_argument('-s', '--size', type=int, default=64,
+                        help="size of shapefiles, styles and icons in kB")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        shps, shared = createSources(tmpdir, args.layers, args.size*1024)
+        print "%d layers sharing a style, projection and icon"%args.layers
+        fn = os.path.join(tmpdir,'asset.apt')
+        for dedup in [False, True]:
+            t0 = time.time()
+            af = createAsset(fn, shps, shared, dedup)
+            dt = time.time()-t0
+            print "dedup %-5s %8.3f s %8.1f MB"%(dedup,dt,
+                                                 os.path.getsize(fn)/2.**20)
+            if dedup:
+                print "%(files)d files of %(bytes)d bytes written, " \
+                    "%(duplicates)d duplicates of %(saved)d bytes saved"% \
+                    af.getDedupSummary()
+    finally:
+        shutil.rmtree(tmpdir)
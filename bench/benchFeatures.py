@@ -0,0 +1,157 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchFeatures.py                                             #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of reading the features of a large shapefile       #
+# layer                                                        #
+#                                                              #
+################################################################
+
+import argparse
+import multiprocessing
+import os,sys
+import resource
+import shutil
+import struct
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+import shapefile
+import numpy
+
+INDEX = numpy.dtype([('offset','>i4'),('length','>i4')])
+BATCH = 2**14
+
+def lineRecord(vertices):
+    # A PolyLine record of one part
+    return numpy.dtype([('number','>i4'),('length','>i4'),('type','<i4'),
+                        ('bbox','<f8',4),('parts','<i4'),('points','<i4'),
+                        ('start','<i4'),('coords','<f8',(vertices,2))])
+
+def header(length, bbox):
+    return struct.pack('>7i', 9994, 0, 0, 0, 0, 0, length//2) + \
+        struct.pack('<2i', 1000, 3) + struct.pack('<8d', *(bbox+(0,0,0,0)))
+
+def shp(count, vertices):
+    # Lines of up to 20 km along the coast of Norway, made in batches
+    record = lineRecord(vertices)
+    yield header(100+count*record.itemsize, (4.0, 58.0, 31.2, 71.2))
+    for start in xrange(0, count, BATCH):
+        n = min(BATCH, count-start)
+        records = numpy.zeros(n, record)
+        records['number'] = numpy.arange(start+1, start+n+1)
+        records['length'] = (record.itemsize-8)//2
+        records['type'] = 3
+        records['parts'] = 1
+        records['points'] = vertices
+        origin = numpy.random.uniform((4, 58), (31, 71), (n, 1, 2))
+        steps = numpy.random.normal(0, 0.01, (n, vertices, 2))
+        records['coords'] = origin+numpy.cumsum(steps, axis=1)
+        records['bbox'][:,:2] = records['coords'].min(1)
+        records['bbox'][:,2:] = records['coords'].max(1)
+        yield records.tobytes()
+
+def shx(count, vertices):
+    size = lineRecord(vertices).itemsize
+    yield header(100+count*8, (4.0, 58.0, 31.2, 71.2))
+    for start in xrange(0, count, BATCH):
+        index = numpy.zeros(min(BATCH, count-start), INDEX)
+        index['offset'] = (100+(numpy.arange(len(index))+start)*size)//2
+        index['length'] = (size-8)//2
+        yield index.tobytes()
+
+def dbf(count):
+    yield struct.pack('<4BI2H20x', 3, 113, 7, 30, count, 97, 31) + \
+        struct.pack('<11sc4x2B14x', 'ID', 'N', 10, 0) + \
+        struct.pack('<11sc4x2B14x', 'NAME', 'C', 20, 0) + '\r'
+    for start in xrange(0, count, BATCH):
+        yield ''.join(' %10d%-20s'%(i, 'Line %d'%i)
+                      for i in xrange(start, min(count, start+BATCH)))
+    yield '\x1a'
+
+def createAsset(fn, count, vertices, compression):
+    numpy.random.seed(1)
+    with Aptofile.create(fn,'asset',validate='on_close',
+                         compression=compression) as af:
+        af.setDescription("Features benchmark")
+        af.setGenerator("benchFeatures.py", "Aptomar AS")
+        af.addLayer('lines',
+                    geometry_data=[(shp(count, vertices),'layers/lines.shp'),
+                                   (shx(count, vertices),'layers/lines.shx'),
+                                   (dbf(count),'layers/lines.dbf')],
+                    style_data=[(bytearray('<sld/>'),'styles/lines.xml')])
+        af.addGroup('group1',layers=['lines'])
+
+def recordByRecord(af, bbox=None):
+    # Reading the files into memory and unpacking each record with struct
+    data = af.readfile('layers/lines.shp')
+    table = af.readfile('layers/lines.dbf')
+    records, headerLength, recordLength = \
+        shapefile.readDbfHeaderLength(table)
+    offset, i, features = 100, 0, 0
+    while offset < len(data):
+        length, = struct.unpack_from('>i', data, offset+4)
+        tp, x0, y0, x1, y1, parts, points = struct.unpack_from(
+            '<i4d2i', data, offset+8)
+        if bbox is None or (x0 <= bbox[2] and x1 >= bbox[0] and
+                            y0 <= bbox[3] and y1 >= bbox[1]):
+            starts = struct.unpack_from('<%di'%parts, data, offset+52)
+            values = struct.unpack_from('<%dd'%(2*points), data,
+                                        offset+52+4*parts)
+            coords = zip(values[0::2], values[1::2])
+            row = table[headerLength+i*recordLength:
+                        headerLength+(i+1)*recordLength]
+            attributes = (int(row[1:11]), row[11:].rstrip())
+            features += 1
+        offset += 8+2*length
+        i += 1
+    return features
+
+def batches(af, bbox=None):
+    return sum(len(b) for b in af.iterFeatures('lines', bbox=bbox))
+
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Features benchmark")
+    parser.add_argument('-n', '--features', type=int, default=200000,
+                        help="number of lines of the layer")
+    parser.add_argument('-v', '--vertices', type=int, default=20,
+                        help="vertices per line")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tmpdir,'asset.apt')
+        size = lineRecord(args.vertices).itemsize*args.features/2.0**20
+        print "%d lines of %d vertices, %.1f MB .shp"%(args.features,
+                                                       args.vertices, size)
+        for compression in [None, 'auto']:
+            # In another process, not to count its memory
+            p = multiprocessing.Process(target=createAsset, args=(
+                fn, args.features, args.vertices, compression))
+            p.start()
+            p.join()
+            with Aptofile.open(fn,validate='none') as af:
+                # Batches first, so the peak memory of reading the whole
+                # files does not hide theirs
+                for name, f in [('iterFeatures', batches),
+                                ('record by record', recordByRecord)]:
+                    for label, bbox in [('all', None),
+                                        ('sea area 10 km', (5, 60, 5.2, 60.1))]:
+                        t0 = time.time()
+                        found = f(af, bbox)
+                        dt = time.time()-t0
+                        print "%-7s %-17s %-15s %8.3f s %9.0f features/s " \
+                            "%7d found, peak memory %6.1f MB"%(
+                                compression or 'stored', name, label, dt,
+                                args.features/dt, found, maxrss())
+    finally:
+        shutil.rmtree(tmpdir)
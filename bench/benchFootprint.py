@@ -0,0 +1,109 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchFootprint.py                                            #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of placing many images on a chart by their         #
+# worldfiles                                                   #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import shutil
+import StringIO
+import struct
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+from catalog import Catalog
+from spatial import SpatialIndex
+import worldfile
+
+def jpeg(width, height, size):
+    # An Exif segment and a frame, followed by random data
+    header = '\xff\xd8\xff\xe1' + struct.pack('>H', 2**14+2) + \
+        os.urandom(2**14) + '\xff\xc0' + \
+        struct.pack('>HB2HB', 17, 8, height, width, 3) + '\0'*9 + '\xff\xda'
+    return header + os.urandom(size-len(header))
+
+def createFiles(dirname, files, size):
+    # Aerial images along the coast, with worldfiles of 1 m pixels
+    image = bytearray(jpeg(4000, 3000, size))
+    for i in xrange(files):
+        lon, lat = 4.0+27.0*i/files, 58.0+13.0*i/files
+        with Aptofile.create(os.path.join(dirname,'%d.apt'%i),'image',
+                             validate='on_close') as af:
+            af.setGenerator('benchFootprint.py','Aptomar AS')
+            af.setDescription('Image %d'%i)
+            af.setImageName('Image %d'%i)
+            af.setImageGeoreference(lon, lat, 300.0)
+            af.addImageFile((image,'image.jpg'))
+            af.writefile((bytearray('0.00002\n0\n0\n-0.00001\n%r\n%r\n'%(
+                lon, lat)),'image.jgw'),'image')
+            af.setImageBounds(['image.jgw'])
+
+def readImage(fn):
+    # Reading the whole image to find its size
+    with Aptofile.open(fn,validate='none') as af:
+        image = af.getManifest()['image']
+        data = af.readfile(image['data'][0])
+        size = worldfile.readImageSize(StringIO.StringIO(data))
+        parameters = worldfile.readWorldfile(
+            af.readfile(image['bounds']['data'][0]))
+        return worldfile.footprint(parameters, size)
+
+def footprint(fn):
+    with Aptofile.open(fn,validate='none') as af:
+        return af.getImageFootprint()['corners']
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Image footprint benchmark")
+    parser.add_argument('-f', '--files', type=int, default=500,
+                        help="number of image archives")
+    parser.add_argument('-s', '--size', type=float, default=4,
+                        help="image size in MB")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir,'files')
+        os.mkdir(path)
+        createFiles(path, args.files, int(args.size*2**20))
+        files = [os.path.join(path,'%d.apt'%i) for i in xrange(args.files)]
+        print "%d images of %.1f MB:"%(args.files, args.size)
+        results = {}
+        for name, f in [('reading the image', readImage),
+                        ('getImageFootprint', footprint)]:
+            t0 = time.time()
+            results[name] = [f(fn) for fn in files]
+            dt = time.time()-t0
+            print "  %-26s %8.3f s %8.2f ms/file"%(name, dt,
+                                                   dt*1000/args.files)
+        assert results['reading the image'] == results['getImageFootprint']
+        with Aptofile.open(files[0],validate='none') as af:
+            af.getImageFootprint()
+            t0 = time.time()
+            for i in xrange(10000): af.getImageFootprint()
+            print "  %-26s %8.3f us"%('cached footprint',
+                                      (time.time()-t0)*1e6/10000)
+        index = SpatialIndex(os.path.join(tmpdir,'spatial.npz'))
+        catalog = Catalog(os.path.join(tmpdir,'catalog.sqlite'))
+        for name, update in [('spatial index update', index.update),
+                             ('catalog update', catalog.update)]:
+            t0 = time.time()
+            update([path], workers=1)
+            print "  %-26s %8.3f s"%(name, time.time()-t0)
+        t0 = time.time()
+        found = catalog.query(bbox=(10, 60, 11, 61))
+        print "  %-26s %8.3f ms, %d images"%('catalog area query',
+                                             (time.time()-t0)*1000,
+                                             len(found))
+        catalog.close()
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,77 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchGeometry.py                                             #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of parsing and writing EWKT routes and areas,      #
+# vertex by vertex or with the geometry module                 #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import re
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+import geometry
+import numpy
+
+VERTEX = re.compile(r'(-?[\d.eE+-]+)\s+(-?[\d.eE+-]+)')
+
+def createRoute(vertices):
+    # A random walk from Trondheim
+    steps = numpy.random.normal(0, 1e-4, (vertices, 2))
+    coords = numpy.cumsum(steps, 0)+(10.4344, 63.4181)
+    return geometry.Geometry('LINESTRING', coords.round(7), srid=4326)
+
+def createArea(rings, vertices):
+    # Polygons of circles
+    t = numpy.linspace(0, 2*numpy.pi, vertices)
+    coords, offsets = [], [0]
+    for i in xrange(rings):
+        circle = numpy.column_stack([10+i*0.01+0.004*numpy.cos(t),
+                                     63+0.004*numpy.sin(t)]).round(7)
+        circle[-1] = circle[0]
+        coords.append(circle)
+        offsets.append(offsets[-1]+vertices)
+    return geometry.Geometry('MULTIPOLYGON', numpy.concatenate(coords),
+                             offsets, range(rings+1), 4326)
+
+def parseLoop(text):
+    # A regular expression and a float per coordinate
+    return [(float(x), float(y)) for x, y in VERTEX.findall(text)]
+
+def writeLoop(g):
+    return 'SRID=4326;LINESTRING(%s)'%', '.join('%r %r'%(x, y)
+                                                 for x, y in g.coords.tolist())
+
+def timeit(f, *args):
+    t0 = time.time()
+    result = f(*args)
+    return time.time()-t0, result
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="EWKT geometry benchmark")
+    parser.add_argument('-v', '--vertices', type=int, default=1000000,
+                        help="number of vertices of the route")
+    parser.add_argument('-r', '--rings', type=int, default=10000,
+                        help="number of rings of the area")
+    args = parser.parse_args()
+
+    for label, g in [('route', createRoute(args.vertices)),
+                     ('area', createArea(args.rings, 100))]:
+        text = g.toEWKT()
+        n = g.vertexCount
+        print "%s of %d vertices, %.1f MB of EWKT:"%(label, n, len(text)/2.**20)
+        steps = [('parse regex loop', parseLoop, text),
+                 ('parse geometry', geometry.parse, text),
+                 ('write geometry', lambda g: g.toEWKT(), g)]
+        if label == 'route': steps.insert(2, ('write loop', writeLoop, g))
+        for name, f, arg in steps:
+            dt, result = timeit(f, arg)
+            print "%-18s %8.3f s %12.0f vertices/s"%(name, dt, n/dt)
+        assert geometry.parse(text) == g
@@ -0,0 +1,63 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchIncremental.py                                          #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of validation cost per edit of a growing asset     #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import shutil
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+
+ASSETDIR = os.path.join(BENCHDIR,'..','test','tests','asset')
+
+def addLayer(af, key):
+    return af.addLayer(key,
+                       geometry_data=[(os.path.join(ASSETDIR,'layers','layer1.'+ext),
+                                       'layers/%s.%s'%(key,ext))
+                                      for ext in ['shp','shx','dbf']],
+                       style_data=[(os.path.join(ASSETDIR,'styles','layer1.xml'),
+                                    'styles/%s.xml'%key)])
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Incremental validation benchmark")
+    parser.add_argument('-l', '--layers', type=int, nargs='+',
+                        default=[100,500,1000,2000], help="layer counts")
+    parser.add_argument('-e', '--edits', type=int, default=20,
+                        help="number of edits timed at each layer count")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print "%8s %16s %16s"%('layers','incremental/edit','full/validate')
+        with Aptofile.create(os.path.join(tmpdir,'bench.apt'),'asset') as af:
+            af.setDescription("Benchmark asset")
+            af.setGenerator("benchIncremental.py", "Aptomar AS")
+            n = 0
+            for target in args.layers:
+                with af.batch():
+                    while n < target:
+                        addLayer(af, 'layer%d'%n)
+                        if n%10 == 0: af.addGroup('group%d'%n,layers=['layer%d'%n])
+                        n += 1
+                t0 = time.time()
+                for i in xrange(args.edits):
+                    if not addLayer(af, 'layer%d'%n): raise Exception("Invalid archive")
+                    n += 1
+                incremental = (time.time()-t0)/args.edits
+                t0 = time.time()
+                af.validate()
+                full = time.time()-t0
+                print "%8d %14.2fms %14.2fms"%(target, incremental*1000, full*1000)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,123 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchLarge.py                                                #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of ZIP64 archives: a video over 4 GB and an asset  #
+# with 100k files, created, opened, validated and read         #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+
+CHUNK = 2**20
+
+def frames(size):
+    frame = bytearray(os.urandom(CHUNK))
+    for i in xrange(size//CHUNK):
+        frame[0:8] = '%08d'%i
+        yield frame
+
+def createVideo(fn, size):
+    with Aptofile.create(fn,'video') as af:
+        af.setGenerator(program='benchLarge.py',creator='Aptomar AS')
+        af.setDescription('Large video')
+        af.setVideoName('Video')
+        af.setVideoDescription('Video of %d MB'%(size//2**20))
+        af.setVideoGeoreference(10.4344, 63.4181, 150.60)
+        af.addVideoFile((frames(size),'video.avi'))
+
+def createAsset(fn, members):
+    with Aptofile.create(fn,'asset',validate='on_close') as af:
+        af.setDescription('Asset with %d files'%members)
+        af.setGenerator('benchLarge.py','Aptomar AS')
+        names = []
+        for i in xrange(members):
+            names.append('tiles/%d/%d.png'%(i//1000,i%1000))
+            af.writefile((bytearray('tile%d'%i),names[-1]))
+        af.addLayer('layer1',resources={'data':names})
+        af.addFile2Layer(names[0],'layer1','geometry',writeFile=False)
+        af.addFile2Layer(names[1],'layer1','style',writeFile=False)
+        af.addGroup('group1',layers=['layer1'])
+
+def openFile(fn):
+    with Aptofile.open(fn,validate='none') as af:
+        return len(af.namelist())
+
+def validateFile(fn):
+    with Aptofile.open(fn,validate='none') as af:
+        assert af.validate(), af.getFailedTests()
+
+def streamFile(fn):
+    # Read every file in the archive in blocks
+    size = 0
+    with Aptofile.open(fn,validate='none') as af:
+        for name in af.namelist():
+            with af.openfile(name) as f:
+                while True:
+                    data = f.read(CHUNK)
+                    if not data: break
+                    size += len(data)
+    return size
+
+def runStep(step, kind, fn, size):
+    # Run in this process, which is started for the step only
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.time()
+    if step == 'create':
+        if kind == 'video': createVideo(fn, size)
+        else: createAsset(fn, size)
+    elif step == 'open': openFile(fn)
+    elif step == 'validate': validateFile(fn)
+    elif step == 'stream': streamFile(fn)
+    dt = time.time()-t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print dt, (peak-base)/1024.
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Large archive benchmark")
+    parser.add_argument('-v', '--video-size', type=int, default=4608,
+                        help="video size in MB")
+    parser.add_argument('-m', '--members', type=int, default=100000,
+                        help="number of files in the asset")
+    parser.add_argument('-d', '--dir', help="directory for the archives")
+    parser.add_argument('--step', help=argparse.SUPPRESS)
+    parser.add_argument('--kind', help=argparse.SUPPRESS)
+    parser.add_argument('--file', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.step:
+        runStep(args.step, args.kind, args.file, args.size)
+        sys.exit(0)
+
+    tmpdir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        for kind, size, label in [('video', args.video_size*2**20,
+                                   '%d MB video'%args.video_size),
+                                  ('asset', args.members,
+                                   'asset with %d files'%args.members)]:
+            fn = os.path.join(tmpdir,'%s.apt'%kind)
+            print "%s:"%label
+            for step in ['create','open','validate','stream']:
+                out = subprocess.check_output([sys.executable,__file__,
+                                               '--step',step,'--kind',kind,
+                                               '--file',fn,'--size',str(size)])
+                dt, rss = [float(v) for v in out.split()]
+                print "%-9s %9.3f s %8.1f MB peak RSS increase"%(step,dt,rss)
+            print "%-9s %9.1f MB"%('size',os.path.getsize(fn)/2.**20)
+            os.remove(fn)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,116 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchLayerInfo.py                                            #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of reading the shape type, extent and feature      #
+# count of large shapefile layers                              #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import shutil
+import struct
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+import shapefile
+import numpy
+
+POINT = numpy.dtype([('number','>i4'),('length','>i4'),('type','<i4'),
+                     ('x','<f8'),('y','<f8')])
+INDEX = numpy.dtype([('offset','>i4'),('length','>i4')])
+BATCH = 2**18
+
+def header(length, bbox):
+    return struct.pack('>7i', 9994, 0, 0, 0, 0, 0, length//2) + \
+        struct.pack('<2i', 1000, 1) + struct.pack('<8d', *(bbox+(0,0,0,0)))
+
+def shp(count):
+    # Point records, made in batches
+    yield header(100+count*POINT.itemsize, (4.0, 58.0, 31.0, 71.0))
+    for start in xrange(0, count, BATCH):
+        n = min(BATCH, count-start)
+        records = numpy.zeros(n, POINT)
+        records['number'] = numpy.arange(start+1, start+n+1)
+        records['length'] = 10
+        records['type'] = 1
+        records['x'] = numpy.random.uniform(4, 31, n)
+        records['y'] = numpy.random.uniform(58, 71, n)
+        yield records.tobytes()
+
+def shx(count):
+    yield header(100+count*8, (4.0, 58.0, 31.0, 71.0))
+    for start in xrange(0, count, BATCH):
+        index = numpy.zeros(min(BATCH, count-start), INDEX)
+        index['offset'] = (100+(numpy.arange(len(index))+start)*POINT.itemsize)//2
+        index['length'] = 10
+        yield index.tobytes()
+
+def dbf(count):
+    yield struct.pack('<4BI2H20x', 3, 113, 7, 30, count, 65, 11) + \
+        struct.pack('<11sc4x2B14x', 'ID', 'N', 10, 0) + '\r'
+    for start in xrange(0, count, BATCH):
+        yield ''.join(' %10d'%i for i in xrange(start, min(count, start+BATCH)))
+    yield '\x1a'
+
+def createAsset(fn, count, compression):
+    with Aptofile.create(fn,'asset',validate='on_close',
+                         compression=compression) as af:
+        af.setDescription("Layer info benchmark")
+        af.setGenerator("benchLayerInfo.py", "Aptomar AS")
+        af.addLayer('points',
+                    geometry_data=[(shp(count),'layers/points.shp'),
+                                   (shx(count),'layers/points.shx'),
+                                   (dbf(count),'layers/points.dbf')],
+                    style_data=[(bytearray('<sld/>'),'styles/points.xml')])
+        af.addGroup('group1',layers=['points'])
+
+def extracted(af, tmpdir):
+    # Extracting the shapefile to disk and reading the headers there
+    names = {}
+    for name in ['layers/points.shp','layers/points.shx','layers/points.dbf']:
+        fn = names[name[-3:]] = os.path.join(tmpdir, os.path.basename(name))
+        with af.openfile(name) as src, open(fn,'wb') as dst:
+            shutil.copyfileobj(src, dst, 2**20)
+    with open(names['shp'],'rb') as fid: h = shapefile.readHeader(fid.read(100))
+    with open(names['shx'],'rb') as fid:
+        count = shapefile.recordCount(shapefile.readHeader(fid.read(100)))
+    return h['bbox'], count
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Layer info benchmark")
+    parser.add_argument('-s', '--sizes', type=int, nargs='+',
+                        default=[1,100,1024], help="shapefile sizes in MB")
+    parser.add_argument('-r', '--repeat', type=int, default=1000,
+                        help="number of reads of the layer info")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tmpdir,'asset.apt')
+        for size in args.sizes:
+            count = size*2**20//POINT.itemsize
+            for compression in [None, 'auto']:
+                createAsset(fn, count, compression)
+                with Aptofile.open(fn,validate='none') as af:
+                    t0 = time.time()
+                    for i in xrange(args.repeat):
+                        af._layerInfo.clear()
+                        info = af.getLayerInfo('points')
+                    dt = (time.time()-t0)/args.repeat
+                    assert info['features'] == count
+                    t0 = time.time()
+                    assert extracted(af, tmpdir)[1] == count
+                    dtx = time.time()-t0
+                print "%5d MB %-7s %8d features: getLayerInfo %8.1f us, " \
+                    "extracting %8.3f s"%(size, compression or 'stored',
+                                          count, dt*1e6, dtx)
+    finally:
+        shutil.rmtree(tmpdir)
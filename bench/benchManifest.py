@@ -0,0 +1,100 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchManifest.py                                             #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of reading the manifest of an asset with many      #
+# files, through zipfile or only the entries needed            #
+#                                                              #
+################################################################
+
+import argparse
+import json
+import os,sys
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import zipfile
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+
+def zipFile(fn):
+    with zipfile.ZipFile(fn) as zf:
+        return json.loads(zf.read(Aptofile.MANIFEST_FILE))
+
+def getManifestFromFile(fn):
+    return Aptofile.getManifestFromFile(fn)
+
+def getSummaryFromFile(fn):
+    return Aptofile.getSummaryFromFile(fn)
+
+SCENARIOS = [zipFile, getManifestFromFile, getSummaryFromFile]
+
+def createAsset(fn, files, manifestFirst):
+    with Aptofile.create(fn,'asset',validate='on_close',
+                         manifestFirst=manifestFirst) as af:
+        af.setDescription("Asset with %d files"%files)
+        af.setGenerator("benchManifest.py", "Aptomar AS")
+        names = []
+        for i in xrange(files):
+            names.append('tiles/%d/%d.png'%(i//1000,i%1000))
+            af.writefile((bytearray('tile%d'%i),names[-1]))
+        # Only some of the files in the manifest, which stays small
+        af.addLayer('layer1',resources={'data':names[:100]})
+        af.addFile2Layer(names[0],'layer1','geometry',writeFile=False)
+        af.addFile2Layer(names[1],'layer1','style',writeFile=False)
+        af.addGroup('group1',layers=['layer1'])
+
+def bytesRead():
+    # Bytes read by this process, where known
+    try:
+        with open('/proc/self/io') as fid:
+            return int(dict(l.split(':') for l in fid)['rchar'])
+    except (IOError, KeyError):
+        return 0
+
+def runScenario(name, fn):
+    # Run in this process, which is started for the scenario only
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    read = bytesRead()
+    t0 = time.time()
+    dict((f.__name__,f) for f in SCENARIOS)[name](fn)
+    dt = time.time()-t0
+    read = bytesRead()-read
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print dt, (peak-base)/1024., read/1024.
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Manifest read benchmark")
+    parser.add_argument('-f', '--files', type=int, default=100000,
+                        help="number of files")
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        runScenario(args.scenario, args.file)
+        sys.exit(0)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tmpdir,'asset.apt')
+        for manifestFirst in [False, True]:
+            createAsset(fn, args.files, manifestFirst)
+            print "%d files, manifest %s:"%(
+                args.files, 'first' if manifestFirst else 'last')
+            for scenario in SCENARIOS:
+                out = subprocess.check_output([sys.executable,__file__,
+                                               '--scenario',scenario.__name__,
+                                               '--file',fn])
+                dt, rss, read = [float(v) for v in out.split()]
+                print "%-20s %8.4f s %8.1f MB peak RSS increase %10.1f kB read"%(
+                    scenario.__name__,dt,rss,read)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,61 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchNameIndex.py                                            #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of file lookups in assets with many files          #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import shutil
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+
+def createAsset(fn, files):
+    with Aptofile.create(fn,'asset',validate='on_close') as af:
+        af.setDescription("Asset with %d tiles"%files)
+        af.setGenerator("benchNameIndex.py", "Aptomar AS")
+        resources = []
+        for i in xrange(files):
+            name = 'tiles/%d/%d.png'%(i//100,i%100)
+            af.zipfile.writestr(name,'')
+            resources.append('file:'+name.replace('/','\\'))
+        af.addLayer('layer1', resources={'data':resources})
+        af.addFile2Layer('tiles/0/0.png','layer1','geometry',writeFile=False)
+        af.addFile2Layer('tiles/0/1.png','layer1','style',writeFile=False)
+        af.addGroup('group1',layers=['layer1'])
+
+def run(name, f, count):
+    t0 = time.time()
+    f()
+    dt = time.time()-t0
+    print "%-24s %8.3f s %10.1f us/file"%(name,dt,dt/count*1e6)
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Name index benchmark")
+    parser.add_argument('-f', '--files', type=int, nargs='+',
+                        default=[1000,10000,50000], help="file counts")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for files in args.files:
+            fn = os.path.join(tmpdir,'asset%d.apt'%files)
+            createAsset(fn, files)
+            print "%d files:"%files
+            with Aptofile.open(fn,validate='none') as af:
+                run('structure validation', lambda: af.validate('structure'),
+                    files)
+                assert af.getFailedTests() == [], af.getFailedTests()
+                names = af.namelist()
+                run('readfile', lambda: [af.readfile(n) for n in names], files)
+    finally:
+        shutil.rmtree(tmpdir)
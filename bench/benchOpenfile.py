@@ -0,0 +1,97 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchOpenfile.py                                             #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of peak memory and latency of reading a preview    #
+# from a large video                                           #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import zipfile
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+
+PREVIEW = 2**20
+
+def readfile(af):
+    return af.readfile('video.avi')[:PREVIEW]
+
+def openfile(af):
+    with af.openfile('video.avi') as f:
+        return f.read(PREVIEW)
+
+def readrange(af):
+    size = af.zipfile.getinfo('video.avi').file_size
+    return af.readrange('video.avi',size//2,PREVIEW)
+
+SCENARIOS = [readfile, openfile, readrange]
+
+def createVideo(fn, size, compression):
+    video = fn+'.avi'
+    block = os.urandom(2**16)
+    with open(video,'wb') as fid:
+        for i in xrange(size//len(block)):
+            # Half repeated blocks, so deflate has work to do
+            fid.write(block if i%2 else os.urandom(len(block)))
+    with Aptofile.create(fn,'video') as af:
+        af.setGenerator(program='benchOpenfile.py',creator='Aptomar AS')
+        af.setDescription('Benchmark video')
+        af.setVideoName('Video')
+        af.setVideoDescription('Video of %d MB'%(size//2**20))
+        af.setVideoGeoreference(10.4344, 63.4181, 150.60)
+        af.zipfile.compression = compression
+        af.addVideoFile((video,'video.avi'))
+    os.remove(video)
+
+def runScenario(name, fn):
+    # Run in this process, which is started for the scenario only
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.time()
+    with Aptofile.open(fn,validate='none') as af:
+        data = dict((f.__name__,f) for f in SCENARIOS)[name](af)
+    dt = time.time()-t0
+    assert len(data) == PREVIEW
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print dt, (peak-base)/1024.
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Streaming read benchmark")
+    parser.add_argument('-s', '--size', type=int, default=256,
+                        help="video size in MB")
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        runScenario(args.scenario, args.file)
+        sys.exit(0)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for compression, label in [(zipfile.ZIP_STORED,'stored'),
+                                   (zipfile.ZIP_DEFLATED,'deflated')]:
+            fn = os.path.join(tmpdir,'%s.apt'%label)
+            createVideo(fn, args.size*2**20, compression)
+            print "%s video of %d MB, reading %d kB:"%(label,args.size,
+                                                      PREVIEW//1024)
+            for scenario in SCENARIOS:
+                out = subprocess.check_output([sys.executable,__file__,
+                                               '--scenario',scenario.__name__,
+                                               '--file',fn])
+                dt, rss = [float(v) for v in out.split()]
+                print "%-10s %8.3f s %10.1f MB peak RSS increase"%(
+                    scenario.__name__,dt,rss)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,87 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchReadview.py                                             #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of reading many stored files, copied or mapped     #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import zlib
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+
+def readfile(af, names):
+    return [af.readfile(n) for n in names]
+
+def readview(af, names):
+    return [af.readview(n) for n in names]
+
+SCENARIOS = [readfile, readview]
+
+def createAsset(fn, files, size):
+    with Aptofile.create(fn,'asset',validate='on_close') as af:
+        af.setDescription("Asset with %d tiles"%files)
+        af.setGenerator("benchReadview.py", "Aptomar AS")
+        for i in xrange(files):
+            af.zipfile.writestr('tiles/%d.png'%i, os.urandom(size))
+        af.addLayer('layer1',resources={'data':['tiles/%d.png'%i
+                                                for i in xrange(files)]})
+        af.addFile2Layer('tiles/0.png','layer1','geometry',writeFile=False)
+        af.addFile2Layer('tiles/1.png','layer1','style',writeFile=False)
+        af.addGroup('group1',layers=['layer1'])
+
+def runScenario(name, fn):
+    # Run in this process, which is started for the scenario only
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with Aptofile.open(fn,validate='none') as af:
+        names = [n for n in af.namelist() if n.startswith('tiles/')]
+        t0 = time.time()
+        # Keep the data, as a pipeline holding the tiles would
+        data = dict((f.__name__,f) for f in SCENARIOS)[name](af, names)
+        dt = time.time()-t0
+        # Touch all the data
+        for d in data: zlib.crc32(d)
+        dtAll = time.time()-t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print dt, dtAll, (peak-base)/1024.
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Mapped read benchmark")
+    parser.add_argument('-f', '--files', type=int, default=200,
+                        help="number of files")
+    parser.add_argument('-s', '--size', type=int, default=1024,
+                        help="file size in kB")
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        runScenario(args.scenario, args.file)
+        sys.exit(0)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tmpdir,'asset.apt')
+        createAsset(fn, args.files, args.size*1024)
+        print "%d stored files of %d kB:"%(args.files,args.size)
+        for scenario in SCENARIOS:
+            out = subprocess.check_output([sys.executable,__file__,
+                                           '--scenario',scenario.__name__,
+                                           '--file',fn])
+            dt, dtAll, rss = [float(v) for v in out.split()]
+            print "%-10s %8.3f s read %8.3f s read+crc32 %8.1f MB peak RSS increase"%(
+                scenario.__name__,dt,dtAll,rss)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,76 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchScan.py                                                 #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of reading the manifests of many files, in a loop  #
+# and with scanner.scan()                                      #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import shutil
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+import scanner
+
+def createFiles(dirname, files):
+    # Assets of a few layers, copied to directories of 1000 files
+    fn = os.path.join(dirname,'asset.apt')
+    # With the manifest first, so the summary is in the archive comment
+    with Aptofile.create(fn,'asset',validate='on_close',
+                         manifestFirst=True) as af:
+        af.setDescription("Scan benchmark")
+        af.setGenerator("benchScan.py", "Aptomar AS")
+        for i in xrange(10):
+            af.addLayer('layer%d'%i,
+                        geometry_data=[(bytearray(os.urandom(2**14)),
+                                        'layers/layer%d.shp'%i)],
+                        style_data=[(bytearray('<sld/>'),
+                                     'styles/layer%d.xml'%i)])
+        af.addGroup('group1',layers=['layer0'])
+    for i in xrange(files):
+        sub = os.path.join(dirname,'files','%d'%(i//1000))
+        if not os.path.exists(sub): os.makedirs(sub)
+        shutil.copy(fn, os.path.join(sub,'%d.apt'%i))
+    return os.path.join(dirname,'files')
+
+def loop(path, workers, fields):
+    for fn in scanner.findFiles([path]):
+        try: Aptofile.getManifestFromFile(fn)
+        except Exception: pass
+
+def scan(path, workers, fields):
+    for result in scanner.scan([path], workers, fields): pass
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Manifest scan benchmark")
+    parser.add_argument('-f', '--files', type=int, default=10000,
+                        help="number of files")
+    parser.add_argument('-w', '--workers', type=int, nargs='+',
+                        default=[1,2,4], help="worker process counts")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = createFiles(tmpdir, args.files)
+        print "%d files:"%args.files
+        for method, workers, fields in \
+                [(loop,1,None)] + \
+                [(scan,w,None) for w in args.workers] + \
+                [(scan,w,['type','date']) for w in args.workers]:
+            t0 = time.time()
+            method(path, workers, fields)
+            dt = time.time()-t0
+            print "%-5s %d workers %-14s %8.3f s %8.0f files/s"%(
+                method.__name__, workers, ','.join(fields or ['manifest']),
+                dt, args.files/dt)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,99 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchSpatial.py                                              #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of finding files intersecting an area with a       #
+# spatial index                                                #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import shutil
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+from spatial import SpatialIndex
+import geometry
+import numpy
+
+def extents(n):
+    # Routes and points of up to 20 km along the coast of Norway
+    lon = numpy.random.uniform(4, 31, n)
+    lat = numpy.random.uniform(58, 71, n)
+    size = numpy.random.exponential(0.05, (n, 2))
+    size[::3] = 0
+    return numpy.column_stack([lon, lat, lon+size[:,0], lat+size[:,1]])
+
+def createFiles(dirname, files):
+    for i, (x0, y0, x1, y1) in enumerate(extents(files).tolist()):
+        g = geometry.Geometry('LINESTRING', [(x0, y0), (x1, y1)], srid=4326)
+        with Aptofile.create(os.path.join(dirname,'%d.apt'%i),'route',
+                             validate='on_close') as af:
+            af.setGenerator('benchSpatial.py','Aptomar AS')
+            af.setDescription('Route %d'%i)
+            af.setRouteName('Route %d'%i)
+            af.setRouteGeometry((g.iterEWKT(),'route.ewkt'))
+
+def timeQueries(f, queries):
+    t0 = time.time()
+    found = sum(len(f(q)) for q in queries)
+    return (time.time()-t0)/len(queries), found/float(len(queries))
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Spatial index benchmark")
+    parser.add_argument('-e', '--entries', type=int, default=100000,
+                        help="number of files in the index")
+    parser.add_argument('-f', '--files', type=int, default=1000,
+                        help="number of files created for update()")
+    parser.add_argument('-q', '--queries', type=int, default=1000,
+                        help="number of queries")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        numpy.random.seed(1)
+        index = SpatialIndex(os.path.join(tmpdir,'spatial.npz'))
+        boxes = extents(args.entries)
+        t0 = time.time()
+        for i, bbox in enumerate(boxes.tolist()):
+            index.add('/data/%d.apt'%i, [(None, bbox)], (0, 0))
+        index.save()
+        print "%d files: added and saved in %.3f s"%(args.entries,
+                                                       time.time()-t0)
+        t0 = time.time()
+        index = SpatialIndex(index.filename)
+        print "loaded in %.3f s"%(time.time()-t0)
+
+        for label, size in [('sea area 10 km', 0.1), ('sea area 100 km', 1.0)]:
+            corners = numpy.random.uniform((4,58), (31,71), (args.queries, 2))
+            queries = [(x, y, x+2*size, y+size) for x, y in corners.tolist()]
+            def scan(q):
+                return numpy.nonzero((boxes[:,0] <= q[2]) & (boxes[:,2] >= q[0]) &
+                                     (boxes[:,1] <= q[3]) & (boxes[:,3] >= q[1]))[0]
+            for name, f in [('R-tree query', index.query),
+                            ('numpy scan', scan)]:
+                dt, found = timeQueries(f, queries)
+                print "%-16s %-15s %8.3f ms %8.1f files found"%(
+                    label, name, dt*1000, found)
+        points = numpy.random.uniform((4,58), (31,71), (args.queries, 2))
+        dt, found = timeQueries(lambda p: index.nearby(p[0], p[1], 10000),
+                                points.tolist())
+        print "%-16s %-15s %8.3f ms %8.1f files found"%(
+            'radius 10 km', 'R-tree nearby', dt*1000, found)
+
+        os.mkdir(os.path.join(tmpdir,'files'))
+        createFiles(os.path.join(tmpdir,'files'), args.files)
+        index = SpatialIndex(os.path.join(tmpdir,'files.npz'))
+        for label in ['update', 'unchanged update']:
+            t0 = time.time()
+            index.update([os.path.join(tmpdir,'files')])
+            print "%d files: %-16s %8.3f s"%(args.files, label, time.time()-t0)
+    finally:
+        shutil.rmtree(tmpdir)
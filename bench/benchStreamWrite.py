@@ -0,0 +1,84 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchStreamWrite.py                                          #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of writing a video produced in memory, through a   #
+# temporary file or streamed                                   #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+
+CHUNK = 2**16
+
+def capture(size):
+    # Video frames as they come from the capture process
+    frame = os.urandom(CHUNK)
+    for i in xrange(size//CHUNK):
+        yield frame
+
+def tempFile(af, size, tmpdir):
+    fn = os.path.join(tmpdir,'capture.avi')
+    with open(fn,'wb') as fid:
+        for frame in capture(size): fid.write(frame)
+    af.addVideoFile((fn,'video.avi'))
+    os.remove(fn)
+
+def stream(af, size, tmpdir):
+    af.addVideoFile((capture(size),'video.avi'))
+
+SCENARIOS = [tempFile, stream]
+
+def runScenario(name, size, tmpdir):
+    # Run in this process, which is started for the scenario only
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.time()
+    with Aptofile.create(os.path.join(tmpdir,'video.apt'),'video') as af:
+        af.setGenerator(program='benchStreamWrite.py',creator='Aptomar AS')
+        af.setDescription('Benchmark video')
+        af.setVideoName('Video')
+        af.setVideoDescription('Captured video')
+        af.setVideoGeoreference(10.4344, 63.4181, 150.60)
+        dict((f.__name__,f) for f in SCENARIOS)[name](af, size, tmpdir)
+    dt = time.time()-t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print dt, (peak-base)/1024.
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Stream write benchmark")
+    parser.add_argument('-s', '--size', type=int, default=512,
+                        help="video size in MB")
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        runScenario(args.scenario, args.size*2**20, args.dir)
+        sys.exit(0)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print "video of %d MB:"%args.size
+        for scenario in SCENARIOS:
+            out = subprocess.check_output([sys.executable,__file__,
+                                           '--scenario',scenario.__name__,
+                                           '--size',str(args.size),
+                                           '--dir',tmpdir])
+            dt, rss = [float(v) for v in out.split()]
+            print "%-10s %8.3f s %8.1f MB peak RSS increase"%(
+                scenario.__name__,dt,rss)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,81 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchUpdate.py                                               #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of changing the description of a large asset, by   #
+# rewriting all files or with Aptofile.update()                #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import random
+import shutil
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+
+def createAsset(fn, layers, size, tmpdir):
+    src = os.path.join(tmpdir,'layer.shp')
+    # Records of numbers, compressing like real attribute data. Blocks
+    # are repeated further apart than deflate can see.
+    blocks = [''.join('%12.6f'%random.gauss(0,100) for j in xrange(2**20//12))
+              for k in xrange(8)]
+    with Aptofile.create(fn,'asset',validate='on_close',
+                         compression='auto') as af:
+        af.setDescription("Update benchmark")
+        af.setGenerator("benchUpdate.py", "Aptomar AS")
+        for i in xrange(layers):
+            with open(src,'wb') as fid:
+                for j in xrange(size//2**20): fid.write(random.choice(blocks))
+            af.addLayer('layer%d'%i,
+                        geometry_data=[(src,'layers/layer%d.shp'%i)],
+                        style_data=[(bytearray('<sld/>'),
+                                     'styles/layer%d.xml'%i)])
+        af.addGroup('group1',layers=['layer0'])
+    os.remove(src)
+
+def rewrite(fn, dst):
+    # Read every file and write it to a new archive
+    with Aptofile.open(fn,validate='none') as af:
+        manifest = af.getManifest()
+        with Aptofile.create(dst,'asset',validate='on_close',
+                             compression='auto') as new:
+            for name in af.namelist():
+                if name == Aptofile.MANIFEST_FILE: continue
+                new.writefile((bytearray(af.readfile(name)),name))
+            new.manifest = manifest
+            new.setDescription("Rewritten")
+    os.rename(dst, fn)
+
+def update(fn, dst):
+    with Aptofile.update(fn) as af:
+        af.setDescription("Updated")
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Update benchmark")
+    parser.add_argument('-l', '--layers', type=int, default=64,
+                        help="number of layers")
+    parser.add_argument('-s', '--size', type=int, default=4,
+                        help="size of each shapefile in MB")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tmpdir,'asset.apt')
+        createAsset(fn, args.layers, args.size*2**20, tmpdir)
+        print "asset of %d layers, %d MB of files, %.1f MB compressed"%(
+            args.layers, args.layers*args.size, os.path.getsize(fn)/2.**20)
+        for method in [rewrite, update]:
+            t0 = time.time()
+            method(fn, os.path.join(tmpdir,'new.apt'))
+            print "%-8s %8.3f s"%(method.__name__,time.time()-t0)
+            assert Aptofile.validateFile(fn)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,69 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchValidateFiles.py                                        #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of validating many files with validateFile.py, a   #
+# process per file or all files in one run                     #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import shutil
+import subprocess
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+
+TOOL = os.path.join(BENCHDIR,'..','src','validateFile.py')
+
+def createFiles(dirname, files):
+    names = []
+    for i in xrange(files):
+        fn = os.path.join(dirname,'point%d.apt'%i)
+        with Aptofile.create(fn,'point') as af:
+            af.setGenerator('benchValidateFiles.py','Aptomar AS')
+            af.setDescription('Point %d'%i)
+            af.setPointName('Point %d'%i)
+            af.setPointType('boat')
+            af.setPointGeometry('data:data_describing_the_point')
+        names.append(fn)
+    return names
+
+def runTool(*args):
+    with open(os.devnull,'w') as null:
+        subprocess.check_call([sys.executable,TOOL]+list(args),
+                              stdout=null, stderr=null)
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Batch validation benchmark")
+    parser.add_argument('-f', '--files', type=int, default=500,
+                        help="number of files")
+    parser.add_argument('-j', '--jobs', type=int, nargs='+', default=[2,4],
+                        help="worker process counts")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        names = createFiles(tmpdir, args.files)
+        print "%d files:"%args.files
+        runs = [('process per file', None)]
+        runs += [('batch -j %d'%j, ['-j',str(j),tmpdir]) for j in [1]+args.jobs]
+        cache = os.path.join(tmpdir,'cache')
+        runs += [('batch, cache miss', ['--cache',cache,tmpdir]),
+                 ('batch, cache hit', ['--cache',cache,tmpdir])]
+        for label, toolArgs in runs:
+            t0 = time.time()
+            if toolArgs is None:
+                for fn in names: runTool(fn)
+            else: runTool(*toolArgs)
+            dt = time.time()-t0
+            print "%-18s %8.3f s %8.1f files/s"%(label,dt,args.files/dt)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,55 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchValidation.py                                           #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of manifest validation throughput                  #
+#                                                              #
+################################################################
+
+import argparse
+import glob
+import json
+import os,sys
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+import jsonschema
+
+def loadManifests():
+    manifests = []
+    for fn in sorted(glob.glob(os.path.join(BENCHDIR,'..','extras','tests',
+                                            'valid','*.json'))):
+        with open(fn) as fid:
+            manifests.append(json.load(fid))
+    return manifests
+
+def perCall(manifest):
+    jsonschema.validate(manifest, Aptofile.SCHEMA, Aptofile.VALIDATOR,
+                        format_checker = jsonschema.FormatChecker())
+
+def registry(manifest):
+    Aptofile.getValidator().validate(manifest)
+
+def run(name, f, manifests, count):
+    t0 = time.time()
+    for i in xrange(count):
+        f(manifests[i%len(manifests)])
+    dt = time.time()-t0
+    print "%-12s %8d manifests %8.3f s %10.1f manifests/s"%(name,count,dt,count/dt)
+    return count/dt
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Manifest validation benchmark")
+    parser.add_argument('-n', '--count', type=int, default=500,
+                        help="number of manifests to validate")
+    args = parser.parse_args()
+
+    manifests = loadManifests()
+    before = run('per-call', perCall, manifests, args.count)
+    after = run('registry', registry, manifests, args.count)
+    print "speedup: %.1fx"%(after/before)
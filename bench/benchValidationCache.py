@@ -0,0 +1,65 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchValidationCache.py                                      #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of validating files again, with and without a      #
+# ValidationCache                                              #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import shutil
+import tempfile
+import time
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+from aptofile import Aptofile
+from validationcache import ValidationCache
+
+def createFiles(dirname, files, layers, size):
+    fns = []
+    for i in xrange(files):
+        fns.append(os.path.join(dirname,'asset%d.apt'%i))
+        with Aptofile.create(fns[-1],'asset',validate='on_close') as af:
+            af.setDescription("Validation cache benchmark")
+            af.setGenerator("benchValidationCache.py", "Aptomar AS")
+            for j in xrange(layers):
+                af.addLayer('layer%d'%j,
+                            geometry_data=[(bytearray(os.urandom(size)),
+                                            'layers/layer%d.shp'%j)],
+                            style_data=[(bytearray('<sld/>'),
+                                         'styles/layer%d.xml'%j)])
+            af.addGroup('group1',layers=['layer0'])
+    return fns
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Validation cache benchmark")
+    parser.add_argument('-f', '--files', type=int, default=50,
+                        help="number of files")
+    parser.add_argument('-l', '--layers', type=int, default=50,
+                        help="number of layers of each file")
+    parser.add_argument('-s', '--size', type=int, default=256,
+                        help="size of each shapefile in kB")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fns = createFiles(tmpdir, args.files, args.layers, args.size*1024)
+        print "%d files of %d layers with %d kB shapefiles:"%(
+            args.files, args.layers, args.size)
+        cache = ValidationCache(os.path.join(tmpdir,'cache'))
+        for name, c in [('no cache',None),('cache miss',cache),
+                        ('cache hit',cache)]:
+            t0 = time.time()
+            for fn in fns: assert Aptofile.validateFile(fn, c)
+            dt = time.time()-t0
+            print "%-10s %8.3f s %8.1f ms/file"%(name, dt, 1000*dt/len(fns))
+        print cache.getStatistics()
+        cache.close()
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,66 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# benchVerify.py                                               #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Benchmark of archive member CRC verification                 #
+#                                                              #
+################################################################
+
+import argparse
+import os,sys
+import shutil
+import tempfile
+import time
+import zipfile
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHDIR,'..','src'))
+import ziptools
+
+def createArchive(fn, members, size, compression):
+    block = os.urandom(2**16)
+    with zipfile.ZipFile(fn,'w',compression,allowZip64=True) as zf:
+        for i in xrange(members):
+            # Half random, half repeated data, so deflate has work to do
+            data = (block*(size//len(block)+1))[:size//2] + \
+                   os.urandom(size-size//2)
+            zf.writestr('member%d'%i, data)
+
+def run(name, f, before=None):
+    t0 = time.time()
+    f()
+    dt = time.time()-t0
+    print "%-14s %8.3f s %8.1fx"%(name,dt,(before or dt)/dt)
+    return dt
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Member verification benchmark")
+    parser.add_argument('-m', '--members', type=int, default=32,
+                        help="number of members")
+    parser.add_argument('-s', '--size', type=int, default=8,
+                        help="member size in MB")
+    parser.add_argument('-w', '--workers', type=int, nargs='+',
+                        default=[1,2,4,8], help="worker counts")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for compression, label in [(zipfile.ZIP_STORED,'stored'),
+                                   (zipfile.ZIP_DEFLATED,'deflated')]:
+            fn = os.path.join(tmpdir,'%s.zip'%label)
+            createArchive(fn, args.members, args.size*2**20, compression)
+            print "%s: %d members of %d MB"%(label,args.members,args.size)
+            with zipfile.ZipFile(fn) as zf:
+                before = run('testzip', zf.testzip)
+                for workers in args.workers:
+                    for processes in [False,True]:
+                        name = '%d %s'%(workers,
+                                        'processes' if processes else 'threads')
+                        run(name, lambda: ziptools.verifyMembers(
+                                zf, workers=workers, processes=processes),
+                            before)
+    finally:
+        shutil.rmtree(tmpdir)
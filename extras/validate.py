@@ -6,9 +6,13 @@
 #
 # This is a simple tool to validate a json manifest file against a json schema.
 
-from jsonschema import validate, Draft4Validator, SchemaError
 import argparse
 import json
+import os,sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+from jsonschema import SchemaError
+from aptofile import Aptofile
 
 
 parser = argparse.ArgumentParser(description='Validate a JSON file against a schema.')
@@ -23,7 +27,7 @@ schema_obj = json.loads(args.schema.read())
 
 good = False
 try:
-	Draft4Validator.check_schema(schema_obj)
+	validator = Aptofile.getValidator(schema_obj)
 except SchemaError as err:
 	print "Schema has an error:"
 	print err
@@ -33,7 +37,7 @@ else:
 
 if good:
 	try:
-		validate(json_obj, schema_obj, Draft4Validator)
+		validator.validate(json_obj)
 	except Exception as inst:
 		print "Error validating"
 		print inst
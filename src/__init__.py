@@ -1,6 +1,11 @@
 
 from aptofile import Aptofile, Assetfile, Imagefile, Videofile, Pointfile, Routefile, Areafile
+from validationcache import ValidationCache
+from scanner import scan
+from catalog import Catalog
+from spatial import SpatialIndex
 
 __all__ = [ 'Aptofile', 'Assetfile', 'Imagefile', 'Videofile', 'Pointfile',
-            'Routefile', 'Areafile']
+            'Routefile', 'Areafile', 'ValidationCache', 'scan', 'Catalog',
+            'SpatialIndex']
 
@@ -11,11 +11,23 @@
 #from __future__ import unicode_literals
 
 import jsonschema
+import ziptools
+import geometry
+import shapefile
+import worldfile
 import json
 import zipfile
 import sys,os
 import time
 import logging
+import hashlib
+import threading
+import tempfile
+import multiprocessing.pool
+import contextlib
+import copy
+import base64
+import urllib
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -44,27 +56,264 @@ def testCase(f):
 def writingMethod(f):
     """
     Decorator for methods that changes the manifest
+
+    The file is validated after the change, unless validation is
+    deferred (see Aptofile.batch()) or the method is called from another
+    writing method. Deferred calls return the last known valid status.
+
+    Methods tell which parts of the manifest they change with
+    self._touch(), so only those parts are validated again. A method
+    that does not call self._touch() causes a full validation.
+
+    Writing methods hold the lock of the file, so they may be called
+    from several threads.
     """
     def decorated(self,*args,**args2):
         self._assureWritable()
-        ret = f(self,*args,**args2)
-        if ret!=None: return ret
-        else: return self.validate()
+        with self._lock:
+            self._writeDepth += 1
+            touched, self._touched = self._touched, False
+            try:
+                ret = f(self,*args,**args2)
+            finally:
+                self._writeDepth -= 1
+                if not self._touched: self._dirty = None
+                self._touched = touched or self._touched
+            if ret!=None: return ret
+            elif self._validationDeferred(): return self.valid
+            else: return self._revalidate()
+    decorated.__name__ = f.__name__
+    decorated.__doc__ = f.__doc__
     return decorated
 
+class ValidatorRegistry(object):
+    """
+    Registry of prebuilt schema validators
+
+    Validators are keyed by a hash of the schema content. A schema is
+    checked against the meta schema only once, and compiled into a
+    jsonschema.CompiledValidator with its refs resolved and its format
+    checker attached. The validator keeps no state while validating
+    and is shared by all threads. Registered schemas should not be
+    modified.
+    """
+
+    def __init__(self, cls=jsonschema.Draft4Validator):
+        self.cls = cls
+        self._validators = {}
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def schemaHash(schema):
+        """
+        Return a hash of the schema content
+        """
+        return hashlib.sha1(json.dumps(schema,sort_keys=True)).hexdigest()
+
+    def _key(self, schema):
+        # Hashing the schema is costly, remember the hash of known objects.
+        # The schema object is kept with the hash so its id is not reused.
+        known = self._hashes.get(id(schema))
+        if known is not None and known[0] is schema:
+            return known[1]
+        key = self.schemaHash(schema)
+        self._hashes[id(schema)] = (schema,key)
+        return key
+
+    def register(self, schema):
+        """
+        Check the schema and register it
+
+        Raises jsonschema.SchemaError if the schema is invalid.
+        Returns the key of the schema.
+        """
+        key = self._key(schema)
+        if key not in self._validators:
+            with self._lock:
+                if key not in self._validators:
+                    self._validators[key] = jsonschema.compile_validator(
+                        schema, self.cls,
+                        format_checker=jsonschema.FormatChecker())
+        return key
+
+    def get(self, schema):
+        """
+        Return a validator for the schema, checking the schema if needed
+        """
+        return self._validators[self.register(schema)]
+
+    def getPartitioned(self, schema, partitions):
+        """
+        Return a PartitionedValidator for the schema and partitions
+        """
+        key = (self.register(schema), tuple(tuple(p) for p in partitions))
+        validator = self._validators.get(key)
+        if validator is None:
+            with self._lock:
+                validator = self._validators.get(key)
+                if validator is None:
+                    validator = PartitionedValidator(schema, partitions, self.cls)
+                    self._validators[key] = validator
+        return validator
+
+    def clear(self):
+        """
+        Forget all registered schemas and validators
+        """
+        with self._lock:
+            self._validators.clear()
+            self._hashes.clear()
+
+class PartitionedValidator(object):
+    """
+    Schema validation of a manifest in parts
+
+    A partition is the manifest path of an object whose children are
+    validated one by one, e.g. ('asset','layers'). The rest of the
+    manifest is validated as one part (the shell). The validator keeps
+    no results itself; they are kept in a state object owned by the
+    file, see newState() and validate().
+
+    Partitions must be declared with inline 'properties' in the schema.
+    """
+
+    # Keywords of a partition object validated per child
+    CHILD_KEYWORDS = ['properties','patternProperties','additionalProperties']
+
+    def __init__(self, schema, partitions, cls=jsonschema.Draft4Validator):
+        root = jsonschema.CompiledValidator(schema, cls,
+                                            format_checker=jsonschema.FormatChecker())
+        shellSchema = copy.deepcopy(schema)
+        self.partitions = []
+        for path in partitions:
+            path = tuple(path)
+            container = self._subschema(schema, path)
+            childSchema = {'type':'object'}
+            containerSchema = {}
+            for k, v in container.iteritems():
+                if k in PartitionedValidator.CHILD_KEYWORDS: childSchema[k] = v
+                else: containerSchema[k] = v
+            # The shell accepts anything for the partition
+            self._subschema(shellSchema, path).clear()
+            self.partitions.append((path,
+                                    root.compile_subschema(containerSchema),
+                                    root.compile_subschema(childSchema)))
+        self.shell = jsonschema.CompiledValidator(shellSchema, cls,
+                                                  format_checker=jsonschema.FormatChecker())
+
+    @staticmethod
+    def _subschema(schema, path):
+        for key in path:
+            try:
+                schema = schema['properties'][key]
+            except KeyError:
+                raise Exception("No inline schema for partition %s"%(path,))
+        return schema
+
+    @staticmethod
+    def _prefixed(errors, path):
+        for error in errors:
+            error.path.extendleft(reversed(path))
+        return errors
+
+    def newState(self):
+        """
+        Return an empty state, meaning everything must be validated
+        """
+        return {'shell': None,
+                'containers': [() for p in self.partitions],
+                'children': [{} for p in self.partitions]}
+
+    def validate(self, manifest, state, changes=None):
+        """
+        Validate the manifest and return a list of errors
+
+        changes is a set of changed manifest paths since state was
+        updated, or None if anything may have changed.
+        """
+        full = changes is None or state['shell'] is None
+        if full or [p for p in changes if not self._inChild(p)]:
+            state['shell'] = list(self.shell.iter_errors(manifest))
+
+        errors = list(state['shell'])
+        for i, (path, containerCheck, childCheck) in enumerate(self.partitions):
+            children = state['children'][i]
+            container = manifest
+            for key in path:
+                container = container.get(key) if isinstance(container,dict) else None
+            if not isinstance(container,dict):
+                state['containers'][i] = ()
+                children.clear()
+                continue
+
+            state['containers'][i] = self._prefixed(containerCheck(container), path)
+            keys = None if full else Aptofile._changedKeys(changes, path)
+            if keys is None:
+                children.clear()
+                keys = container.keys()
+            for key in keys:
+                if key in container:
+                    found = childCheck({key: container[key]})
+                    if found: children[key] = self._prefixed(found, path)
+                    else: children.pop(key,None)
+                else: children.pop(key,None)
+
+            errors.extend(state['containers'][i])
+            if children:
+                for key in container:
+                    errors.extend(children.get(key,()))
+        return errors
+
+    def _inChild(self, changed):
+        for path, containerCheck, childCheck in self.partitions:
+            if len(changed) > len(path) and changed[:len(path)] == path:
+                return True
+        return False
+
 def stripFileName(fn):
     if fn.startswith('file:'):
         fn = fn[5:]
     return fn.lstrip('/').lstrip('\\')
 
-class Aptofile:
+def readDataURL(url):
+    """
+    Return the data of a data: URL
+
+    Data without a media type and comma, e.g. 'data:POINT(10 63)', is
+    taken as it is.
+    """
+    data = url[5:]
+    header, comma, rest = data.partition(',')
+    if not comma or '(' in header or ' ' in header: return data
+    if header.endswith(';base64'): return base64.b64decode(rest)
+    return urllib.unquote(rest)
+
+def canonicalName(fn):
+    """
+    Return the name used for looking up fn in an archive, stripped and
+    with '/' as path separator
+    """
+    return stripFileName(fn).replace('\\','/')
+
+def _sameFile(a, b):
+    # Also for links to the file, where the platform has samefile()
+    if not isinstance(a, basestring) or not isinstance(b, basestring):
+        return False
+    if os.path.abspath(a) == os.path.abspath(b): return True
+    try:
+        return os.path.samefile(a, b)
+    except (AttributeError, OSError):
+        return False
+
+class Aptofile(object):
     """
     Super class for Aptomar files
 
     IMPORTANT: Files in an archive cannot be updated, hence the files
     should be fully created before closing the files. If update is needed
-    the content should be read from file, updated and then written to a
-    new file. Since every change to the archive means an update of the
+    use update(), which writes a new archive, copying the unchanged files
+    as they are. Since every change to the archive means an update of the
     manifest, this opening files with other modes than 'r' or 'w' is
     not supported.
 
@@ -73,17 +322,50 @@ class Aptofile:
     """
 
     MANIFEST_FILE = 'manifest.json'
+    # Space reserved for the manifest as the first file, see create()
+    MANIFEST_RESERVE = 2**16
     SCHEMA_FILE = 'apt.schema.json'
     VALIDATOR = jsonschema.Draft4Validator
 
     FILETYPES = ['asset','image','video','point','route','area']
+    # Type of the file, set by each subclass
+    FILETYPE = None
+    VALIDATE_MODES = ['always','on_close']
+    # Validation depths, each including the checks of the previous ones
+    DEPTHS = ['none','manifest','structure','full']
+
+    # Manifest objects whose children are validated separately
+    PARTITIONS = []
+
+    # Member verification: number of workers (None for one per core),
+    # process pool instead of thread pool, stop at the first bad member
+    VERIFY_WORKERS = None
+    VERIFY_PROCESSES = False
+    VERIFY_FAIL_FAST = False
+
+    # Number of threads compressing files (None for one per core)
+    COMPRESS_WORKERS = None
+
+    # Use the ZIP64 extensions for files over 2 GB and archives over
+    # 65535 files or 2 GB. Without, such archives raise LargeZipFile.
+    ALLOW_ZIP64 = True
 
     schema_file = os.path.join(os.path.dirname(__file__),SCHEMA_FILE)
     with open(schema_file) as fid:
         SCHEMA = json.load(fid)
 
+    REGISTRY = ValidatorRegistry(VALIDATOR)
+
     @staticmethod
-    def validateFile(filename):
+    def getValidator(schema=None):
+        """
+        Return the shared validator for schema (default: Aptofile.SCHEMA)
+        """
+        if schema is None: schema = Aptofile.SCHEMA
+        return Aptofile.REGISTRY.get(schema)
+
+    @staticmethod
+    def validateFile(filename,cache=None,details=False):
         """
         Validate an aptomar file
 
@@ -96,20 +378,70 @@ class Aptofile:
         (testname, exception) where exception is the exception
         raised by the method testname.
 
+        With details, (valid, failedTests) is returned instead, where a
+        file that could not be opened fails the test 'open'.
+
+        With a ValidationCache, a file validated before is not validated
+        again while unchanged. The errors are then from cache.get().
         """
-        try:
-            with Aptofile.open(filename) as af:
-                return af.validate()
-        except Exception as e:
-            return False
+        cached = None
+        if cache is not None:
+            try:
+                fingerprint = cache.fingerprint(filename)
+                cached = cache.get(filename,fingerprint=fingerprint)
+            except OSError as e:
+                cached = False, [('open',e)]
+        if cached is None:
+            try:
+                with Aptofile.open(filename,validate='none') as af:
+                    valid = af.validate()
+                    failed = af.getFailedTests()
+            except Exception as e:
+                valid, failed = False, [('open',e)]
+            if cache is not None:
+                cache.put(filename,valid,failed,fingerprint=fingerprint)
+            cached = valid, failed
+        if details: return cached
+        return cached[0]
 
     @staticmethod
     def getManifestFromFile(filename):
-        with zipfile.ZipFile(filename) as zf:
-            return json.loads(zf.read(Aptofile.MANIFEST_FILE))
+        """
+        Read the manifest of a file
+
+        Only the end of the archive and its entry for the manifest are
+        read, not the whole central directory, so this is fast for files
+        with many files. See ziptools.findMember().
+        """
+        with open(filename,'rb') as fp:
+            zinfo = ziptools.findMember(fp, Aptofile.MANIFEST_FILE)
+            if zinfo is None:
+                raise KeyError("There is no item named %r in the archive"%
+                               Aptofile.MANIFEST_FILE)
+            return json.loads(ziptools.readMember(fp, zinfo))
 
     @staticmethod
-    def open(filename,mode='r'):
+    def getSummaryFromFile(filename):
+        """
+        Read the summary of a file from the archive comment
+
+        Returns a dict with the file type, date and manifest_version, or
+        None for files without a summary. Only the end of the file is read.
+        """
+        with open(filename,'rb') as fp:
+            return Aptofile._parseSummary(ziptools.endRecord(fp)[3])
+
+    @staticmethod
+    def _parseSummary(comment):
+        try:
+            summary = json.loads(comment)
+        except ValueError:
+            return None
+        if isinstance(summary,dict) and summary.has_key('type'): return summary
+        return None
+
+    @staticmethod
+    def open(filename,mode='r',validate='full'):
         """
         Open an existing file.
 
@@ -117,7 +449,18 @@ class Aptofile:
         which is found by reading the manifest.
 
         Only currently supported mode is 'r', since zipfile content
-        cannot be updated. For creating a new file, use Aptofile.create().
+        cannot be updated. For creating a new file, use Aptofile.create(),
+        for changing a file, use Aptofile.update().
+
+        validate is the depth of validation done when opening the file:
+        'none'       No validation. The valid attribute is computed
+                     by a full validation when first read.
+        'manifest'   The manifest and its content.
+        'structure'  As 'manifest', and that the files referenced
+                     by the manifest exist in the archive.
+        'full'       As 'structure', and the CRC of every file in
+                     the archive (default).
+        Later calls to validate() use the same depth by default.
 
         Supports the 'with' statement:
         with Aptofile.open(fn) as fid:
@@ -125,32 +468,27 @@ class Aptofile:
         """
         if mode == 'w':
             raise Exception("Use Aptofile.create() to create new file")
+        if validate not in Aptofile.DEPTHS:
+            raise Exception("Invalid validation depth: %s"%validate)
 
 
-        zf = zipfile.ZipFile(filename)
+        zf = zipfile.ZipFile(filename,allowZip64=Aptofile.ALLOW_ZIP64)
         try:
             manifest = json.loads(zf.read(Aptofile.MANIFEST_FILE))
         except Exception as e:
             zf.close()
             raise e
 
-        if manifest.has_key('asset'):
-            return Assetfile(zf,manifest)
-        if manifest.has_key('image'):
-            return Imagefile(zf,manifest)
-        if manifest.has_key('video'):
-            return Videofile(zf,manifest)
-        if manifest.has_key('point'):
-            return Pointfile(zf,manifest)
-        if manifest.has_key('route'):
-            return Routefile(zf,manifest)
-        if manifest.has_key('area'):
-            return Areafile(zf,manifest)
-        zf.close()
-        raise NotImplementedError("File type not implemented")
+        try:
+            cls = Aptofile._fileClass(manifest)
+        except Exception as e:
+            zf.close()
+            raise e
+        return cls(zf,manifest,validate)
 
     @staticmethod
-    def create(filename,fileType,**args):
+    def create(filename,fileType,validate='always',compression=None,
+               writeWorkers=None,dedup=False,manifestFirst=False,**args):
         """
         Create a new file
 
@@ -160,13 +498,44 @@ class Aptofile:
         to the archive until close(). Hence, close() is vital and
         the use of 'with' statement is adviced.
 
+        validate is 'always' (default) for validating the file after
+        every change, or 'on_close' for validating only when the file
+        is closed. Use batch() to defer validation for a group of changes.
+
+        compression is None (default) for storing files uncompressed, 'auto'
+        for compressing by the default rules of CompressionPolicy, or a
+        dict of rules added to these (e.g. {'.dbf':9, 'image':'auto'}).
+        Large files are compressed in blocks by COMPRESS_WORKERS threads.
+
+        writeWorkers is None (default) for writing files when they are
+        added, or a number of threads reading and compressing files in
+        the background. Files are then written in the order they were
+        added, and close() waits for them and raises an IOError listing
+        the files that could not be written. See also flush().
+
+        With dedup, an asset stores files with the same content once,
+        and layers adding such a file refer to the first one in the
+        manifest. See Assetfile.getDedupSummary().
+
+        With manifestFirst, space is reserved for the manifest as the first
+        file in the archive, so readers get it from the start of the file.
+        The space is MANIFEST_RESERVE bytes, or manifestFirst bytes if it
+        is a number, and the manifest is padded with spaces. A manifest
+        larger than this is written last, as without manifestFirst.
+        The type and date of the file are then also written to the archive
+        comment, see getSummaryFromFile(). Without manifestFirst, the
+        archive has no comment, and update() keeps the comment of the file
+        updated, rewriting it only if it is a summary.
+
         Supports the 'with' statement:
         with Aptofile.create(fn,type) as fid:
             # Add content
         """
         if fileType not in Aptofile.FILETYPES:
             raise Exception("Invalid filetype: %s"%fileType)
-        zf = zipfile.ZipFile(filename,"w",zipfile.ZIP_STORED)
+        Aptofile._checkWriting(fileType,validate,dedup)
+        zf = zipfile.ZipFile(filename,"w",zipfile.ZIP_STORED,
+                             allowZip64=Aptofile.ALLOW_ZIP64)
         manifest={}
         manifest['description']=args.get('description','')
         manifest['generator']=args.get('generator',{})
@@ -182,15 +551,109 @@ class Aptofile:
         manifest['date']=args.get('date',d)
         manifest[fileType] = {}
 
-        if fileType=='asset': return Assetfile(zf,manifest)
-        elif fileType=='image': return Imagefile(zf,manifest)
-        elif fileType=='video': return Videofile(zf,manifest)
-        elif fileType=='point': return Pointfile(zf,manifest)
-        elif fileType=='route': return Routefile(zf,manifest)
-        elif fileType=='area': return Areafile(zf,manifest)
+        if fileType=='asset': af = Assetfile(zf,manifest)
+        elif fileType=='image': af = Imagefile(zf,manifest)
+        elif fileType=='video': af = Videofile(zf,manifest)
+        elif fileType=='point': af = Pointfile(zf,manifest)
+        elif fileType=='route': af = Routefile(zf,manifest)
+        elif fileType=='area': af = Areafile(zf,manifest)
+        else:
+            zf.close()
+            return None
+        af._setWriting(validate,compression,writeWorkers,dedup,manifestFirst)
+        return af
 
-        zf.close()
-        return None
+    @staticmethod
+    def update(filename,dst=None,validate='always',compression=None,
+               writeWorkers=None,dedup=False,manifestFirst=False):
+        """
+        Open an existing file for changes
+
+        Returns an instance of the proper subclass, with the writing
+        methods as after create(). The changed file is written to a new
+        archive dst, or when dst is None or names filename, to a temporary
+        file replacing filename when closed. filename is left unchanged if
+        close() fails.
+
+        Files added are written as by create(). Files of filename can be
+        read and are found by the validation as before. On close(), the
+        files that were not replaced are copied to the new archive as
+        they are, without decompressing them, and the new manifest is
+        written. Changing the manifest only is hence as fast as copying
+        the archive. The files copied are not verified, validate filename
+        for that.
+
+        validate, compression, writeWorkers, dedup and manifestFirst are
+        as for create(), and apply to the files added.
+
+        with Aptofile.update(fn) as af:
+            af.setDescription('New description')
+        """
+        src = zipfile.ZipFile(filename,allowZip64=Aptofile.ALLOW_ZIP64)
+        try:
+            manifest = json.loads(src.read(Aptofile.MANIFEST_FILE))
+            cls = Aptofile._fileClass(manifest)
+            Aptofile._checkWriting(cls.FILETYPE,validate,dedup)
+        except Exception as e:
+            src.close()
+            raise e
+        if dst is not None and _sameFile(dst,filename): dst = None
+        if dst is None:
+            fd, dst = tempfile.mkstemp(suffix='.apt',
+                          dir=os.path.dirname(os.path.abspath(filename)))
+            os.close(fd)
+            replace = filename
+        else: replace = None
+        zf = None
+        try:
+            zf = zipfile.ZipFile(dst,"w",zipfile.ZIP_STORED,
+                                 allowZip64=Aptofile.ALLOW_ZIP64)
+            af = cls(zf,manifest,'none')
+        except Exception as e:
+            if zf is not None: zf.close()
+            src.close()
+            if replace: os.remove(dst)
+            raise e
+        af._source = src
+        for zinfo in src.infolist():
+            if zinfo.filename != Aptofile.MANIFEST_FILE:
+                af._sourceIndex[canonicalName(zinfo.filename)] = zinfo
+        af._replaceFile = replace
+        af._setWriting(validate,compression,writeWorkers,dedup,manifestFirst)
+        if validate == 'always': af.valid = af.validate()
+        return af
+
+    @staticmethod
+    def _fileClass(manifest):
+        for cls in [Assetfile,Imagefile,Videofile,Pointfile,Routefile,Areafile]:
+            if manifest.has_key(cls.FILETYPE): return cls
+        raise NotImplementedError("File type not implemented")
+
+    @staticmethod
+    def _checkWriting(fileType,validate,dedup):
+        if validate not in Aptofile.VALIDATE_MODES:
+            raise Exception("Invalid validate mode: %s"%validate)
+        if dedup and fileType != 'asset':
+            raise Exception("Deduplication is only supported for assets")
+
+    def _setWriting(self,validate,compression,writeWorkers,dedup,
+                    manifestFirst=False):
+        self._manifestFirst = bool(manifestFirst)
+        if manifestFirst:
+            # Before any other file
+            size = self.MANIFEST_RESERVE if manifestFirst is True \
+                else manifestFirst
+            self._manifestSlot = ziptools.reserveMember(
+                self.zipfile, Aptofile.MANIFEST_FILE, size)
+        if compression == 'auto': policy = ziptools.CompressionPolicy()
+        elif compression: policy = ziptools.CompressionPolicy(compression)
+        else: policy = None
+        self.validateMode = validate
+        self.compression = policy
+        if dedup: self.dedup = True
+        if writeWorkers:
+            pool = self._pool() if policy is not None else None
+            self._writer = ziptools.AsyncWriter(self.zipfile, writeWorkers, pool)
 
     # Methods for checking filetype, overriden by subclass
     def isAssetfile(self): return False
@@ -200,12 +663,12 @@ class Aptofile:
     def isRoutefile(self): return False
     def isAreafile(self): return False
 
-    def __init__(self,zipfile,manifest=None):
+    def __init__(self,zipfile,manifest=None,depth='full'):
         """
         Initialise the file instance.
 
         zipfile should be an opened zipfile instance. Only currently supported
-        modes are 'r' and 'w'.
+        modes are 'r' and 'w'. depth is the validation depth, see open().
         """
         self.zipfile = zipfile
         self.filename = zipfile.filename
@@ -222,21 +685,65 @@ class Aptofile:
             if self.mode in 'r':
                 self._readManifest()
             else: raise Exception("Manifest needed when mode!='r'")
+        self.validateMode = 'always'
+        self._lock = threading.RLock()
+        self._writeDepth = 0
+        self._batchDepth = 0
+        self._touched = False
+        self._dirty = None
+        self._changes = None
+        self._schemaState = None
+        self._testedMembers = 0
+        self._names = []
+        self._nameIndex = {}
+        self._archiveMaps = {}
+        self._source = None
+        self._sourceIndex = {}
+        self._replaceFile = None
+        self._manifestSlot = None
+        self._manifestFirst = False
+        self.compression = None
+        self._compressPool = None
+        self._writer = None
+        self.memberChecks = []
+        self.depth = depth
         self.failedTests = []
-        self.valid = self.validate()
+        self._valid = None
+        if depth != 'none': self.valid = self.validate()
+        # Subclasses may complete the manifest after this validation
+        self._dirty = None
+
+    def _getValid(self):
+        if self._valid is None: self._valid = self.validate()
+        return self._valid
+    def _setValid(self, valid): self._valid = valid
+    valid = property(_getValid, _setValid, doc="""
+        Valid status of the file
+
+        Computed when first read, if the file was opened without
+        validation.
+        """)
+
+    def _atDepth(self, depth):
+        return Aptofile.DEPTHS.index(self._depth) >= Aptofile.DEPTHS.index(depth)
 
     # Enable with statement:
     def __enter__(self): return self
     def __exit__(self,type,value,tb): self.close()
 
     def _checkFiles(self,files):
+        pending = None
         for f in files:
             if not ':' in f or f.startswith('file:'):
-                f = stripFileName(f)
-                if not f in self.namelist() and \
-                        not f.replace('/','\\') in self.namelist() and \
-                        not f.replace('\\','/') in self.namelist():
-                    raise IOError("File not found: %s"%f)
+                if self._getinfo(f,wait=False) is None and \
+                        self._sourceInfo(f) is None:
+                    # Files being written count as found. Written files
+                    # are in the archive before they leave pending, so
+                    # look again after getting the pending names.
+                    if pending is None: pending = self._pendingNames()
+                    if canonicalName(f) not in pending and \
+                            self._getinfo(f,wait=False) is None:
+                        raise IOError("File not found: %s"%stripFileName(f))
             elif f.startswith('http://'):
                 pass
             elif f.startswith('data:'):
@@ -250,11 +757,128 @@ class Aptofile:
     def _readManifest(self):
         self.manifest = json.loads(self.zipfile.read(Aptofile.MANIFEST_FILE))
     def _writeManifest(self):
-        self.zipfile.writestr(Aptofile.MANIFEST_FILE,json.dumps(self.manifest,indent=4))
+        data = json.dumps(self.manifest,indent=4)
+        comment = self._source.comment if self._source is not None else ''
+        # A summary of the file updated is kept up to date
+        if self._manifestFirst or Aptofile._parseSummary(comment) is not None:
+            comment = json.dumps(
+                {'type':self.FILETYPE,'date':self.manifest.get('date'),
+                 'manifest_version':self.manifest.get('manifest_version')})
+        self.zipfile.comment = comment
+        if self._manifestSlot is not None and \
+                ziptools.fillMember(self.zipfile, self._manifestSlot, data):
+            return
+        level = 0
+        if self.compression is not None:
+            level = self.compression.level(Aptofile.MANIFEST_FILE,
+                                           'application/json',
+                                           lambda: data[:self.compression.SAMPLE_SIZE])
+        if level:
+            ziptools.writestrDeflated(self.zipfile, Aptofile.MANIFEST_FILE,
+                                      data, level)
+        else: self.zipfile.writestr(Aptofile.MANIFEST_FILE,data)
     def _assureWritable(self):
         if self.mode != 'w':
             raise Exception("File not writable.")
+    def _validationDeferred(self):
+        return self._writeDepth > 0 or self._batchDepth > 0 or \
+            self.validateMode == 'on_close'
 
+    def _touch(self,*path):
+        """
+        Mark a manifest path as changed by the current writing method
+
+        Called without path by methods that do not change the manifest.
+        """
+        self._touched = True
+        if path and self._dirty is not None: self._dirty.add(path)
+
+    @staticmethod
+    def _changedKeys(changes, path):
+        """
+        Return the set of changed keys of the object at path
+
+        Returns None if the object itself may have been replaced.
+        """
+        keys = set()
+        n = len(path)
+        for changed in changes:
+            if changed[:n] == path[:len(changed)]:
+                if len(changed) <= n: return None
+                keys.add(changed[n])
+        return keys
+
+    def _revalidate(self):
+        """
+        Validate the parts of the file changed by writing methods
+
+        Falls back to a full validation if the changes are not known.
+        Changes made directly to the manifest are not tracked, call
+        validate() after such changes.
+        """
+        self._changes, self._dirty = self._dirty, set()
+        try:
+            return self.validate()
+        finally:
+            self._changes = None
+
+    def _testMembers(self):
+        """
+        Verify the CRC of the archive members, raises on bad members
+
+        Only members added since the last test are verified, unless the
+        whole file is validated. The result for each verified member is
+        kept in memberChecks.
+        """
+        # Members may be appended meanwhile by a background writer
+        infos = list(self.zipfile.infolist())
+        tested, self._testedMembers = self._testedMembers, len(infos)
+        if self._changes is not None: infos = infos[tested:]
+        self.memberChecks = ziptools.verifyMembers(self.zipfile, infos,
+                                                   self.VERIFY_WORKERS,
+                                                   self.VERIFY_PROCESSES,
+                                                   self.VERIFY_FAIL_FAST)
+        bad = [c for c in self.memberChecks if not c.ok]
+        if bad:
+            raise zipfile.BadZipfile("Bad members: %s"%
+                    ', '.join("%s (%s)"%(c.name,c.error) for c in bad))
+
+    def _validateSchema(self):
+        """
+        Validate the manifest against the schema, raises the first error
+        """
+        if not self.PARTITIONS:
+            Aptofile.getValidator().validate(self.manifest)
+            return
+        validator = Aptofile.REGISTRY.getPartitioned(Aptofile.SCHEMA,
+                                                     self.PARTITIONS)
+        if self._changes is None or self._schemaState is None:
+            self._schemaState = validator.newState()
+        errors = validator.validate(self.manifest, self._schemaState,
+                                    self._changes)
+        if errors: raise errors[0]
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Defer validation for a group of changes
+
+        Writing methods called inside the block do not validate the file
+        and return the last known valid status. The file is validated
+        once when the block ends, which sets self.valid.
+
+        with af.batch():
+            for key in layers:
+                af.addLayer(key, ...)
+        """
+        self._assureWritable()
+        self._batchDepth += 1
+        try:
+            yield self
+        finally:
+            self._batchDepth -= 1
+        if not self._validationDeferred():
+            self._revalidate()
 
     def close(self):
         """
@@ -262,28 +886,254 @@ class Aptofile:
 
         If the mode is 'w' it also writes the manifest. This is done
         only here, so closing of files are important. Use 'with'.
+        When validation is deferred to close, the file is validated
+        before the manifest is written. When updating a file, the files
+        not replaced are copied before the manifest is written.
         """
-        if self.mode == 'w': self._writeManifest()
-        self.zipfile.close()
+        errors = []
+        closed = False
+        try:
+            if self._writer is not None:
+                errors = self._writer.close()
+                self._writer = None
+                # Check the files written since the last validation
+                if self.validateMode == 'always': self._revalidate()
+            if self.mode == 'w':
+                if self.validateMode == 'on_close': self.validate()
+                if self._source is not None: self._copySource()
+                self._writeManifest()
+            self._closeArchive()
+            closed = True
+        finally:
+            # After a failure too, without hiding its exception
+            if not closed: self._closeArchive(quiet=True)
+            if self._source is not None: self._source.close()
+            if self._replaceFile is not None:
+                # Keep the original unless the new file is complete
+                if closed and not errors:
+                    if os.name == 'nt': os.remove(self._replaceFile)
+                    os.rename(self.filename, self._replaceFile)
+                    self.filename = self._replaceFile
+                else: os.remove(self.filename)
+                self._replaceFile = None
+        if errors:
+            raise IOError("Failed writing files: %s"%
+                          ', '.join("%s (%s)"%(n,e) for n,e in errors))
+    def _closeArchive(self, quiet=False):
+        """
+        Close the maps of the archives, the compression workers and the
+        archive. With quiet, errors are ignored.
+        """
+        closers = [m.close for m in self._archiveMaps.values()]
+        closers.extend([self._closePool, self.zipfile.close])
+        for close in closers:
+            try:
+                close()
+            except Exception:
+                if not quiet: raise
+        self._archiveMaps = {}
+    def _closePool(self):
+        if self._compressPool is not None:
+            self._compressPool.close()
+            self._compressPool.join()
+            self._compressPool = None
+    def _copySource(self):
+        """
+        Copy the files of the file being updated that were not replaced,
+        without decompressing them
+        """
+        self._updateIndex()
+        for zinfo in self._source.infolist():
+            name = canonicalName(zinfo.filename)
+            if name in self._sourceIndex and name not in self._nameIndex:
+                ziptools.copyMember(self.zipfile, self._source, zinfo)
     def getManifest(self): return self.manifest
     def getPrettyManifest(self,indent=4):
         return json.dumps(self.manifest,indent=indent)
     def getDescription(self): return self.manifest['description']
+    def getGeometry(self):
+        """
+        Return the geometry of a point, route or area as a
+        geometry.Geometry, None if the file has no geometry
+
+        The geometry is read from a data: URL or a file in the archive,
+        see geometry.parse().
+        """
+        return self._readGeometry(
+            (self.manifest.get(self.FILETYPE) or {}).get('geometry'))
+    def _readGeometry(self, geom):
+        # geom is a geometry of the manifest, with type and data
+        if not geom or not geom.get('data'): return None
+        if geom.get('type') != 'text/x-ewkt':
+            raise ValueError("Unsupported geometry type: %s"%geom.get('type'))
+        return geometry.parse(self._readData(geom['data'][0]))
+    def _readData(self, f):
+        # f is an element of a dataset, a data: URL or a file in the archive
+        if f.startswith('data:'): return readDataURL(f)
+        if not ':' in f or f.startswith('file:'): return self.readfile(f)
+        raise ValueError("Data not in the file: %s"%f)
+    def getExtent(self):
+        """
+        Return the extent of the file as (minLongitude, minLatitude,
+        maxLongitude, maxLatitude), None if not known
+
+        The extent is the bounding box of the geometry of points, routes
+        and areas, and the georeference of videos. Images have the extent
+        of their footprint, see Imagefile.getImageFootprint(), and assets
+        of their layers, see Assetfile.getLayerExtent().
+        """
+        obj = self.manifest.get(self.FILETYPE) or {}
+        if obj.get('geometry'):
+            g = self.getGeometry()
+            return g.bbox if g is not None else None
+        ref = obj.get('georeference')
+        if ref: return (ref['longitude'], ref['latitude'])*2
+        return None
+    def _updateIndex(self):
+        """
+        Add the members written since the last update to the name index
+        """
+        infos = self.zipfile.infolist()
+        if len(infos) == len(self._names): return
+        for zinfo in infos[len(self._names):]:
+            self._names.append(stripFileName(zinfo.filename))
+            self._nameIndex[canonicalName(zinfo.filename)] = zinfo
+    def _getinfo(self,fn,wait=True):
+        """
+        Return the ZipInfo of the member fn, None if not found
+
+        fn may have a 'file:' prefix, leading separators and either
+        path separator. With wait, a file being written is waited for.
+        """
+        self._updateIndex()
+        zinfo = self._nameIndex.get(canonicalName(fn))
+        if zinfo is None and wait and self._writer is not None and \
+                canonicalName(fn) in self._pendingNames():
+            self.flush()
+            return self._getinfo(fn,False)
+        return zinfo
+    def _sourceInfo(self,fn):
+        """
+        Return the ZipInfo of fn in the file being updated, None if not found
+        """
+        return self._sourceIndex.get(canonicalName(fn))
+    def _locate(self,fn):
+        """
+        Return the archive and ZipInfo of the file fn, raises if not found
+
+        Files written are found before those of the file being updated.
+        """
+        zinfo = self._getinfo(fn)
+        if zinfo is not None: return self.zipfile, zinfo
+        zinfo = self._sourceInfo(fn)
+        if zinfo is not None: return self._source, zinfo
+        raise Exception("File %s not found"%stripFileName(fn))
+    def _pendingNames(self):
+        if self._writer is None: return set()
+        return set(canonicalName(fn) for fn in self._writer.pending())
+    def flush(self):
+        """
+        Wait for the files being written in the background
+
+        Returns a list of (name, exception) for the files that could not
+        be written.
+        """
+        if self._writer is None: return []
+        return self._writer.flush()
     def namelist(self):
-        return [ stripFileName(fn) for fn in self.zipfile.namelist() ]
+        self._updateIndex()
+        if self._source is None: return list(self._names)
+        return [stripFileName(zinfo.filename)
+                for zinfo in self._source.infolist()
+                if canonicalName(zinfo.filename) in self._sourceIndex and
+                canonicalName(zinfo.filename) not in self._nameIndex] + \
+                self._names
     def readfile(self,fn):
-        fn = stripFileName(fn)
-        if fn in self.namelist():
-            return self.zipfile.read(fn)
-        elif fn.replace('\\','/') in self.namelist():
-            return self.zipfile.read(fn.replace('\\','/'))
-        elif fn.replace('/','\\') in self.namelist():
-            return self.zipfile.read(fn.replace('/','\\'))
-        else: raise Exception("File %s not found"%fn)
+        zf, zinfo = self._locate(fn)
+        return zf.read(zinfo)
+    def openfile(self,fn):
+        """
+        Open the file fn in the archive as a seekable, read only file object
+
+        Names are resolved as in readfile(). Use this instead of readfile()
+        for large files, e.g. video, which should not be read into memory.
+        Seeking is cheap for uncompressed files, seeking backward in a
+        compressed file decompresses from the nearest checkpoint.
+        """
+        zf, zinfo = self._locate(fn)
+        return ziptools.MemberFile(zf, zinfo)
+    def readrange(self,fn,offset,length):
+        """
+        Read length bytes from offset of the file fn in the archive
+        """
+        with self.openfile(fn) as f:
+            f.seek(offset)
+            return f.read(length)
+    def readview(self,fn):
+        """
+        Return a read only view of the file fn in the archive
+
+        Uncompressed files are views of a memory map of the archive, so
+        no data is copied and only the pages used are read. Compressed
+        files are read as with readfile(). The view can be passed on to
+        e.g. numpy.frombuffer() or struct.unpack_from(); on Python 2 it
+        is a buffer object, on Python 3 a memoryview.
+        """
+        zf, zinfo = self._locate(fn)
+        if zf not in self._archiveMaps:
+            self._archiveMaps[zf] = ziptools.ArchiveMap(zf)
+        return self._archiveMaps[zf].view(zinfo)
+
+
+    def _pool(self):
+        if self._compressPool is None:
+            self._compressPool = multiprocessing.pool.ThreadPool(
+                self.COMPRESS_WORKERS or multiprocessing.cpu_count())
+        return self._compressPool
 
+    def _write(self,filename,arcname=None,mimetype=None):
+        """
+        Write a local file to the archive, compressed as decided by the
+        compression policy
+        """
+        if ziptools.isStream(filename):
+            self._writeStream(filename,arcname,mimetype)
+            return
+        def sample():
+            with open(filename,'rb') as fid:
+                return fid.read(self.compression.SAMPLE_SIZE)
+        def getLevel():
+            if self.compression is None: return 0
+            return self.compression.level(arcname or filename, mimetype, sample)
+        if self._writer is not None:
+            self._writer.add(filename, arcname, getLevel)
+            return
+        if self.compression is None:
+            self.zipfile.write(filename,arcname)
+            return
+        level = getLevel()
+        if level:
+            ziptools.writeDeflated(self.zipfile, filename, arcname, level,
+                                   self._pool())
+        else: self.zipfile.write(filename,arcname,zipfile.ZIP_STORED)
+
+    def _writeStream(self,source,arcname,mimetype=None):
+        """
+        Write data from a file object or iterable to the archive in blocks
+        """
+        if not arcname: raise Exception("Archive name needed for data")
+        # Written here to keep the order, after the files in the background
+        self.flush()
+        reader = ziptools.StreamReader(source)
+        level = 0
+        if self.compression is not None:
+            level = self.compression.level(arcname, mimetype,
+                        lambda: reader.peek(self.compression.SAMPLE_SIZE))
+        ziptools.writeStream(self.zipfile, arcname, reader, level,
+                             self._pool() if level else None)
 
     @writingMethod
-    def writefile(self,file):
+    def writefile(self,file,mimetype=None):
         """
         Write a file to the archive
 
@@ -293,14 +1143,22 @@ class Aptofile:
         archive name of the file. If a local file is added without this,
         the archive name will be the same as filename, but without a drive
         letter and with leading path separators removed.
+
+        Instead of a local file, the first element of the tuple may be data:
+        a file object, an iterable of strings (e.g. a generator), or bytes
+        as a bytearray, buffer or memoryview (a str is a file name). The
+        data is written in blocks of 1 MB, without reading it all into
+        memory.
+
+        mimetype is the type of the file in the manifest, used for choosing
+        the compression (see create()). Errors reading the file or data
+        are raised, leaving nothing of the file in the archive.
         """
+        self._touch()
         if type(file)==tuple:
-            try:
-                self.zipfile.write(file[0],stripFileName(file[1]))
-            except Exception as e:
-                return False
+            self._write(file[0],stripFileName(file[1]),mimetype)
         elif not ':' in file or file.startswith('file:'):
-            self.zipfile.write(stripFileName(file))
+            self._write(stripFileName(file),mimetype=mimetype)
         elif file.startswith('data:'):
             pass
         elif file.startswith('http:'):
@@ -312,36 +1170,46 @@ class Aptofile:
 
     @writingMethod
     def setGenerator(self,program='',creator=''):
+        self._touch('generator')
         if program: self.manifest['generator']['program'] = program
         if creator: self.manifest['generator']['creator'] = creator
 
     @writingMethod
     def setDate(self,date):
+        self._touch('date')
         self.manifest['date']=date
 
     @writingMethod
     def setDescription(self,desc):
+        self._touch('description')
         self.manifest['description']=desc
 
     def getFailedTests(self): return self.failedTests
-    def validate(self):
+    def getMemberChecks(self): return self.memberChecks
+    def validate(self, depth=None):
         """
         Validate the file
 
         Performs tests which are defined as methods decorated with testCase.
         Each method throws an exception which is handeled in the decorator.
+
+        depth is the validation depth, see open(). Defaults to the depth
+        the file was opened with, or 'full' if that was 'none'.
         """
+        if depth is None: depth = self.depth
+        if depth == 'none': depth = 'full'
+        if depth not in Aptofile.DEPTHS:
+            raise Exception("Invalid validation depth: %s"%depth)
+        self._depth = depth
         self.failedTests = []
+        if self._changes is None: self._dirty = set()
         ret = True
         @testCase
-        def testZip(self): self.zipfile.testzip()
-        ret = testZip(self) and ret
+        def testZip(self): self._testMembers()
+        if self._atDepth('full'): ret = testZip(self) and ret
 
         @testCase
-        def validateManifest(self):
-            jsonschema.validate(self.manifest, Aptofile.SCHEMA,
-                                Aptofile.VALIDATOR,
-                                format_checker = jsonschema.FormatChecker())
+        def validateManifest(self): self._validateSchema()
         ret = validateManifest(self) and ret
 
         @testCase
@@ -352,10 +1220,20 @@ class Aptofile:
 
 class Assetfile(Aptofile):
 
+    FILETYPE = 'asset'
     LAYER_FIELDS = ['geometry','style','resources']
-
-    def __init__(self, zipfile, manifest=None):
-        Aptofile.__init__(self, zipfile, manifest)
+    PARTITIONS = [('asset','layers'),('asset','groups')]
+
+    def __init__(self, zipfile, manifest=None, depth='full'):
+        self._layerErrors = {}
+        self._groupErrors = {}
+        self._checkedMembers = 0
+        self.dedup = False
+        self._blobs = {}
+        self._fileDigests = {}
+        self.dedupSummary = {'files':0,'bytes':0,'duplicates':0,'saved':0}
+        self._layerInfo = {}
+        Aptofile.__init__(self, zipfile, manifest, depth)
 
         if self.mode == 'w':
             asset = self.manifest['asset']
@@ -363,6 +1241,81 @@ class Assetfile(Aptofile):
             asset['groups']=asset.get('groups',{})
 
     def isAssetfile(self): return True
+    def getDedupSummary(self):
+        """
+        Return a summary of the deduplication of files when creating
+
+        'files' and 'bytes' count the unique files written, 'duplicates'
+        and 'saved' the files that were not written again.
+        """
+        return dict(self.dedupSummary)
+
+    @staticmethod
+    def _digest(read):
+        digest = hashlib.sha1()
+        for data in iter(lambda: read(ziptools.CHUNK_SIZE), ''):
+            digest.update(data)
+        return digest.digest()
+
+    def _contentDigest(self,source):
+        """
+        Return the SHA-1 digest of a local file or bytes
+
+        Local files are hashed once while their size and modification
+        time are unchanged.
+        """
+        if not isinstance(source, basestring):
+            return hashlib.sha1(source).digest()
+        st = os.stat(source)
+        stamp = (os.path.abspath(source), st.st_size, st.st_mtime)
+        if stamp not in self._fileDigests:
+            with open(source,'rb') as fid:
+                self._fileDigests[stamp] = self._digest(fid.read)
+        return self._fileDigests[stamp]
+
+    def _memberDigest(self,fn):
+        try:
+            with self.openfile(fn) as f: return self._digest(f.read)
+        except Exception:
+            # Not written, never equal to other content
+            return ''
+
+    def _writeUnique(self,file,mimetype=None):
+        """
+        Write file unless a file with the same content has been written
+
+        Returns the name to refer to the file by in the manifest, which
+        is the name of the earlier file for a duplicate. Only files of
+        the same size are hashed, earlier files from the archive.
+        """
+        name = file[1] if type(file)==tuple else file
+        if type(file)==tuple: source = file[0]
+        elif not ':' in file or file.startswith('file:'):
+            source = stripFileName(file)
+        else: source = None
+        size = digest = None
+        try:
+            if isinstance(source, (bytearray, buffer, memoryview)):
+                size = len(source)
+            elif isinstance(source, basestring):
+                size = os.path.getsize(source)
+            if self._blobs.get(size): digest = self._contentDigest(source)
+        except (IOError, OSError):
+            # Written as usual, which reports the error
+            size = None
+        blobs = self._blobs.get(size,{})
+        for earlier in blobs.keys():
+            if blobs[earlier] is None:
+                blobs[earlier] = self._memberDigest(earlier)
+            if blobs[earlier] == digest:
+                self.dedupSummary['duplicates'] += 1
+                self.dedupSummary['saved'] += size
+                return earlier
+        if self.writefile(file,mimetype) and size is not None:
+            self._blobs.setdefault(size,{})[name] = digest
+            self.dedupSummary['files'] += 1
+            self.dedupSummary['bytes'] += size
+        return name
 
 
 
@@ -387,8 +1340,10 @@ class Assetfile(Aptofile):
         also be a tuple where the second element is a string with the
         archive name of the file. If a local file is added without this,
         the archive name will be the same as filename, but without a drive
-        letter and with leading path separators removed.
+        letter and with leading path separators removed. The first element
+        of the tuple may also be data, see writefile().
         """
+        self._touch('asset','layers',key)
         layer = {}
         layer['name']=args.get('name',key)
         layer['geometry']={}
@@ -423,6 +1378,7 @@ class Assetfile(Aptofile):
         There is no requirement that the layers exists.
         if the file is
         """
+        self._touch('asset','groups',key)
         group = {}
         if name: group['name'] = name
         else: group['name'] = key
@@ -451,12 +1407,22 @@ class Assetfile(Aptofile):
         also be a tuple where the second element is a string with the
         archive name of the file. If a local file is added without this,
         the archive name will be the same as filename, but without a drive
-        letter and with leading path separators removed.
+        letter and with leading path separators removed. The first element
+        of the tuple may also be data, see writefile().
+
+        With dedup (see create()), a local file or bytes with the same
+        content as a file written before is not written again, and the
+        earlier file is added to the layer instead.
         """
         if fileType not in Assetfile.LAYER_FIELDS:
             raise Exception("Invalid file type: %s"%fileType)
 
-        if writeFile: self.writefile(file)
+        self._touch('asset','layers',layerKey)
+        if writeFile:
+            layer = self.manifest['asset']['layers'][layerKey]
+            mimetype = layer.get(fileType,{}).get('type')
+            if self.dedup: file = self._writeUnique(file,mimetype)
+            else: self.writefile(file,mimetype)
         if type(file)==tuple: file = file[1]
         if not self.manifest['asset']['layers'][layerKey].has_key(fileType):
             self.manifest['asset']['layers'][layerKey][fileType]={}
@@ -464,8 +1430,195 @@ class Assetfile(Aptofile):
         ls.append(file)
         self.manifest['asset']['layers'][layerKey][fileType]['data']=ls
 
-    def validate(self):
-        ret = Aptofile.validate(self)
+    def getLayerInfo(self, key):
+        """
+        Return information about the geometry of a layer
+
+        Returns a dict with
+        type       the geometry type of the layer, e.g. 'text/x-shapefile'
+        shapeType  the shape type, e.g. 'PolyLine', or the EWKT type
+        bbox       the extent (minLongitude, minLatitude, maxLongitude,
+                   maxLatitude), None if not known
+        zRange     (min, max) of z, and mRange of m, of shapefiles
+        features   the number of features, None if not known
+        fields     the attributes as (name, type, length, decimals)
+        files      the files of a shapefile by extension ('shp', 'shx',
+                   'dbf')
+
+        Only the headers of the .shp, .shx and .dbf files are read, with
+        ranged reads of the files in the archive, so the time does not
+        depend on the size of the shapefile. EWKT geometries are parsed.
+        The information is kept while the files of the layer are the same.
+        """
+        geom = self.manifest['asset']['layers'][key].get('geometry') or {}
+        data = tuple(geom.get('data') or [])
+        cached = self._layerInfo.get(key)
+        if cached is not None and cached[0] == data: return cached[1]
+        info = {'type':geom.get('type'), 'shapeType':None, 'bbox':None,
+                'zRange':None, 'mRange':None, 'features':None, 'fields':[],
+                'files':{}}
+        if geom.get('type') == 'text/x-ewkt':
+            g = self._readGeometry(geom)
+            if g is not None:
+                info.update(shapeType=g.type, bbox=g.bbox,
+                            features=len(g.parts)-1)
+        else:
+            for f in data:
+                if ':' in f and not f.startswith('file:'): continue
+                ext = os.path.splitext(canonicalName(f))[1][1:].lower()
+                if ext in ('shp','shx','dbf'): info['files'][ext] = f
+            files = info['files']
+            if files.has_key('shp'):
+                header = shapefile.readHeader(
+                    self.readrange(files['shp'], 0, shapefile.HEADER_SIZE))
+                info.update(shapeType=header['shapeTypeName'],
+                            zRange=header['zRange'], mRange=header['mRange'])
+                # A file of null shapes only has no extent
+                if header['shapeType'] != 0: info['bbox'] = header['bbox']
+            if files.has_key('dbf'):
+                start = self.readrange(files['dbf'], 0,
+                                       shapefile.DBF_HEADER_SIZE)
+                length = shapefile.readDbfHeaderLength(start)[1]
+                dbf = shapefile.readDbfHeader(
+                    start+self.readrange(files['dbf'],
+                                         shapefile.DBF_HEADER_SIZE,
+                                         length-shapefile.DBF_HEADER_SIZE))
+                info.update(features=dbf['records'], fields=dbf['fields'])
+            if files.has_key('shx'):
+                header = shapefile.readHeader(
+                    self.readrange(files['shx'], 0, shapefile.HEADER_SIZE))
+                info['features'] = shapefile.recordCount(header)
+        self._layerInfo[key] = (data, info)
+        return info
+
+    def getLayerExtent(self, key):
+        """
+        Return the extent of a layer, None if not known, see getLayerInfo()
+        """
+        return self.getLayerInfo(key)['bbox']
+
+    def iterFeatures(self, key, bbox=None, batch=shapefile.BATCH_SIZE,
+                     start=0, stop=None):
+        """
+        Generate the features of the shapefile of a layer in batches
+
+        Each batch is a shapefile.FeatureBatch of up to batch records,
+        with the vertices of all its features in one numpy array, and the
+        attributes from the .dbf file as numpy arrays by field name. With
+        bbox (minLongitude, minLatitude, maxLongitude, maxLatitude), only
+        features intersecting it are returned, and batches without any
+        are skipped. start and stop are record numbers, e.g. for dividing
+        a large layer among workers.
+
+        The records are located by the .shx file and read from the files
+        in the archive batch by batch, so memory use depends on batch and
+        not on the size of the shapefile:
+
+        for features in af.iterFeatures('oil', bbox=(4.5, 60, 5.5, 61)):
+            for j, name in enumerate(features.attributes['NAME']):
+                print name, features.getGeometry(j).bbox
+        """
+        info = self.getLayerInfo(key)
+        files = info['files']
+        if not (files.has_key('shp') and files.has_key('shx')):
+            raise ValueError("Layer %s has no .shp and .shx files"%key)
+        shapeType = shapefile.SHAPE_TYPE_CODES[info['shapeType']]
+        count = info['features']
+        stop = count if stop is None else min(stop, count)
+        with self.openfile(files['shp']) as shp, \
+             self.openfile(files['shx']) as shx:
+            dbf = None
+            if files.has_key('dbf'): dbf = self.openfile(files['dbf'])
+            try:
+                if dbf is not None:
+                    data = dbf.read(shapefile.DBF_HEADER_SIZE)
+                    length = shapefile.readDbfHeaderLength(data)[1]
+                    dbfHeader = shapefile.readDbfHeader(
+                        data+dbf.read(length-shapefile.DBF_HEADER_SIZE))
+                    if dbfHeader['records'] < stop:
+                        raise ValueError("Layer %s has %d records in .dbf, "
+                                         "%d in .shx"%(
+                                             key, dbfHeader['records'], count))
+                for first in xrange(start, stop, batch):
+                    n = min(batch, stop-first)
+                    shx.seek(shapefile.HEADER_SIZE+8*first)
+                    offsets, ends = shapefile.readIndex(shx.read(8*n))
+                    low, high = int(offsets.min()), int(ends.max())
+                    shp.seek(low)
+                    block = shp.read(high-low)
+                    if len(block) < high-low:
+                        raise ValueError("Layer %s has a truncated .shp "
+                                         "file"%key)
+                    features = shapefile.readRecords(
+                        block, offsets+8-low, shapeType,
+                        xrange(first, first+n), bbox)
+                    if bbox is not None and not len(features): continue
+                    if dbf is not None:
+                        dbf.seek(dbfHeader['headerLength']+
+                                 first*dbfHeader['recordLength'])
+                        attributes = shapefile.readDbfRecords(
+                            dbf.read(n*dbfHeader['recordLength']), dbfHeader)
+                        rows = features.ids-first
+                        features.attributes = dict(
+                            (name, values[rows])
+                            for name, values in attributes.items())
+                    yield features
+            finally:
+                if dbf is not None: dbf.close()
+
+    def getExtent(self):
+        layers = self.manifest['asset'].get('layers') or {}
+        return geometry.union(self.getLayerExtent(key) for key in layers)
+
+    def _checkLayerFiles(self, v):
+        if not v['geometry']['data']:
+            raise Exception("Layer %s has no geometry data"%v['name'])
+        files = []
+        for key in ['geometry','style']:
+            files.extend(v[key]['data'])
+        if v.has_key('resources'):
+            files.extend(v['resources']['data'])
+        self._checkFiles(files)
+
+    def _checkGroupLayers(self, v):
+        layerDict = self.manifest['asset']['layers']
+        for layername in v['layers']:
+            if not layerDict.has_key(layername):
+                raise Exception("Layer '%s' in group '%s' does not exist"%
+                                (layername,v['name']))
+
+    def _checkChildren(self, path, check, errors, recheck=False):
+        """
+        Run check on the changed children of the manifest object at path
+
+        errors holds the exception of each failing child from earlier
+        checks and is updated. With recheck, children that failed earlier
+        are checked again. Raises the exception of the first failing child.
+        """
+        children = self.manifest[path[0]][path[1]]
+        keys = None
+        if self._changes is not None:
+            keys = Aptofile._changedKeys(self._changes, path)
+        if keys is None:
+            errors.clear()
+            keys = children.keys()
+        elif recheck:
+            keys.update(errors.keys())
+        for key in keys:
+            if key not in children:
+                errors.pop(key,None)
+                continue
+            try:
+                check(children[key])
+                errors.pop(key,None)
+            except Exception as e:
+                errors[key] = e
+        if errors:
+            for key in children:
+                if key in errors: raise errors[key]
+
+    def validate(self, depth=None):
+        ret = Aptofile.validate(self, depth)
 
         @testCase
         def isAssetFile(self): self.manifest['asset']
@@ -473,25 +1626,20 @@ class Assetfile(Aptofile):
 
         @testCase
         def assetFiles(self):
-            files = []
-            for v in self.manifest['asset']['layers'].itervalues():
-                if not v['geometry']['data']:
-                    raise Exception("Layer %s has no geometry data"%v['name'])
-                for key in ['geometry','style']:
-                    files.extend(v[key]['data'])
-                if v.has_key('resources'):
-                    files.extend(v['resources']['data'])
-            self._checkFiles(files)
-        ret = assetFiles(self) and ret
+            # Layers missing files are checked again when files are added
+            members = len(self.zipfile.infolist())
+            added, self._checkedMembers = members != self._checkedMembers, members
+            self._checkChildren(('asset','layers'), self._checkLayerFiles,
+                                self._layerErrors, added)
+        if self._atDepth('structure'): ret = assetFiles(self) and ret
 
         @testCase
         def assetGroups(self):
-            layerDict = self.manifest['asset']['layers']
-            for v in self.manifest['asset']['groups'].itervalues():
-                for layername in v['layers']:
-                    if not layerDict.has_key(layername):
-                        raise Exception("Layer '%s' in group '%s' does not exist"%
-                                        (layername,v['name']))
+            # Groups with missing layers are checked again when layers change
+            layersChanged = self._changes is None or \
+                Aptofile._changedKeys(self._changes, ('asset','layers')) != set()
+            self._checkChildren(('asset','groups'), self._checkGroupLayers,
+                                self._groupErrors, layersChanged)
         ret = assetGroups(self) and ret
 
         self.valid=ret
@@ -500,8 +1648,11 @@ class Assetfile(Aptofile):
 
 class Imagefile(Aptofile):
 
-    def __init__(self, zipfile, manifest=None):
-        Aptofile.__init__(self, zipfile, manifest)
+    FILETYPE = 'image'
+
+    def __init__(self, zipfile, manifest=None, depth='full'):
+        self._footprint = None
+        Aptofile.__init__(self, zipfile, manifest, depth)
 
         if self.mode == 'w':
             imageDict = self.manifest['image']
@@ -513,24 +1664,29 @@ class Imagefile(Aptofile):
 
     @writingMethod
     def setImageName(self,name):
+        self._touch('image')
         self.manifest['image']['name']=name
 
     @writingMethod
     def setImageDescription(self,desc):
+        self._touch('image')
         self.manifest['image']['description']=desc
 
     @writingMethod
     def setImageCreated(self, timestamp):
+        self._touch('image')
         self.manifest['image']['created']=timestamp
 
     @writingMethod
     def addImageFile(self, file):
-        self.writefile(file)
+        self._touch('image')
+        self.writefile(file,'image')
         if type(file)==tuple: file = file[1]
         self.manifest['image']['data']=[file]
 
     @writingMethod
     def setImageGeoreference(self, lon, lat, elev):
+        self._touch('image')
         d={}
         d['longitude']=lon
         d['latitude']=lat
@@ -539,13 +1695,64 @@ class Imagefile(Aptofile):
 
     @writingMethod
     def setImageBounds(self, data, type="text/x-worldfile"):
+        self._touch('image')
         d={}
         d['type']=type
         d['data']=data
         self.manifest['image']['bounds']=d
 
-    def validate(self):
-        ret = Aptofile.validate(self)
+    def getImageFootprint(self):
+        """
+        Return where the image is on the map, None if it has no bounds
+
+        Returns a dict with
+        corners  the (longitude, latitude) of the upper left, upper right,
+                 lower right and lower left corners of the image
+        bbox     (minLongitude, minLatitude, maxLongitude, maxLatitude)
+        size     the (width, height) of the image in pixels
+
+        The worldfile of the bounds is read from a data: URL or a file in
+        the archive, and the size from the header of the JPEG or PNG
+        image without decoding it, see worldfile.readImageSize(). The
+        footprint is kept while the image and bounds are the same. Raises
+        ValueError if the bounds or the image cannot be read.
+        """
+        image = self.manifest['image']
+        bounds = image.get('bounds') or {}
+        key = (tuple(image.get('data') or []), tuple(bounds.get('data') or []))
+        if self._footprint is not None and self._footprint[0] == key:
+            return self._footprint[1]
+        result = None
+        if bounds.get('data'):
+            if bounds.get('type') != 'text/x-worldfile':
+                raise ValueError("Unsupported bounds type: %s"%
+                                 bounds.get('type'))
+            if not image.get('data'): raise ValueError("Image file missing")
+            parameters = worldfile.readWorldfile(
+                self._readData(bounds['data'][0]))
+            with self.openfile(image['data'][0]) as f:
+                size = worldfile.readImageSize(f)
+            corners = worldfile.footprint(parameters, size)
+            xs, ys = zip(*corners)
+            result = {'corners':corners, 'size':size,
+                      'bbox':(min(xs), min(ys), max(xs), max(ys))}
+        self._footprint = (key, result)
+        return result
+
+    def getExtent(self):
+        """
+        Return the bbox of the footprint of the image, or the
+        georeference if it has no bounds or they cannot be read
+        """
+        try:
+            footprint = self.getImageFootprint()
+        except ValueError:
+            footprint = None
+        if footprint is not None: return footprint['bbox']
+        return Aptofile.getExtent(self)
+
+    def validate(self, depth=None):
+        ret = Aptofile.validate(self, depth)
         @testCase
         def isImageFile(self): self.manifest['image']
         ret = isImageFile(self) and ret
@@ -555,7 +1762,7 @@ class Imagefile(Aptofile):
             if not self.manifest['image']['data']:
                 raise Exception("Image file missing")
             self._checkFiles(self.manifest['image']['data'])
-        ret = imageFiles(self) and ret
+        if self._atDepth('structure'): ret = imageFiles(self) and ret
 
         @testCase
         def imageDate(self): self._checkTimestamp(self.manifest['image']['created'])
@@ -566,8 +1773,10 @@ class Imagefile(Aptofile):
 
 class Videofile(Aptofile):
 
-    def __init__(self, zipfile, manifest=None):
-        Aptofile.__init__(self, zipfile, manifest)
+    FILETYPE = 'video'
+
+    def __init__(self, zipfile, manifest=None, depth='full'):
+        Aptofile.__init__(self, zipfile, manifest, depth)
 
         if self.mode == 'w':
             videoDict = self.manifest['video']
@@ -579,32 +1788,37 @@ class Videofile(Aptofile):
 
     @writingMethod
     def setVideoName(self, name):
+        self._touch('video')
         self.manifest['video']['name'] = name
 
     @writingMethod
     def setVideoDescription(self, desc):
+        self._touch('video')
         self.manifest['video']['description'] = desc
 
     @writingMethod
     def setVideoCreated(self, timestamp):
+        self._touch('video')
         self.manifest['video']['created']=timestamp
 
     @writingMethod
     def addVideoFile(self, file):
-        self.writefile(file)
+        self._touch('video')
+        self.writefile(file,'video')
         if type(file)==tuple: file = file[1]
         self.manifest['video']['data']=[file]
 
     @writingMethod
     def setVideoGeoreference(self, lon, lat, elev):
+        self._touch('video')
         d={}
         d['longitude']=lon
         d['latitude']=lat
         d['elevation']=elev
         self.manifest['video']['georeference']=d
 
-    def validate(self):
-        ret = Aptofile.validate(self)
+    def validate(self, depth=None):
+        ret = Aptofile.validate(self, depth)
 
         @testCase
         def isVideoFile(self): self.manifest['video']
@@ -612,7 +1826,7 @@ class Videofile(Aptofile):
 
         @testCase
         def videoFiles(self): self._checkFiles(self.manifest['video']['data'])
-        ret = videoFiles(self) and ret
+        if self._atDepth('structure'): ret = videoFiles(self) and ret
         @testCase
         def videoDate(self):
             self._checkTimestamp(self.manifest['video']['created'])
@@ -623,11 +1837,12 @@ class Videofile(Aptofile):
 
 class Pointfile(Aptofile):
 
+    FILETYPE = 'point'
     OBJECT_TYPES = ['boat','bouy','debris','fishfarm','green','oil',
                     'personel','red','unknown','vessel','yellow']
 
-    def __init__(self, zipfile, manifest=None):
-        Aptofile.__init__(self, zipfile, manifest)
+    def __init__(self, zipfile, manifest=None, depth='full'):
+        Aptofile.__init__(self, zipfile, manifest, depth)
 
         if self.mode == 'w':
             pointDict = self.manifest['point']
@@ -640,18 +1855,23 @@ class Pointfile(Aptofile):
     def isPointfile(self): True
 
     @writingMethod
-    def setPointName(self,name): self.manifest['point']['name']
+    def setPointName(self,name):
+        self._touch('point')
+        self.manifest['point']['name'] = name
 
     @writingMethod
     def setPointDescription(self, desc):
+        self._touch('point')
         self.manifest['point']['description'] = desc
 
     @writingMethod
     def setPointCreated(self, timestamp):
+        self._touch('point')
         self.manifest['point']['created'] = timestamp
 
     @writingMethod
     def setPointType(self, type):
+        self._touch('point')
         type = type.lower()
         if not type in Pointfile.OBJECT_TYPES:
             raise Exception("Invalid type %s"%type)
@@ -659,13 +1879,14 @@ class Pointfile(Aptofile):
 
     @writingMethod
     def setPointGeometry(self, file, gType = 'text/x-ewkt'):
-        self.writefile(file)
+        self._touch('point')
+        self.writefile(file,gType)
         if type(file)==tuple: file = file[1]
         self.manifest['point']['geometry']['data'] = [file]
         self.manifest['point']['geometry']['type'] = gType
 
-    def validate(self):
-        ret = Aptofile.validate(self)
+    def validate(self, depth=None):
+        ret = Aptofile.validate(self, depth)
 
         @testCase
         def isPointFile(self): self.manifest['point']
@@ -688,8 +1909,10 @@ class Pointfile(Aptofile):
 
 class Routefile(Aptofile):
 
-    def __init__(self, zipfile, manifest=None):
-        Aptofile.__init__(self, zipfile, manifest)
+    FILETYPE = 'route'
+
+    def __init__(self, zipfile, manifest=None, depth='full'):
+        Aptofile.__init__(self, zipfile, manifest, depth)
 
         if self.mode == 'w':
             routeDict = self.manifest['route']
@@ -702,26 +1925,30 @@ class Routefile(Aptofile):
 
     @writingMethod
     def setRouteName(self, name):
+        self._touch('route')
         self.manifest['route']['name'] = name
 
     @writingMethod
     def setRouteDescription(self, desc):
+        self._touch('route')
         self.manifest['route']['description'] = desc
 
 
     @writingMethod
     def setRouteCreated(self, timestamp):
+        self._touch('route')
         self.manifest['route']['created'] = timestamp
 
     @writingMethod
     def setRouteGeometry(self, file, gType = 'text/x-ewkt'):
-        self.writefile(file)
+        self._touch('route')
+        self.writefile(file,gType)
         if type(file)==tuple: file = file[1]
         self.manifest['route']['geometry']['data'] = [file]
         self.manifest['route']['geometry']['type'] = gType
 
-    def validate(self):
-        ret = Aptofile.validate(self)
+    def validate(self, depth=None):
+        ret = Aptofile.validate(self, depth)
 
         @testCase
         def isRouteFile(self): self.manifest['route']
@@ -737,8 +1964,10 @@ class Routefile(Aptofile):
 
 class Areafile(Aptofile):
 
-    def __init__(self, zipfile, manifest=None):
-        Aptofile.__init__(self, zipfile, manifest)
+    FILETYPE = 'area'
+
+    def __init__(self, zipfile, manifest=None, depth='full'):
+        Aptofile.__init__(self, zipfile, manifest, depth)
 
         if self.mode == 'w':
             areaDict = self.manifest['area']
@@ -751,26 +1980,30 @@ class Areafile(Aptofile):
 
     @writingMethod
     def setAreaName(self, name):
+        self._touch('area')
         self.manifest['area']['name'] = name
 
     @writingMethod
     def setAreaDescription(self, desc):
+        self._touch('area')
         self.manifest['area']['description'] = desc
 
 
     @writingMethod
     def setAreaCreated(self, timestamp):
+        self._touch('area')
         self.manifest['area']['created'] = timestamp
 
     @writingMethod
     def setAreaGeometry(self, file, gType = 'text/x-ewkt'):
-        self.writefile(file)
+        self._touch('area')
+        self.writefile(file,gType)
         if type(file)==tuple: file = file[1]
         self.manifest['area']['geometry']['data'] = [file]
         self.manifest['area']['geometry']['type'] = gType
 
-    def validate(self):
-        ret = Aptofile.validate(self)
+    def validate(self, depth=None):
+        ret = Aptofile.validate(self, depth)
 
         @testCase
         def isAreaFile(self): self.manifest['area']
@@ -0,0 +1,261 @@
+################################################################
+#                                                              #
+# catalog.py                                                   #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Index of the metadata of many Aptofiles, kept in SQLite      #
+#                                                              #
+################################################################
+
+import json
+import os
+import zipfile
+from datetime import datetime
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from aptofile import Aptofile, Imagefile
+from scanner import findChanged, fileType, chunked, runChunks, CHUNK_SIZE
+
+# Columns of the index, in the order of the table
+COLUMNS = ['path','size','mtime','type','date','created','time','program',
+           'creator','description','name','objectDescription','members',
+           'memberSize','longitude','latitude','elevation','error',
+           'minLongitude','minLatitude','maxLongitude','maxLatitude',
+           'footprint']
+EXTENT = ['minLongitude','minLatitude','maxLongitude','maxLatitude']
+
+def _timestamp(t):
+    if isinstance(t, datetime): return t.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return t
+
+def _footprint(zf, manifest):
+    # From the archive already open, None where the georeference is used
+    if not (manifest.get('image') or {}).get('bounds'): return None
+    try:
+        return Imagefile(zf, manifest, 'none').getImageFootprint()
+    except ValueError:
+        # As Imagefile.getExtent()
+        return None
+
+def readEntry(filename):
+    """
+    Return the row of the index of a file, as a dict of COLUMNS
+
+    The list of files and the manifest are read. The extent is the
+    footprint of images with bounds, with the corners as JSON in
+    'footprint', see Imagefile.getImageFootprint(), and the
+    georeference otherwise. A file that cannot be read has the problem
+    in 'error' and no metadata.
+    """
+    path = os.path.abspath(filename)
+    st = os.stat(path)
+    entry = dict.fromkeys(COLUMNS)
+    entry.update(path=path, size=st.st_size, mtime=st.st_mtime)
+    try:
+        with zipfile.ZipFile(path, allowZip64=True) as zf:
+            infos = zf.infolist()
+            manifest = json.loads(zf.read(Aptofile.MANIFEST_FILE))
+            footprint = _footprint(zf, manifest)
+        tp = fileType(manifest)
+        obj = manifest.get(tp) or {}
+        generator = manifest.get('generator') or {}
+        georeference = obj.get('georeference') or {}
+        entry.update(type=tp, date=manifest.get('date'),
+                     created=obj.get('created'),
+                     program=generator.get('program'),
+                     creator=generator.get('creator'),
+                     description=manifest.get('description'),
+                     name=obj.get('name'),
+                     objectDescription=obj.get('description'),
+                     members=len(infos),
+                     memberSize=sum(i.file_size for i in infos),
+                     longitude=georeference.get('longitude'),
+                     latitude=georeference.get('latitude'),
+                     elevation=georeference.get('elevation'))
+        entry['time'] = entry['created'] or entry['date']
+        if footprint is not None:
+            entry['footprint'] = json.dumps(footprint['corners'])
+            bbox = footprint['bbox']
+        elif georeference:
+            bbox = (entry['longitude'], entry['latitude'])*2
+        else:
+            bbox = (None,)*4
+        entry.update(zip(EXTENT, bbox))
+    except Exception as e:
+        entry['error'] = "%s: %s"%(type(e).__name__, e)
+    return entry
+
+def _escapeLike(text):
+    # The wildcards of LIKE matched as they are
+    for c in '\\%_': text = text.replace(c, '\\'+c)
+    return text
+
+def _indexChunk(filenames):
+    results = []
+    for filename in filenames:
+        try:
+            entry = readEntry(filename)
+        except OSError:
+            # Removed since listed
+            continue
+        results.append([entry[c] for c in COLUMNS])
+    return results
+
+class Catalog(object):
+    """
+    Index of the metadata of Aptofiles, kept in an SQLite database
+
+    The type, dates, generator, names and descriptions, number and total
+    size of the files in the archive and the georeference of each file
+    are indexed by update(), which reads files that are new or changed
+    since they were indexed. Queries are answered from the index only.
+
+    catalog = Catalog('/data/catalog.sqlite')
+    catalog.update(['/data/surveys'])
+    for entry in catalog.query(type='image', creator='Vessel X',
+                               since='2013-07-22'):
+        print entry['path'], entry['time']
+    """
+
+    FILENAME = 'catalog.sqlite'
+
+    def __init__(self, filename=None):
+        """
+        filename is the database (default: catalog.sqlite in the
+        environment variable APTOFILE_CACHE or ~/.cache/aptofile)
+        """
+        if sqlite3 is None:
+            raise ImportError("Catalog needs the sqlite3 module")
+        if filename is None:
+            directory = os.environ.get('APTOFILE_CACHE',
+                os.path.join(os.path.expanduser('~'),'.cache','aptofile'))
+            if not os.path.isdir(directory): os.makedirs(directory)
+            filename = os.path.join(directory, Catalog.FILENAME)
+        self.filename = filename
+        self._db = sqlite3.connect(filename, timeout=60)
+        self._db.row_factory = sqlite3.Row
+        with self._db as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS archives (
+                              path TEXT PRIMARY KEY, size INTEGER,
+                              mtime REAL, type TEXT, date TEXT, created TEXT,
+                              time TEXT, program TEXT, creator TEXT,
+                              description TEXT, name TEXT,
+                              objectDescription TEXT, members INTEGER,
+                              memberSize INTEGER, longitude REAL,
+                              latitude REAL, elevation REAL, error TEXT,
+                              minLongitude REAL, minLatitude REAL,
+                              maxLongitude REAL, maxLatitude REAL,
+                              footprint TEXT)""")
+            for column in ['type','time','creator','longitude','minLongitude']:
+                db.execute("""CREATE INDEX IF NOT EXISTS archives_%s
+                              ON archives (%s)"""%(column, column))
+
+    def update(self, paths, workers=None, pattern='*.apt', prune=True):
+        """
+        Index the files of paths that are new or changed
+
+        paths and pattern are as for scanner.findFiles(). A file is read
+        again when its size or modification time changes, by a pool of
+        worker processes (default one per core) or in this process if
+        workers is 1. With prune, files that no longer exist are removed
+        from the index.
+
+        Returns a dict with the number of files 'added', 'updated',
+        'unchanged', 'failed' (could not be read) and 'removed'.
+        """
+        known = dict((row[0], (row[1], row[2])) for row in self._db.execute(
+            "SELECT path, size, mtime FROM archives"))
+        counts = dict.fromkeys(['added','updated','failed','removed'], 0)
+        changed, counts['unchanged'] = findChanged(paths, known, pattern)
+        rows = runChunks(_indexChunk, chunked(changed, CHUNK_SIZE), workers)
+        with self._db as db:
+            for row in rows:
+                counts['updated' if known.has_key(row[0]) else 'added'] += 1
+                if row[COLUMNS.index('error')] is not None:
+                    counts['failed'] += 1
+                db.execute("INSERT OR REPLACE INTO archives VALUES (%s)"%
+                           ','.join('?'*len(COLUMNS)), row)
+            if prune:
+                missing = [(p,) for p in known if not os.path.exists(p)]
+                db.executemany("DELETE FROM archives WHERE path=?", missing)
+                counts['removed'] = len(missing)
+        return counts
+
+    def query(self, type=None, since=None, until=None, creator=None,
+              program=None, name=None, text=None, bbox=None, errors=False,
+              order='time', limit=None):
+        """
+        Return the entries matching all the conditions given, as dicts
+
+        type      file type, e.g. 'image'
+        since     earliest time, an ISO 8601 string or a datetime in UTC
+        until     latest time, the time is when the object was created,
+                  or the date of the file
+        creator   generator creator
+        program   generator program
+        name      glob pattern of the object name, e.g. 'Oil spill*'
+        text      text in the names or descriptions, ignoring case
+        bbox      (minLongitude, minLatitude, maxLongitude, maxLatitude)
+                  intersecting the extent, the footprint of images or
+                  the georeference
+        errors    True for the files that could not be read instead
+        order     column to order by
+        limit     maximum number of entries
+        """
+        if order not in COLUMNS:
+            raise ValueError("Unknown column: %r"%order)
+        where, args = ["error IS %s NULL"%('NOT' if errors else '')], []
+        for column, op, value in [('type','=',type),
+                                  ('time','>=',_timestamp(since)),
+                                  ('time','<=',_timestamp(until)),
+                                  ('creator','=',creator),
+                                  ('program','=',program),
+                                  ('name','GLOB',name)]:
+            if value is None: continue
+            where.append("%s %s ?"%(column, op))
+            args.append(value)
+        if text is not None:
+            where.append("(name LIKE ? ESCAPE '\\' OR "
+                         "description LIKE ? ESCAPE '\\' OR "
+                         "objectDescription LIKE ? ESCAPE '\\')")
+            args.extend(['%%%s%%'%_escapeLike(text)]*3)
+        if bbox is not None:
+            where.append("minLongitude <= ? AND maxLongitude >= ? AND "
+                         "minLatitude <= ? AND maxLatitude >= ?")
+            args.extend([bbox[2], bbox[0], bbox[3], bbox[1]])
+        sql = "SELECT * FROM archives WHERE %s ORDER BY %s, path"%(
+            ' AND '.join(where), order)
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+        return [dict(zip(row.keys(), row))
+                for row in self._db.execute(sql, args)]
+
+    def get(self, filename):
+        """
+        Return the entry of a file, None if not indexed
+        """
+        row = self._db.execute("SELECT * FROM archives WHERE path=?",
+                               (os.path.abspath(filename),)).fetchone()
+        if row is None: return None
+        return dict(zip(row.keys(), row))
+
+    def remove(self, filename):
+        with self._db as db:
+            db.execute("DELETE FROM archives WHERE path=?",
+                       (os.path.abspath(filename),))
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM archives").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,89 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# catalogFiles.py                                              #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Tool for indexing and querying the metadata of Aptofiles     #
+#                                                              #
+################################################################
+
+import argparse
+import json
+import re
+import sys
+from datetime import datetime, timedelta
+
+from catalog import Catalog
+
+UNITS = {'m':'minutes', 'h':'hours', 'd':'days', 'w':'weeks'}
+
+def parseTime(value):
+    # An ISO 8601 time, or a time ago as e.g. '7d'
+    m = re.match(r'^(\d+)([mhdw])$', value)
+    if m is None: return value
+    delta = timedelta(**{UNITS[m.group(2)]:int(m.group(1))})
+    return datetime.utcnow()-delta
+
+def parseBbox(value):
+    bbox = [float(v) for v in value.split(',')]
+    if len(bbox) != 4: raise ValueError(value)
+    return bbox
+
+parser = argparse.ArgumentParser(description="Tool for indexing and "
+                                 "querying the metadata of Aptofiles")
+parser.add_argument('-c', '--catalog',
+                    help="catalog database (default: catalog.sqlite in "
+                    "$APTOFILE_CACHE or ~/.cache/aptofile)")
+commands = parser.add_subparsers(dest='command')
+update = commands.add_parser('update', help="index new and changed files")
+update.add_argument('paths', nargs='+',
+                    help="files, directories or glob patterns to index")
+update.add_argument('-j', '--jobs', type=int, default=None,
+                    help="number of worker processes (default: one per core)")
+update.add_argument('-p', '--pattern', default='*.apt',
+                    help="files searched for in directories "
+                    "(default: %(default)s)")
+update.add_argument('--keep', action='store_true',
+                    help="keep the entries of files that no longer exist")
+query = commands.add_parser('query', help="list the files matching all "
+                            "the conditions given")
+query.add_argument('-t', '--type', help="file type, e.g. image")
+query.add_argument('--since', type=parseTime,
+                   help="earliest time, ISO 8601 or ago as e.g. 7d or 12h")
+query.add_argument('--until', type=parseTime, help="latest time")
+query.add_argument('--creator', help="generator creator")
+query.add_argument('--program', help="generator program")
+query.add_argument('-n', '--name', help="glob pattern of the object name")
+query.add_argument('-s', '--text', help="text in names and descriptions")
+query.add_argument('--bbox', type=parseBbox,
+                   help="minlon,minlat,maxlon,maxlat intersecting the "
+                   "footprint or georeference")
+query.add_argument('--errors', action='store_true',
+                   help="list the files that could not be read")
+query.add_argument('--order', default='time', help="column to order by")
+query.add_argument('--limit', type=int, help="maximum number of files")
+query.add_argument('--jsonl', action='store_true',
+                   help="write a JSON object per file")
+args = parser.parse_args()
+
+with Catalog(args.catalog) as catalog:
+    if args.command == 'update':
+        counts = catalog.update(args.paths, args.jobs, args.pattern,
+                                not args.keep)
+        print ', '.join('%d %s'%(counts[k],k) for k in
+                        ['added','updated','unchanged','failed','removed'])
+        sys.exit(1 if counts['failed'] else 0)
+    try:
+        entries = catalog.query(args.type, args.since, args.until,
+                                args.creator, args.program, args.name,
+                                args.text, args.bbox, args.errors, args.order,
+                                args.limit)
+    except ValueError as e:
+        parser.error(str(e))
+    for entry in entries:
+        if args.jsonl: print json.dumps(entry)
+        elif args.errors: print "%s: %s"%(entry['path'], entry['error'])
+        else: print "%s %-6s %s %s"%(entry['time'], entry['type'],
+                                     entry['path'], entry['name'] or '')
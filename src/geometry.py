@@ -0,0 +1,248 @@
+################################################################
+#                                                              #
+# geometry.py                                                  #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Reading and writing EWKT geometries as numpy arrays          #
+#                                                              #
+################################################################
+
+import re
+import warnings
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TYPES = ['POINT','LINESTRING','POLYGON','MULTIPOINT','MULTILINESTRING',
+         'MULTIPOLYGON']
+# Vertices formatted by one string operation when writing
+EWKT_CHUNK = 2**14
+
+_HEADER = re.compile(r'\s*(?:SRID\s*=\s*(-?\d+)\s*;)?\s*(%s)\s*(ZM|Z|M)?\s*'
+                     r'(\(|EMPTY\s*$)'%'|'.join(sorted(TYPES, reverse=True)),
+                     re.IGNORECASE)
+_TOKENS = re.compile(r'\(|\)|[^()]+')
+
+class Geometry(object):
+    """
+    A geometry of the simple feature types in TYPES
+
+    All vertices are in coords, an array of shape (vertices, dimensions)
+    with x (longitude) and y (latitude) first, then z and m as in zm
+    ('', 'Z', 'M' or 'ZM'). The vertices of ring i (a point, line string
+    or polygon ring) are coords[rings[i]:rings[i+1]], and the rings of
+    part j (a point, line string or polygon) are rings parts[j] to
+    parts[j+1]. srid is the spatial reference id, None if not given.
+    """
+
+    __slots__ = ['type','coords','rings','parts','srid','zm']
+
+    def __init__(self, type, coords, rings=None, parts=None, srid=None,
+                 zm=None):
+        """
+        coords is a sequence of vertices, rings and parts default to a
+        single ring and part of all vertices.
+        """
+        if numpy is None:
+            raise ImportError("Geometry needs the numpy module")
+        type = type.upper()
+        if type not in TYPES:
+            raise ValueError("Unknown geometry type: %r"%type)
+        coords = numpy.asarray(coords, dtype=float)
+        if coords.ndim != 2: coords = coords.reshape(len(coords) and -1, 2)
+        if rings is None: rings = [0, len(coords)] if len(coords) else [0]
+        if parts is None: parts = [0, len(rings)-1] if len(coords) else [0]
+        if zm is None: zm = ['','','','Z','ZM'][coords.shape[1]]
+        if coords.shape[1] != 2+len(zm):
+            raise ValueError("Vertices of %d dimensions for %r"%(
+                coords.shape[1], zm))
+        self.type = type
+        self.coords = coords
+        self.rings = numpy.asarray(rings, dtype=numpy.int64)
+        self.parts = numpy.asarray(parts, dtype=numpy.int64)
+        self.srid = srid
+        self.zm = zm.upper()
+
+    @property
+    def vertexCount(self): return len(self.coords)
+
+    @property
+    def bbox(self):
+        """
+        (minx, miny, maxx, maxy) of the vertices, None if empty
+        """
+        if not len(self.coords): return None
+        xy = self.coords[:,:2]
+        return tuple(xy.min(0).tolist()+xy.max(0).tolist())
+
+    def getRings(self):
+        """
+        Return the vertices of each ring, as views of coords
+        """
+        return [self.coords[a:b] for a, b in zip(self.rings[:-1],
+                                                   self.rings[1:])]
+
+    def getParts(self):
+        """
+        Return the rings of each part, as lists of views of coords
+        """
+        rings = self.getRings()
+        return [rings[a:b] for a, b in zip(self.parts[:-1], self.parts[1:])]
+
+    def iterEWKT(self):
+        """
+        Generate the EWKT of the geometry in pieces, e.g. for writing
+        large geometries to an archive without joining them:
+
+        af.setRouteGeometry((geometry.iterEWKT(),'route.ewkt'))
+        """
+        header = self.type + (' '+self.zm if self.zm else '')
+        if self.srid is not None: header = 'SRID=%d;%s'%(self.srid, header)
+        if not len(self.coords):
+            yield header+' EMPTY'
+            return
+        yield header
+        multi = self.type.startswith('MULTI')
+        polygon = self.type.endswith('POLYGON')
+        if multi: yield '('
+        for j, part in enumerate(self.getParts()):
+            if j: yield ', '
+            if polygon: yield '('
+            for i, ring in enumerate(part):
+                yield ', (' if i else '('
+                for text in _formatRing(ring): yield text
+                yield ')'
+            if polygon: yield ')'
+        if multi: yield ')'
+
+    def toEWKT(self):
+        return ''.join(self.iterEWKT())
+
+    def __eq__(self, other):
+        return isinstance(other, Geometry) and \
+            (self.type, self.srid, self.zm) == \
+            (other.type, other.srid, other.zm) and \
+            numpy.array_equal(self.coords, other.coords) and \
+            numpy.array_equal(self.rings, other.rings) and \
+            numpy.array_equal(self.parts, other.parts)
+
+    def __ne__(self, other): return not self == other
+
+    def __repr__(self):
+        return "<Geometry %s of %d vertices>"%(self.type, self.vertexCount)
+
+def union(bboxes):
+    """
+    Return the bounding box of bounding boxes, None for none
+
+    None in bboxes is skipped.
+    """
+    bboxes = [b for b in bboxes if b is not None]
+    if not bboxes: return None
+    return (min(b[0] for b in bboxes), min(b[1] for b in bboxes),
+            max(b[2] for b in bboxes), max(b[3] for b in bboxes))
+
+def _formatRing(ring):
+    # A string operation per chunk of vertices, not per vertex
+    vertex = ' '.join(['%r']*ring.shape[1])
+    for i in xrange(0, len(ring), EWKT_CHUNK):
+        block = ring[i:i+EWKT_CHUNK]
+        text = ', '.join([vertex]*len(block))%tuple(block.ravel().tolist())
+        yield ', '+text if i else text
+
+def _valueCounts(text, vertices):
+    # Number of values of each vertex of comma separated vertices,
+    # counted by numpy over the bytes of the text
+    data = numpy.frombuffer(text, numpy.uint8)
+    comma = data == ord(',')
+    # Whitespace and commas
+    separator = (data <= ord(' ')) | comma
+    starts = ~separator
+    starts[1:] &= separator[:-1]
+    commas = numpy.flatnonzero(comma)
+    vertex = numpy.searchsorted(commas, numpy.flatnonzero(starts))
+    return numpy.bincount(vertex, minlength=vertices)
+
+def parse(text):
+    """
+    Parse an EWKT (or WKT) geometry, returning a Geometry
+
+    The structure is read by a tokenizer splitting the text at the
+    parentheses, and the coordinates of all rings are converted to
+    numbers by numpy in one pass. Raises ValueError for invalid or
+    unsupported geometries.
+    """
+    if numpy is None:
+        raise ImportError("Parsing geometries needs the numpy module")
+    if isinstance(text, unicode): text = text.encode('ascii')
+    m = _HEADER.match(text)
+    if m is None:
+        raise ValueError("Invalid EWKT: %r"%text[:40])
+    srid = int(m.group(1)) if m.group(1) is not None else None
+    type, zm = m.group(2).upper(), (m.group(3) or '').upper()
+    if m.group(4) != '(':
+        return Geometry(type, numpy.empty((0, 2+len(zm))), srid=srid, zm=zm)
+    multi = type.startswith('MULTI')
+    nesting = 1 + multi + type.endswith('POLYGON')
+    tokens = _TOKENS.findall(text, m.start(4))
+    # MULTIPOINT(1 2, 3 4) as well as MULTIPOINT((1 2), (3 4))
+    first = next((t for t in tokens[1:] if t.strip()), None)
+    legacy = type == 'MULTIPOINT' and first is not None and first != '('
+    if legacy: nesting = 1
+    partDepth = 1 if legacy else 1 + multi
+    chunks, parts = [], []
+    depth, last = 0, None
+    for token in tokens:
+        if depth == 0 and last is not None:
+            if token.strip():
+                raise ValueError("Unexpected %r after geometry"%token[:20])
+        elif token == '(':
+            depth += 1
+            if depth > nesting:
+                raise ValueError("Too deeply nested %s"%type)
+            if depth == partDepth: parts.append(len(chunks))
+        elif token == ')':
+            if depth == nesting and last != 'ring':
+                raise ValueError("Empty ring in %s"%type)
+            depth -= 1
+        elif depth == nesting:
+            if not token.strip(): raise ValueError("Empty ring in %s"%type)
+            chunks.append(token)
+            token = 'ring'
+        elif token.strip(' \t\r\n,'):
+            raise ValueError("Unexpected %r in %s"%(token[:20], type))
+        last = token
+    if depth != 0: raise ValueError("Unbalanced parentheses in %s"%type)
+
+    counts = [chunk.count(',')+1 for chunk in chunks]
+    if not zm:
+        dims = len(chunks[0].split(',',1)[0].split())
+        if dims not in (2,3,4):
+            raise ValueError("Vertices of %d dimensions in %s"%(dims, type))
+        zm = ['','Z','ZM'][dims-2]
+    dims = 2+len(zm)
+    vertices = sum(counts)
+    text = ','.join(chunks)
+    if (_valueCounts(text, vertices) != dims).any():
+        raise ValueError("Vertices of other than %d dimensions in %s"%(
+            dims, type))
+    with warnings.catch_warnings():
+        # Text that is not numbers gives fewer values, checked below
+        warnings.simplefilter('ignore', DeprecationWarning)
+        values = numpy.fromstring(text.replace(',',' '), dtype=float,
+                                  sep=' ')
+    if len(values) != vertices*dims:
+        raise ValueError("Invalid coordinates in %s"%type)
+    coords = values.reshape(vertices, dims)
+    if legacy:
+        rings = parts = numpy.arange(vertices+1)
+    else:
+        rings = numpy.zeros(len(counts)+1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=rings[1:])
+        parts = parts+[len(chunks)]
+    if not multi and len(parts) != 2:
+        raise ValueError("Several parts in %s"%type)
+    if type in ('POINT','MULTIPOINT') and vertices != len(rings)-1:
+        raise ValueError("Several vertices in a point of %s"%type)
+    return Geometry(type, coords, rings, parts, srid, zm)
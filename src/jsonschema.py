@@ -1165,6 +1165,667 @@ class ErrorTree(object):
         return len(self.errors) + child_errors
 
 
+class CompiledValidator(object):
+    """
+    A validator which compiles its schema into a tree of closures.
+
+    The schema is walked once, when the validator is created. ``$ref``\s are
+    resolved, type tuples, ``enum`` sets, ``required`` lists and regular
+    expressions are computed, and each schema node becomes a function taking
+    an instance and returning a list of errors. Validating an instance then
+    only calls these functions, without dispatching on keywords or touching
+    the resolver. The errors are the same, and in the same order, as the
+    ones produced by the validator class ``cls``.
+
+    A compiled validator keeps no state while validating, so it may be
+    shared between threads.
+
+    Keywords without a compiled implementation fall back to the
+    ``validate_<keyword>`` methods of ``cls``.
+
+    """
+
+    def __init__(self, schema, cls=None, types=(), resolver=None,
+                 format_checker=None):
+        if cls is None:
+            cls = meta_schemas.get(schema.get("$schema", ""), Draft4Validator)
+        self.cls = cls
+        self.schema = schema
+        self.format_checker = format_checker
+        self._validator = cls(schema, types=types, resolver=resolver,
+                              format_checker=format_checker)
+        self._refs = {}
+        self._check = _Compiler(self._validator, self._refs).compile(schema)
+
+    @property
+    def resolver(self):
+        return self._validator.resolver
+
+    def iter_errors(self, instance, _schema=None):
+        if _schema is not None:
+            return self._validator.iter_errors(instance, _schema)
+        return iter(self._check(instance))
+
+    def is_valid(self, instance, _schema=None):
+        if _schema is not None:
+            return self._validator.is_valid(instance, _schema)
+        return not self._check(instance)
+
+    def validate(self, *args, **kwargs):
+        for error in self.iter_errors(*args, **kwargs):
+            raise error
+
+    def compile_subschema(self, schema):
+        """
+        Compile a ``schema`` found inside the validator's schema.
+
+        Returns a function taking an instance and returning a list of errors.
+        ``$ref``\s in ``schema`` are resolved relative to the root of the
+        validator's schema.
+
+        """
+
+        return _Compiler(self._validator, self._refs).compile(schema)
+
+
+_NO_ERRORS = ()
+
+
+class _Compiler(object):
+    """
+    Turns a schema into a function which returns the list of errors of an
+    instance.
+
+    """
+
+    def __init__(self, validator, refs):
+        self.validator = validator
+        self.resolver = validator.resolver
+        self.refs = refs
+
+    def compile(self, schema):
+        with self.resolver.in_scope(schema.get("id", "")):
+            ref = schema.get("$ref")
+            if ref is not None:
+                keywords = [("$ref", ref)]
+            else:
+                keywords = list(iteritems(schema))
+
+            checks = []
+            for k, v in keywords:
+                name = k.lstrip("$")
+                method = getattr(self.validator, "validate_%s" % (name,), None)
+                if method is None:
+                    continue
+                compiler = getattr(self, "compile_%s" % (name,), None)
+                if compiler is not None and self._is_draft4(name, method):
+                    check = compiler(v, schema)
+                else:
+                    check = self._fallback(k, v, schema)
+                if check is not None:
+                    checks.append(check)
+
+        if not checks:
+            return lambda instance: _NO_ERRORS
+        if len(checks) == 1:
+            return checks[0]
+
+        def check_all(instance):
+            errors = _NO_ERRORS
+            for check in checks:
+                found = check(instance)
+                if found:
+                    if errors:
+                        errors.extend(found)
+                    else:
+                        errors = list(found)
+            return errors
+        return check_all
+
+    def _is_draft4(self, name, method):
+        """
+        Check whether the validator implements ``name`` like draft 4.
+
+        Compiled keywords follow :class:`Draft4Validator`, other
+        implementations are used through :meth:`_fallback`.
+
+        """
+
+        draft4 = getattr(Draft4Validator, "validate_%s" % (name,), None)
+        if draft4 is None:
+            return False
+        return getattr(method, "__func__", method) is \
+            getattr(draft4, "__func__", draft4)
+
+    def _fallback(self, k, v, schema):
+        method = getattr(self.validator, "validate_%s" % (k.lstrip("$"),))
+
+        def check(instance):
+            errors = list(method(v, instance, schema) or ())
+            for error in errors:
+                if error.validator is None:
+                    error.validator = k
+            return errors
+        return check
+
+    def _is_type(self, type):
+        """
+        Compile ``is_type`` for a single type name.
+
+        """
+
+        return self._is_types([type])
+
+    def _is_types(self, types):
+        """
+        Compile a check of whether an instance is any of ``types``.
+
+        """
+
+        pytypes = []
+        for type in types:
+            if type not in self.validator._types:
+                raise UnknownType(type)
+            pytypes.extend(_flatten(self.validator._types[type]))
+        pytypes = tuple(pytypes)
+        bool_ok = any(self.validator.is_type(True, type) for type in types)
+
+        def is_type(instance):
+            if isinstance(instance, bool):
+                return bool_ok
+            return isinstance(instance, pytypes)
+        return is_type
+
+    def _subschemas(self, subschemas):
+        return [self.compile(subschema) for subschema in subschemas]
+
+    def compile_ref(self, ref, schema):
+        full_uri = urlparse.urljoin(self.resolver.resolution_scope, ref)
+        target = self.refs.get(full_uri)
+        if target is None:
+            # The cell is registered before compiling, so recursive
+            # references end up pointing at the same cell.
+            target = self.refs[full_uri] = [None]
+            with self.resolver.resolving(ref) as resolved:
+                target[0] = self.compile(resolved)
+        return lambda instance: target[0](instance)
+
+    def compile_type(self, types, schema):
+        types = _list(types)
+        is_type = self._is_types(types)
+
+        def check(instance):
+            if not is_type(instance):
+                return [ValidationError(_types_msg(instance, types),
+                                        validator="type")]
+            return _NO_ERRORS
+        return check
+
+    def compile_properties(self, properties, schema):
+        is_object = self._is_type("object")
+        subschemas = [
+            (property, self.compile(subschema))
+            for property, subschema in iteritems(properties)
+        ]
+
+        def check(instance):
+            if not is_object(instance):
+                return _NO_ERRORS
+            errors = _NO_ERRORS
+            for property, subcheck in subschemas:
+                if property in instance:
+                    found = subcheck(instance[property])
+                    if found:
+                        if not errors:
+                            errors = []
+                        for error in found:
+                            error.path.appendleft(property)
+                            errors.append(error)
+            return errors
+        return check
+
+    def compile_patternProperties(self, patternProperties, schema):
+        is_object = self._is_type("object")
+        subschemas = [
+            (re.compile(pattern).search, self.compile(subschema))
+            for pattern, subschema in iteritems(patternProperties)
+        ]
+
+        def check(instance):
+            if not is_object(instance):
+                return _NO_ERRORS
+            errors = _NO_ERRORS
+            for search, subcheck in subschemas:
+                for k, v in iteritems(instance):
+                    if search(k):
+                        found = subcheck(v)
+                        if found:
+                            if not errors:
+                                errors = []
+                            for error in found:
+                                error.path.appendleft(k)
+                                errors.append(error)
+            return errors
+        return check
+
+    def compile_additionalProperties(self, aP, schema):
+        is_object = self._is_type("object")
+        properties = schema.get("properties", {})
+        patterns = "|".join(schema.get("patternProperties", {}))
+        search = re.compile(patterns).search if patterns else None
+
+        def find_extras(instance):
+            return set(
+                property for property in instance
+                if property not in properties and
+                not (search is not None and search(property))
+            )
+
+        if self.validator.is_type(aP, "object"):
+            subcheck = self.compile(aP)
+
+            def check(instance):
+                if not is_object(instance):
+                    return _NO_ERRORS
+                errors = _NO_ERRORS
+                for extra in find_extras(instance):
+                    found = subcheck(instance[extra])
+                    if found:
+                        if not errors:
+                            errors = []
+                        for error in found:
+                            error.path.appendleft(extra)
+                            errors.append(error)
+                return errors
+        elif not aP:
+            def check(instance):
+                if not is_object(instance):
+                    return _NO_ERRORS
+                extras = find_extras(instance)
+                if extras:
+                    error = "Additional properties are not allowed (%s %s unexpected)"
+                    return [ValidationError(error % _extras_msg(extras),
+                                            validator="additionalProperties")]
+                return _NO_ERRORS
+        else:
+            return None
+        return check
+
+    def compile_items(self, items, schema):
+        is_array = self._is_type("array")
+
+        if self.validator.is_type(items, "object"):
+            subcheck = self.compile(items)
+
+            def check(instance):
+                if not is_array(instance):
+                    return _NO_ERRORS
+                errors = _NO_ERRORS
+                for index, item in enumerate(instance):
+                    found = subcheck(item)
+                    if found:
+                        if not errors:
+                            errors = []
+                        for error in found:
+                            error.path.appendleft(index)
+                            errors.append(error)
+                return errors
+        else:
+            subchecks = self._subschemas(items)
+
+            def check(instance):
+                if not is_array(instance):
+                    return _NO_ERRORS
+                errors = _NO_ERRORS
+                for (index, item), subcheck in zip(enumerate(instance),
+                                                   subchecks):
+                    found = subcheck(item)
+                    if found:
+                        if not errors:
+                            errors = []
+                        for error in found:
+                            error.path.appendleft(index)
+                            errors.append(error)
+                return errors
+        return check
+
+    def compile_additionalItems(self, aI, schema):
+        if self.validator.is_type(schema.get("items", {}), "object"):
+            return None
+        is_array = self._is_type("array")
+        n_items = len(schema.get("items", []))
+
+        if self.validator.is_type(aI, "object"):
+            subcheck = self.compile(aI)
+
+            def check(instance):
+                if not is_array(instance):
+                    return _NO_ERRORS
+                errors = _NO_ERRORS
+                for index, item in enumerate(instance[n_items:]):
+                    found = subcheck(item)
+                    if found:
+                        if not errors:
+                            errors = []
+                        for error in found:
+                            error.path.appendleft(index)
+                            errors.append(error)
+                return errors
+        elif not aI:
+            def check(instance):
+                if is_array(instance) and len(instance) > n_items:
+                    error = "Additional items are not allowed (%s %s unexpected)"
+                    return [ValidationError(
+                        error % _extras_msg(instance[n_items:]),
+                        validator="additionalItems",
+                    )]
+                return _NO_ERRORS
+        else:
+            return None
+        return check
+
+    def compile_minimum(self, minimum, schema):
+        is_number = self._is_type("number")
+        if schema.get("exclusiveMinimum", False):
+            cmp = "less than or equal to"
+            failed = lambda instance: instance <= minimum
+        else:
+            cmp = "less than"
+            failed = lambda instance: instance < minimum
+
+        def check(instance):
+            if is_number(instance):
+                instance = float(instance)
+                if failed(instance):
+                    return [ValidationError(
+                        "%s is %s the minimum of %r" % (instance, cmp, minimum),
+                        validator="minimum",
+                    )]
+            return _NO_ERRORS
+        return check
+
+    def compile_maximum(self, maximum, schema):
+        is_number = self._is_type("number")
+        if schema.get("exclusiveMaximum", False):
+            cmp = "greater than or equal to"
+            failed = lambda instance: instance >= maximum
+        else:
+            cmp = "greater than"
+            failed = lambda instance: instance > maximum
+
+        def check(instance):
+            if is_number(instance):
+                instance = float(instance)
+                if failed(instance):
+                    return [ValidationError(
+                        "%s is %s the maximum of %r" % (instance, cmp, maximum),
+                        validator="maximum",
+                    )]
+            return _NO_ERRORS
+        return check
+
+    def compile_minItems(self, mI, schema):
+        is_array = self._is_type("array")
+
+        def check(instance):
+            if is_array(instance) and len(instance) < mI:
+                return [ValidationError("'%s' is too short" % (instance,),
+                                        validator="minItems")]
+            return _NO_ERRORS
+        return check
+
+    def compile_maxItems(self, mI, schema):
+        is_array = self._is_type("array")
+
+        def check(instance):
+            if is_array(instance) and len(instance) > mI:
+                return [ValidationError("'%s' is too long" % (instance,),
+                                        validator="maxItems")]
+            return _NO_ERRORS
+        return check
+
+    def compile_uniqueItems(self, uI, schema):
+        if not uI:
+            return None
+        is_array = self._is_type("array")
+
+        def check(instance):
+            if is_array(instance) and not _uniq(instance):
+                return [ValidationError(
+                    "'%s' has non-unique elements" % instance,
+                    validator="uniqueItems",
+                )]
+            return _NO_ERRORS
+        return check
+
+    def compile_pattern(self, patrn, schema):
+        is_string = self._is_type("string")
+        search = re.compile(patrn).search
+
+        def check(instance):
+            if is_string(instance) and not search(instance):
+                return [ValidationError(
+                    "'%s' does not match %s" % (instance, patrn),
+                    validator="pattern",
+                )]
+            return _NO_ERRORS
+        return check
+
+    def compile_format(self, format, schema):
+        format_checker = self.validator.format_checker
+        if format_checker is None:
+            return None
+        is_string = self._is_type("string")
+
+        def check(instance):
+            if is_string(instance):
+                try:
+                    format_checker.check(instance, format)
+                except FormatError as e:
+                    return [ValidationError(unicode(e), cause=e.cause,
+                                            validator="format")]
+            return _NO_ERRORS
+        return check
+
+    def compile_minLength(self, mL, schema):
+        is_string = self._is_type("string")
+
+        def check(instance):
+            if is_string(instance) and len(instance) < mL:
+                return [ValidationError("'%s' is too short" % (instance,),
+                                        validator="minLength")]
+            return _NO_ERRORS
+        return check
+
+    def compile_maxLength(self, mL, schema):
+        is_string = self._is_type("string")
+
+        def check(instance):
+            if is_string(instance) and len(instance) > mL:
+                return [ValidationError("'%s' is too long" % (instance,),
+                                        validator="maxLength")]
+            return _NO_ERRORS
+        return check
+
+    def compile_dependencies(self, dependencies, schema):
+        is_object = self._is_type("object")
+        compiled = []
+        for property, dependency in iteritems(dependencies):
+            if self.validator.is_type(dependency, "object"):
+                compiled.append((property, self.compile(dependency)))
+            else:
+                compiled.append((property, _list(dependency)))
+
+        def check(instance):
+            if not is_object(instance):
+                return _NO_ERRORS
+            errors = _NO_ERRORS
+            for property, dependency in compiled:
+                if property not in instance:
+                    continue
+                if callable(dependency):
+                    found = dependency(instance)
+                    for error in found:
+                        if error.validator is None:
+                            error.validator = "dependencies"
+                else:
+                    found = [
+                        ValidationError(
+                            "'%s' is a dependency of '%s'" % (each, property),
+                            validator="dependencies",
+                        )
+                        for each in dependency if each not in instance
+                    ]
+                if found:
+                    if not errors:
+                        errors = []
+                    errors.extend(found)
+            return errors
+        return check
+
+    def compile_enum(self, enums, schema):
+        try:
+            enum_set = frozenset(enums)
+        except TypeError:
+            enum_set = None
+
+        def error(instance):
+            values = ["'%s'" % elm for elm in enums]
+            if len(values) > 1:
+                values = ", ".join(values[:-1]) + " or " + values[-1]
+            else:
+                values = values[0]
+            return [ValidationError("'%s' is not one of %s" % (instance, values),
+                                    validator="enum")]
+
+        def check(instance):
+            if enum_set is not None:
+                try:
+                    if instance in enum_set:
+                        return _NO_ERRORS
+                except TypeError:
+                    pass
+            if instance in enums:
+                return _NO_ERRORS
+            return error(instance)
+        return check
+
+    def compile_required(self, required, schema):
+        is_object = self._is_type("object")
+        required = list(required)
+
+        def check(instance):
+            if not is_object(instance):
+                return _NO_ERRORS
+            missing = [property for property in required
+                       if property not in instance]
+            if missing:
+                return [ValidationError("%s is required property" % property,
+                                        validator="required")
+                        for property in missing]
+            return _NO_ERRORS
+        return check
+
+    def compile_minProperties(self, mP, schema):
+        is_object = self._is_type("object")
+
+        def check(instance):
+            if is_object(instance) and len(instance) < mP:
+                return [ValidationError("%r is too short" % (instance,),
+                                        validator="minProperties")]
+            return _NO_ERRORS
+        return check
+
+    def compile_maxProperties(self, mP, schema):
+        is_object = self._is_type("object")
+
+        def check(instance):
+            if is_object(instance) and len(instance) > mP:
+                return [ValidationError("%r is too long" % (instance,),
+                                        validator="maxProperties")]
+            return _NO_ERRORS
+        return check
+
+    def compile_allOf(self, allOf, schema):
+        subchecks = self._subschemas(allOf)
+
+        def check(instance):
+            errors = _NO_ERRORS
+            for subcheck in subchecks:
+                found = subcheck(instance)
+                if found:
+                    if not errors:
+                        errors = []
+                    errors.extend(found)
+            return errors
+        return check
+
+    def compile_anyOf(self, anyOf, schema):
+        subchecks = self._subschemas(anyOf)
+
+        def check(instance):
+            for subcheck in subchecks:
+                if not subcheck(instance):
+                    return _NO_ERRORS
+            return [ValidationError(
+                "The instance is not valid under any of the given schemas.",
+                validator="anyOf",
+            )]
+        return check
+
+    def compile_oneOf(self, oneOf, schema):
+        subchecks = list(zip(oneOf, self._subschemas(oneOf)))
+
+        def check(instance):
+            valid = [s for s, subcheck in subchecks if not subcheck(instance)]
+            if not valid:
+                return [ValidationError(
+                    "%r is not valid under any of the given schemas." %
+                    (instance,),
+                    validator="oneOf",
+                )]
+            if len(valid) > 1:
+                more_valid = valid[1:] + valid[:1]
+                reprs = ", ".join(repr(s) for s in more_valid)
+                return [ValidationError(
+                    "%r is valid under each of %s" % (instance, reprs),
+                    validator="oneOf",
+                )]
+            return _NO_ERRORS
+        return check
+
+    def compile_not(self, not_schema, schema):
+        subcheck = self.compile(not_schema)
+
+        def check(instance):
+            if not subcheck(instance):
+                return [ValidationError(
+                    "%r is not allowed for %r" % (not_schema, instance),
+                    validator="not",
+                )]
+            return _NO_ERRORS
+        return check
+
+    def compile_multipleOf(self, dB, schema):
+        is_number = self._is_type("number")
+
+        def check(instance):
+            if not is_number(instance):
+                return _NO_ERRORS
+            if isinstance(dB, float):
+                mod = instance % dB
+                failed = (mod > FLOAT_TOLERANCE) and (dB - mod) > FLOAT_TOLERANCE
+            else:
+                failed = instance % dB
+            if failed:
+                return [ValidationError(
+                    "%s is not a multiple of %s" % (instance, dB),
+                    validator="multipleOf",
+                )]
+            return _NO_ERRORS
+        return check
+
+
 def _meta_schemas():
     """
     Collect the urls and meta schemas from each known validator.
@@ -1311,3 +1972,15 @@ def validate(instance, schema, cls=None, *args, **kwargs):
         cls = meta_schemas.get(schema.get("$schema", ""), Draft4Validator)
     cls.check_schema(schema)
     cls(schema, *args, **kwargs).validate(instance)
+
+
+def compile_validator(schema, cls=None, *args, **kwargs):
+    """
+    Check ``schema`` and return a :class:`CompiledValidator` for it.
+
+    """
+
+    if cls is None:
+        cls = meta_schemas.get(schema.get("$schema", ""), Draft4Validator)
+    cls.check_schema(schema)
+    return CompiledValidator(schema, cls, *args, **kwargs)
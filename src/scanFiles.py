@@ -0,0 +1,49 @@
+#! /usr/bin/python
+
+################################################################
+#                                                              #
+# scanFiles.py                                                 #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Tool for listing the manifests of many Aptofiles             #
+#                                                              #
+################################################################
+
+import argparse
+import json
+import sys
+
+from scanner import scan
+
+parser = argparse.ArgumentParser(description="Tool for listing the "
+                                 "manifests of Aptofiles")
+parser.add_argument('paths', nargs='+',
+                    help="files, directories or glob patterns to scan")
+parser.add_argument('-f', '--fields', default='type,date,description',
+                    help="comma separated manifest fields, e.g. "
+                    "'type,generator.program', or 'all' for the manifest "
+                    "(default: %(default)s)")
+parser.add_argument('-j', '--jobs', type=int, default=None,
+                    help="number of worker processes (default: one per core)")
+parser.add_argument('-p', '--pattern', default='*.apt',
+                    help="files searched for in directories "
+                    "(default: %(default)s)")
+parser.add_argument('--jsonl', action='store_true',
+                    help="write a JSON object per file")
+args = parser.parse_args()
+
+fields = None if args.fields == 'all' else args.fields.split(',')
+failed = 0
+for result in scan(args.paths, args.jobs, fields, args.pattern):
+    if not result.ok: failed += 1
+    if args.jsonl:
+        print json.dumps(result.asDict(fields))
+    elif not result.ok:
+        print "%s: failed: %s"%(result.filename, result.error)
+    elif fields:
+        print "%s: %s"%(result.filename,
+                        ' '.join(unicode(result.data[f]) for f in fields))
+    else:
+        print "%s: %s"%(result.filename, json.dumps(result.data))
+    sys.stdout.flush()
+sys.exit(1 if failed else 0)
@@ -0,0 +1,293 @@
+################################################################
+#                                                              #
+# scanner.py                                                   #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Reading the manifests of many files in parallel              #
+#                                                              #
+################################################################
+
+import collections
+import fnmatch
+import glob
+import multiprocessing
+import os
+import time
+
+from aptofile import Aptofile
+from validationcache import CachedError
+
+# Fields read from the archive comment when it has a summary
+SUMMARY_FIELDS = ['type','date','manifest_version']
+# Number of files read by one task
+CHUNK_SIZE = 16
+# Number of files validated by one task, few as validating takes long
+VALIDATE_CHUNK_SIZE = 1
+
+class ScanResult(object):
+    """
+    Result of reading the manifest of a file
+
+    filename  name of the file
+    data      the manifest, or a dict of the fields asked for
+    error     description of the problem, None if the file was read
+    """
+
+    __slots__ = ['filename','data','error']
+
+    def __init__(self, filename, data=None, error=None):
+        self.filename = filename
+        self.data = data
+        self.error = error
+
+    @property
+    def ok(self): return self.error is None
+
+    def asDict(self, fields=None):
+        """
+        Return the result as a dict for JSON output
+
+        With fields, these are keys of the dict, otherwise the manifest
+        is the value of 'manifest'. Errors are the value of 'error'.
+        """
+        d = {'file':self.filename}
+        if self.error is not None: d['error'] = self.error
+        elif fields: d.update(self.data)
+        else: d['manifest'] = self.data
+        return d
+
+    def __repr__(self):
+        return "<ScanResult %s %s>"%(self.filename, self.error or 'ok')
+
+class ValidationResult(object):
+    """
+    Result of validating a file
+
+    filename  name of the file
+    valid     True if the file is valid
+    failed    list of (testname, exception type name, message) of the
+              failed tests, the test 'open' if the file could not be opened
+    time      seconds used for validating
+    cached    True if the result was taken from the cache, False if not
+              cached, None without a cache
+    """
+
+    __slots__ = ['filename','valid','failed','time','cached']
+
+    def __init__(self, filename, valid, failed=(), time=0.0, cached=None):
+        self.filename = filename
+        self.valid = valid
+        self.failed = list(failed)
+        self.time = time
+        self.cached = cached
+
+    @property
+    def readable(self):
+        return not any(test == 'open' for test, tp, msg in self.failed)
+
+    def asDict(self):
+        """
+        Return the result as a dict for JSON output
+        """
+        return {'file':self.filename, 'valid':self.valid, 'time':self.time,
+                'failed':[{'test':test,'type':tp,'message':msg}
+                          for test, tp, msg in self.failed]}
+
+    def __repr__(self):
+        return "<ValidationResult %s %s>"%(self.filename,
+                                           'valid' if self.valid else 'invalid')
+
+def fileType(manifest):
+    for fileType in Aptofile.FILETYPES:
+        if manifest.has_key(fileType): return fileType
+    return None
+
+def getField(manifest, field):
+    """
+    Return a field of a manifest, None if not found
+
+    field is a key, or keys joined by '.' for nested objects (e.g.
+    'generator.program'). 'type' is the file type.
+    """
+    if field == 'type': return fileType(manifest)
+    value = manifest
+    for key in field.split('.'):
+        if not isinstance(value, dict) or not value.has_key(key): return None
+        value = value[key]
+    return value
+
+def readFile(filename, fields=None):
+    """
+    Read the manifest, or the fields of it, of a file
+
+    Fields in the summary of the archive comment are read from there,
+    other fields from the manifest only. See Aptofile.getSummaryFromFile()
+    and Aptofile.getManifestFromFile().
+    """
+    if fields and all(f in SUMMARY_FIELDS for f in fields):
+        summary = Aptofile.getSummaryFromFile(filename)
+        if summary is not None:
+            return dict((f,summary.get(f)) for f in fields)
+    manifest = Aptofile.getManifestFromFile(filename)
+    if not fields: return manifest
+    return dict((f,getField(manifest,f)) for f in fields)
+
+def _scanChunk(args):
+    # Plain tuples, picklable for process pools
+    filenames, fields = args
+    results = []
+    for filename in filenames:
+        try:
+            results.append((filename, readFile(filename, fields), None))
+        except Exception as e:
+            results.append((filename, None, "%s: %s"%(type(e).__name__, e)))
+    return results
+
+def _validateChunk(args):
+    filenames, cache = args
+    results = []
+    for filename in filenames:
+        t0 = time.time()
+        lookups = (cache.hits, cache.misses) if cache is not None else None
+        valid, failed = Aptofile.validateFile(filename, cache, details=True)
+        # Exceptions are not all picklable
+        failed = [(test, e.type if isinstance(e, CachedError)
+                   else type(e).__name__, unicode(e)) for test, e in failed]
+        cached = None
+        if lookups is not None and (cache.hits, cache.misses) != lookups:
+            cached = cache.hits != lookups[0]
+        results.append((filename, valid, failed, time.time()-t0, cached))
+    return results
+
+def _initWorker():
+    # Compiled before forking where processes are forked
+    Aptofile.getValidator()
+
+def findFiles(paths, pattern='*.apt'):
+    """
+    Generate the files of paths
+
+    paths is a list of files, directories and glob patterns. Directories
+    are searched recursively for files matching pattern, glob patterns
+    and files are taken as they are.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for fn in sorted(fnmatch.filter(filenames, pattern)):
+                    yield os.path.join(dirpath, fn)
+        elif glob.has_magic(path):
+            for fn in sorted(glob.glob(path)):
+                if os.path.isdir(fn):
+                    for f in findFiles([fn], pattern): yield f
+                else: yield fn
+        else: yield path
+
+def findChanged(paths, known, pattern='*.apt'):
+    """
+    Return the files of paths that are new or changed, and the number of
+    files that are unchanged
+
+    known is a dict of absolute paths to (size, modification time) of
+    the files as they were. The files are returned as absolute paths.
+    """
+    changed, unchanged = [], 0
+    for filename in findFiles(paths, pattern):
+        path = os.path.abspath(filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if known.get(path) == (st.st_size, st.st_mtime): unchanged += 1
+        else: changed.append(path)
+    return changed, unchanged
+
+def chunked(iterable, size):
+    """
+    Generate lists of size items of iterable, the last one shorter
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
+
+def _workers(workers):
+    return workers or multiprocessing.cpu_count()
+
+def runChunks(task, chunks, workers=None, window=None):
+    """
+    Run task on chunks with a pool of worker processes, generating the
+    results in order with at most window chunks in the pool
+
+    task returns a list of results per chunk, and must be picklable, as
+    a function of a module. With workers 1, or one core, the chunks are
+    run in this process instead.
+    """
+    workers = _workers(workers)
+    if workers <= 1:
+        for chunk in chunks:
+            for result in task(chunk): yield result
+        return
+    window = window or 4*workers
+    _initWorker()
+    pool = multiprocessing.Pool(workers, _initWorker)
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(task, (chunk,)))
+            if len(pending) < window: continue
+            for result in pending.popleft().get(): yield result
+        while pending:
+            for result in pending.popleft().get(): yield result
+        pool.close()
+    finally:
+        # Also when the generator is closed before the end
+        pool.terminate()
+        pool.join()
+
+def scan(paths, workers=None, fields=None, pattern='*.apt', window=None):
+    """
+    Read the manifests of many files, generating a ScanResult per file
+
+    paths is a list of files, directories and glob patterns, see
+    findFiles(). fields is a list of fields to read instead of the whole
+    manifest, see getField(). Fields of the archive summary only ('type',
+    'date' and 'manifest_version') are read without the manifest.
+
+    Files are read by a pool of worker processes (default one per core),
+    or in this process if workers is 1. The results are generated in the
+    order of the files, as they are read. At most window tasks of
+    CHUNK_SIZE files (default 4 per worker) are read ahead, which bounds
+    the memory used when the results are consumed slowly. Files that
+    cannot be read give results with an error.
+
+    for result in scan(['/data/survey','/data/*.apt'], fields=['type']):
+        print result.filename, result.data['type']
+    """
+    chunks = ((c, fields) for c in chunked(findFiles(paths, pattern),
+                                           CHUNK_SIZE))
+    for result in runChunks(_scanChunk, chunks, workers, window):
+        yield ScanResult(*result)
+
+def validate(paths, workers=None, cache=None, pattern='*.apt', window=None):
+    """
+    Validate many files, generating a ValidationResult per file
+
+    paths, workers, pattern and window are as for scan(). The schema is
+    compiled once before the worker processes are started, which share
+    it where processes are forked. With a ValidationCache, unchanged
+    files validated before are not validated again, see
+    Aptofile.validateFile(). The lookups of the worker processes, which
+    use copies of the cache, are counted in the hits and misses of cache.
+    """
+    chunks = ((c, cache) for c in chunked(findFiles(paths, pattern),
+                                          VALIDATE_CHUNK_SIZE))
+    pooled = _workers(workers) > 1
+    for result in runChunks(_validateChunk, chunks, workers, window):
+        result = ValidationResult(*result)
+        if pooled and result.cached is not None: cache.count(result.cached)
+        yield result
@@ -0,0 +1,301 @@
+################################################################
+#                                                              #
+# shapefile.py                                                 #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Reading shapefiles (.shp, .shx and .dbf)                     #
+#                                                              #
+################################################################
+
+import struct
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import geometry
+
+# Length of the header of .shp and .shx files
+HEADER_SIZE = 100
+# Records read at a time by Assetfile.iterFeatures()
+BATCH_SIZE = 4096
+# Length of the fixed part of the header of .dbf files, and of a field
+DBF_HEADER_SIZE = 32
+DBF_FIELD_SIZE = 32
+
+SHAPE_TYPES = {0:'Null', 1:'Point', 3:'PolyLine', 5:'Polygon',
+               8:'MultiPoint', 11:'PointZ', 13:'PolyLineZ', 15:'PolygonZ',
+               18:'MultiPointZ', 21:'PointM', 23:'PolyLineM', 25:'PolygonM',
+               28:'MultiPointM', 31:'MultiPatch'}
+
+SHAPE_TYPE_CODES = dict((name, code) for code, name in SHAPE_TYPES.items())
+POINT_TYPES = [1, 11, 21]
+MULTIPOINT_TYPES = [8, 18, 28]
+POLY_TYPES = [3, 5, 13, 15, 23, 25]
+# Types with z values
+Z_TYPES = [11, 13, 15, 18]
+
+class FeatureBatch(object):
+    """
+    Features of a shapefile, with all vertices in arrays
+
+    ids         record numbers of the features, from 0
+    bboxes      array of the (xmin, ymin, xmax, ymax) of each feature
+    coords      array of all vertices, of x, y and z for types with z
+    rings       offsets of the parts (rings of polygons, lines and the
+                points of multipoints) in coords, part i is the vertices
+                coords[rings[i]:rings[i+1]]
+    features    offsets of the features in rings, feature j has parts
+                features[j] to features[j+1], none for null shapes
+    attributes  dict of field names to arrays of the values of the
+                features, see readDbfRecords()
+    shapeType   the shape type number of the shapefile
+    """
+
+    __slots__ = ['ids','bboxes','coords','rings','features','attributes',
+                 'shapeType']
+
+    def __init__(self, ids, bboxes, coords, rings, features, shapeType,
+                 attributes=None):
+        self.ids = ids
+        self.bboxes = bboxes
+        self.coords = coords
+        self.rings = rings
+        self.features = features
+        self.shapeType = shapeType
+        self.attributes = attributes if attributes is not None else {}
+
+    def __len__(self): return len(self.ids)
+
+    def getGeometry(self, j):
+        """
+        Return feature j as a geometry.Geometry, None for a null shape
+
+        Points are POINT, multipoints MULTIPOINT, lines LINESTRING or
+        MULTILINESTRING and polygons POLYGON of all their rings.
+        """
+        first, last = self.features[j], self.features[j+1]
+        if first == last: return None
+        rings = self.rings[first:last+1]-self.rings[first]
+        coords = self.coords[self.rings[first]:self.rings[last]]
+        parts = last-first
+        if self.shapeType in POINT_TYPES: tp, parts = 'POINT', [0, 1]
+        elif self.shapeType in MULTIPOINT_TYPES:
+            tp, parts = 'MULTIPOINT', range(parts+1)
+        elif self.shapeType in (5, 15, 25): tp, parts = 'POLYGON', [0, parts]
+        elif parts == 1: tp, parts = 'LINESTRING', [0, 1]
+        else: tp, parts = 'MULTILINESTRING', range(parts+1)
+        return geometry.Geometry(tp, coords, rings, parts)
+
+    def __repr__(self):
+        return "<FeatureBatch of %d features>"%len(self.ids)
+
+def _gather(data, positions, dtype, count=1):
+    # Values of dtype at positions of a byte array, count per position.
+    # Positions with the same alignment are rows of a view of data with
+    # overlapping rows of count values, so each row is one index.
+    dtype = numpy.dtype(dtype)
+    size = dtype.itemsize
+    values = numpy.empty((len(positions), count), dtype)
+    shifts = positions % size
+    for shift in numpy.flatnonzero(numpy.bincount(shifts)).tolist():
+        rows = max((len(data)-shift)//size-count+1, 0)
+        view = numpy.ndarray((rows, count), dtype, data, shift, (size, size))
+        if shift == shifts[0] and (shifts == shift).all():
+            values[:] = view[(positions-shift)//size]
+        else:
+            select = shifts == shift
+            values[select] = view[(positions[select]-shift)//size]
+    return values
+
+def _ragged(starts, counts, step):
+    # Positions starts[i]+step*k for k below counts[i], for each i
+    before = numpy.cumsum(counts)-counts
+    return numpy.repeat(starts-step*before, counts) + \
+        step*numpy.arange(counts.sum(), dtype=numpy.int64)
+
+def readIndex(data):
+    """
+    Parse records of a .shx file, returning arrays of the offsets of the
+    records in the .shp file and of the offsets of their ends, in bytes
+    """
+    if numpy is None:
+        raise ImportError("Reading shapefile records needs the numpy module")
+    index = numpy.frombuffer(data, '>i4').astype(numpy.int64)
+    offsets = 2*index[0::2]
+    return offsets, offsets+8+2*index[1::2]
+
+def readRecords(block, starts, shapeType, ids, bbox=None):
+    """
+    Parse records of a .shp file, returning a FeatureBatch
+
+    starts are the positions in block of the contents of the records
+    (after the 8 byte record headers), ids their record numbers. With
+    bbox (xmin, ymin, xmax, ymax), only the features intersecting it are
+    parsed. The records are parsed by numpy for all features at once,
+    without Python objects per feature or vertex.
+    """
+    if numpy is None:
+        raise ImportError("Reading shapefile records needs the numpy module")
+    data = numpy.frombuffer(block, numpy.uint8)
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    ids = numpy.asarray(ids, dtype=numpy.int64)
+    if not len(starts):
+        return FeatureBatch(ids, numpy.zeros((0,4)), numpy.zeros((0,2)),
+                            numpy.zeros(1, numpy.int64),
+                            numpy.zeros(1, numpy.int64), shapeType)
+    types = _gather(data, starts, '<i4')[:,0]
+    if ((types != shapeType) & (types != 0)).any():
+        raise ValueError("Records of other shape types than %d"%shapeType)
+    null = types == 0
+    dims = 3 if shapeType in Z_TYPES else 2
+    # Null shapes have no bbox, and are features without parts
+    keep = ~null
+    bboxes = numpy.empty((len(starts), 4))
+    bboxes[null] = numpy.nan
+    if shapeType in POINT_TYPES:
+        xy = _gather(data, starts[keep]+4, '<f8', 2)
+        bboxes[keep] = numpy.hstack([xy, xy])
+    elif shapeType != 0:
+        bboxes[keep] = _gather(data, starts[keep]+4, '<f8', 4)
+    if bbox is not None:
+        keep &= (bboxes[:,0] <= bbox[2]) & (bboxes[:,2] >= bbox[0]) & \
+            (bboxes[:,1] <= bbox[3]) & (bboxes[:,3] >= bbox[1])
+        starts, ids, bboxes = starts[keep], ids[keep], bboxes[keep]
+        keep = keep[keep]
+    valid = starts[keep]
+    if shapeType in POINT_TYPES:
+        coords = _gather(data, valid+4, '<f8', dims)
+        counts = numpy.ones(len(valid), numpy.int64)
+        ringStarts = numpy.arange(len(valid), dtype=numpy.int64)
+        partCounts = counts
+    elif shapeType in MULTIPOINT_TYPES:
+        counts = _gather(data, valid+36, '<i4')[:,0].astype(numpy.int64)
+        pointStarts = valid+40
+        ringStarts = numpy.arange(counts.sum(), dtype=numpy.int64)
+        partCounts = counts
+    elif shapeType in POLY_TYPES:
+        partCounts, counts = _gather(data, valid+36, '<i4', 2).astype(
+            numpy.int64).T
+        pointStarts = valid+44+4*partCounts
+        localStarts = _gather(data, _ragged(valid+44, partCounts, 4), '<i4')
+        ringStarts = localStarts[:,0] + \
+            numpy.repeat(numpy.cumsum(counts)-counts, partCounts)
+    elif shapeType == 0:
+        counts = partCounts = numpy.zeros(0, numpy.int64)
+        ringStarts = numpy.zeros(0, numpy.int64)
+    else:
+        raise ValueError("Unsupported shape type %d"%shapeType)
+    if shapeType not in POINT_TYPES:
+        coords = _gather(data, _ragged(pointStarts, counts, 16), '<f8', 2)
+        if dims == 3:
+            z = _gather(data, _ragged(pointStarts+16*counts+16, counts, 8),
+                        '<f8')
+            coords = numpy.hstack([coords, z])
+    allParts = numpy.zeros(len(keep), numpy.int64)
+    allParts[keep] = partCounts
+    features = numpy.zeros(len(keep)+1, numpy.int64)
+    numpy.cumsum(allParts, out=features[1:])
+    rings = numpy.append(ringStarts, len(coords))
+    return FeatureBatch(ids, bboxes, coords, rings, features, shapeType)
+
+def _column(raw, type, decimals):
+    # Values of a dBase field
+    if type in 'NF':
+        text = numpy.char.strip(raw)
+        empty = text == ''
+        if type == 'N' and decimals == 0 and not empty.any():
+            try:
+                return text.astype(numpy.int64)
+            except (ValueError, OverflowError):
+                pass
+        return numpy.where(empty, 'nan', text).astype(float)
+    if type == 'L': return numpy.in1d(raw, ['T','t','Y','y'])
+    return numpy.char.rstrip(raw, ' \0')
+
+def readDbfRecords(block, header):
+    """
+    Parse records of a .dbf file, returning a dict of field names to
+    arrays of their values
+
+    block is whole records, header as from readDbfHeader(). Numbers
+    ('N' and 'F') are integer arrays for integer fields without blanks,
+    and float arrays with NaN for blanks otherwise. Logicals ('L') are
+    booleans, and other fields strings with the padding stripped.
+    """
+    if numpy is None:
+        raise ImportError("Reading dBase records needs the numpy module")
+    fields = header['fields']
+    offsets = numpy.cumsum([1]+[f[2] for f in fields])[:-1].tolist()
+    dtype = numpy.dtype({'names':['f%d'%i for i in range(len(fields))],
+                         'formats':['S%d'%f[2] for f in fields],
+                         'offsets':offsets,
+                         'itemsize':header['recordLength']})
+    records = numpy.frombuffer(block, dtype)
+    return dict((name, _column(records['f%d'%i], type, decimals))
+                for i, (name, type, length, decimals) in enumerate(fields))
+
+def readHeader(data):
+    """
+    Parse the 100 byte header of a .shp or .shx file
+
+    Returns a dict with the fileLength in bytes, the shapeType number and
+    shapeTypeName, and the bbox (xmin, ymin, xmax, ymax), zRange and
+    mRange of the shapes. Raises ValueError if not a shapefile header.
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("Shapefile header of %d bytes"%len(data))
+    code, length = struct.unpack_from('>i20xi', data)
+    version, shapeType = struct.unpack_from('<2i', data, 28)
+    if code != 9994 or version != 1000:
+        raise ValueError("Not a shapefile header")
+    if shapeType not in SHAPE_TYPES:
+        raise ValueError("Unknown shape type %d"%shapeType)
+    bounds = struct.unpack_from('<8d', data, 36)
+    return {'fileLength':2*length, 'shapeType':shapeType,
+            'shapeTypeName':SHAPE_TYPES[shapeType], 'bbox':bounds[:4],
+            'zRange':bounds[4:6], 'mRange':bounds[6:]}
+
+def recordCount(shxHeader):
+    """
+    Return the number of records of a shapefile from the header of its
+    .shx file, which has 8 bytes per record
+    """
+    return (shxHeader['fileLength']-HEADER_SIZE)//8
+
+def readDbfHeaderLength(data):
+    """
+    Return the number of records, and the length of the header and of a
+    record, from the first 32 bytes of a .dbf file
+    """
+    if len(data) < DBF_HEADER_SIZE:
+        raise ValueError("dBase header of %d bytes"%len(data))
+    records, headerLength, recordLength = struct.unpack_from('<I2H', data, 4)
+    if headerLength < DBF_HEADER_SIZE+1:
+        raise ValueError("Not a dBase header")
+    return records, headerLength, recordLength
+
+def readDbfHeader(data):
+    """
+    Parse the header of a .dbf file, of the length given by
+    readDbfHeaderLength()
+
+    Returns a dict with the number of records, the recordLength, the
+    lastUpdate date as 'YYYY-MM-DD', and the fields as a list of
+    (name, type, length, decimals), where type is a dBase field type,
+    e.g. 'C' for text, 'N' for numbers.
+    """
+    records, headerLength, recordLength = readDbfHeaderLength(data)
+    if len(data) < headerLength:
+        raise ValueError("dBase header of %d bytes"%len(data))
+    year, month, day = struct.unpack_from('<3B', data, 1)
+    fields = []
+    for offset in xrange(DBF_HEADER_SIZE, headerLength-1, DBF_FIELD_SIZE):
+        if data[offset] == '\r': break
+        name, type, length, decimals = struct.unpack_from('<11sc4x2B', data,
+                                                          offset)
+        fields.append((name.split('\0',1)[0], type, length, decimals))
+    return {'records':records, 'recordLength':recordLength,
+            'headerLength':headerLength,
+            'lastUpdate':'%04d-%02d-%02d'%(1900+year, month, day),
+            'fields':fields}
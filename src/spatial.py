@@ -0,0 +1,397 @@
+################################################################
+#                                                              #
+# spatial.py                                                   #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Spatial index of the extents of many Aptofiles, an R-tree    #
+# packed by Sort-Tile-Recursive                                #
+#                                                              #
+################################################################
+
+import math
+import os
+import tempfile
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from aptofile import Aptofile
+import geometry
+from scanner import findChanged, chunked, runChunks, CHUNK_SIZE
+
+# Mean radius of the earth in meters
+EARTH_RADIUS = 6371008.8
+
+def readExtents(filename):
+    """
+    Return the extents of a file as a list of (key, bbox)
+
+    key is None for the extent of the file, and the layer key for the
+    layers of assets. See Aptofile.getExtent(). The extents of geometries
+    and image footprints crossing the antimeridian cross it, see
+    lonLatBbox(). Those of layers are from the shapefile headers, the
+    minimum and maximum longitudes.
+    """
+    with Aptofile.open(filename, validate='none') as af:
+        if af.FILETYPE != 'asset':
+            extents = [(None, _fileExtent(af))]
+        else:
+            layers = af.getManifest()['asset'].get('layers') or {}
+            extents = [(key, af.getLayerExtent(key)) for key in sorted(layers)]
+            extents.append((None, geometry.union(b for k, b in extents)))
+    return [(key, tuple(bbox)) for key, bbox in extents if bbox is not None]
+
+def lonLatBbox(coords):
+    """
+    Return the bbox of an array of (longitude, latitude) in degrees
+
+    Where the longitudes fit in a narrower range across the antimeridian,
+    e.g. 179 and -179, the bbox crosses it, with minLongitude larger than
+    maxLongitude. Coordinates outside -180 to 180, e.g. projected, are
+    taken as they are.
+    """
+    lon, lat = coords[:,0], coords[:,1]
+    bbox = (lon.min(), lat.min(), lon.max(), lat.max())
+    if bbox[2]-bbox[0] > 180 and bbox[0] >= -180 and bbox[2] <= 180:
+        east = lon % 360
+        if east.max()-east.min() < bbox[2]-bbox[0]:
+            bbox = (east.min(), bbox[1], east.max(), bbox[3])
+            bbox = tuple(v-360 if i%2 == 0 and v > 180 else v
+                         for i, v in enumerate(bbox))
+    return tuple(float(v) for v in bbox)
+
+def _fileExtent(af):
+    # As getExtent(), from the coordinates where there are any
+    coords = None
+    if af.FILETYPE in ('point','route','area'):
+        g = af.getGeometry()
+        if g is not None and g.vertexCount: coords = g.coords
+    elif af.FILETYPE == 'image':
+        try:
+            footprint = af.getImageFootprint()
+        except ValueError:
+            footprint = None
+        if footprint is not None: coords = numpy.array(footprint['corners'])
+    if coords is None: return af.getExtent()
+    return lonLatBbox(coords)
+
+def _extentChunk(filenames):
+    results = []
+    for path in filenames:
+        try:
+            st = os.stat(path)
+        except OSError:
+            # Removed since listed
+            continue
+        try:
+            extents, error = readExtents(path), None
+        except Exception as e:
+            extents, error = [], "%s: %s"%(type(e).__name__, e)
+        results.append((path, (st.st_size, st.st_mtime), extents, error))
+    return results
+
+def pack(boxes, size):
+    """
+    Pack boxes in an R-tree of nodes of size children, by Sort-Tile-Recursive
+
+    Returns the order of the boxes in the tree and the levels of the
+    tree from the root, each an array of the boxes of its nodes. The
+    children of node i are nodes i*size to (i+1)*size-1 of the next
+    level, the last level is the boxes in the order of the tree.
+    """
+    n = len(boxes)
+    if n == 0: return numpy.zeros(0, dtype=numpy.int64), []
+    leaves = -(-n//size)
+    slices = int(math.ceil(math.sqrt(leaves)))
+    # Slices of the boxes sorted by the x of their centers, each sorted by y
+    byX = numpy.argsort(boxes[:,0]+boxes[:,2], kind='mergesort')
+    slice = numpy.empty(n, dtype=numpy.int64)
+    slice[byX] = numpy.arange(n)//(slices*size)
+    order = numpy.lexsort((boxes[:,1]+boxes[:,3], slice))
+    level = boxes[order]
+    levels = [level]
+    while len(level) > 1:
+        starts = numpy.arange(0, len(level), size)
+        level = numpy.column_stack(
+            [numpy.minimum.reduceat(level[:,0], starts),
+             numpy.minimum.reduceat(level[:,1], starts),
+             numpy.maximum.reduceat(level[:,2], starts),
+             numpy.maximum.reduceat(level[:,3], starts)])
+        levels.append(level)
+    levels.reverse()
+    return order, levels
+
+def search(levels, size, bbox):
+    """
+    Return the indices in the last level of the boxes intersecting bbox,
+    levels as from pack()
+    """
+    minx, miny, maxx, maxy = bbox
+    if not levels: return numpy.zeros(0, dtype=numpy.int64)
+    children = numpy.arange(size)
+    nodes = numpy.arange(len(levels[0]))
+    for i, level in enumerate(levels):
+        b = level[nodes]
+        nodes = nodes[(b[:,0] <= maxx) & (b[:,2] >= minx) &
+                      (b[:,1] <= maxy) & (b[:,3] >= miny)]
+        if i+1 == len(levels): break
+        nodes = (nodes[:,None]*size+children).ravel()
+        nodes = nodes[nodes < len(levels[i+1])]
+    return nodes
+
+def _strings(values):
+    # Arrays of strings saved without pickling
+    if not values: return numpy.zeros(0, dtype='S1')
+    return numpy.array(values)
+
+def _split(bbox):
+    # A bbox crossing the antimeridian as a part on each side of it
+    minx, miny, maxx, maxy = bbox
+    if minx <= maxx: return [bbox]
+    return [(minx, miny, 180, maxy), (-180, miny, maxx, maxy)]
+
+def _distance(lon, lat, boxes, shifts=(0,)):
+    # Great circle distance in meters to the nearest point of each box,
+    # across the antimeridian with the point shifted by 360 degrees
+    return numpy.minimum.reduce([_boxDistance(lon+shift, lat, boxes)
+                                 for shift in shifts])
+
+def _boxDistance(lon, lat, boxes):
+    lon2 = numpy.radians(numpy.clip(lon, boxes[:,0], boxes[:,2]))
+    lat2 = numpy.radians(numpy.clip(lat, boxes[:,1], boxes[:,3]))
+    lon1, lat1 = math.radians(lon), math.radians(lat)
+    a = numpy.sin((lat2-lat1)/2)**2 + \
+        math.cos(lat1)*numpy.cos(lat2)*numpy.sin((lon2-lon1)/2)**2
+    return 2*EARTH_RADIUS*numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1)))
+
+class SpatialIndex(object):
+    """
+    Spatial index of the extents of Aptofiles
+
+    The extents of points, routes and areas, images and videos, and of
+    assets and each of their layers are kept in an R-tree packed by
+    Sort-Tile-Recursive. update() reads the files that are new or changed
+    since they were indexed. Entries added and removed since the tree was
+    packed are kept beside it, and the tree is packed again when these
+    are more than REPACK of the entries, and when saved. Extents and
+    queries crossing the antimeridian, with minLongitude larger than
+    maxLongitude, are split in a part on each side.
+
+    index = SpatialIndex('/data/spatial.npz')
+    index.update(['/data/surveys'])
+    print index.query((10.0, 63.0, 11.0, 64.0))
+    print index.nearby(10.4344, 63.4181, 5000)
+    """
+
+    FILENAME = 'spatial.npz'
+    # Children of a node of the tree
+    NODE_SIZE = 32
+    # Fraction of the entries added or removed before packing again
+    REPACK = 0.1
+
+    def __init__(self, filename=None):
+        """
+        filename is where the index is saved (default: spatial.npz in the
+        environment variable APTOFILE_CACHE or ~/.cache/aptofile), and
+        read from if it exists
+        """
+        if numpy is None:
+            raise ImportError("SpatialIndex needs the numpy module")
+        if filename is None:
+            directory = os.environ.get('APTOFILE_CACHE',
+                os.path.join(os.path.expanduser('~'),'.cache','aptofile'))
+            if not os.path.isdir(directory): os.makedirs(directory)
+            filename = os.path.join(directory, SpatialIndex.FILENAME)
+        self.filename = filename
+        # Size and modification time of the files indexed, also without extent
+        self._files = {}
+        # The packed tree, with (path, key) of its entries
+        self._items = []
+        self._levels = []
+        self._removed = set()
+        # Entries since packed
+        self._added = []
+        self._addedBoxes = None
+        if os.path.exists(filename): self._load()
+
+    def _load(self):
+        with open(self.filename, 'rb') as fid:
+            data = numpy.load(fid, allow_pickle=False)
+            files = data['files'].tolist()
+            stamps = data['stamps'].tolist()
+            self._files = dict((p, (int(s), m)) for p, (s, m) in
+                               zip(files, stamps))
+            keys = [k or None for k in data['keys'].tolist()]
+            self._items = [(files[i], k) for i, k in
+                           zip(data['paths'].tolist(), keys)]
+            self._levels = [data['level%d'%i]
+                            for i in range(int(data['depth']))]
+
+    def save(self):
+        """
+        Pack the tree and write the index to filename
+        """
+        self._pack()
+        files = sorted(self._files)
+        numbers = dict((p, i) for i, p in enumerate(files))
+        # Files added without a stamp are read again by update()
+        arrays = {'files':_strings(files),
+                  'stamps':numpy.array([self._files[p] or (-1, -1)
+                                        for p in files],
+                                       dtype=float).reshape(-1, 2),
+                  'paths':numpy.array([numbers[p] for p, k in self._items],
+                                      dtype=numpy.int64),
+                  'keys':_strings([k or '' for p, k in self._items]),
+                  'depth':numpy.array(len(self._levels))}
+        for i, level in enumerate(self._levels): arrays['level%d'%i] = level
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.npz')
+        try:
+            with os.fdopen(fd, 'wb') as fid: numpy.savez(fid, **arrays)
+            os.rename(tmp, self.filename)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+    def _entries(self):
+        # The live entries as (path, key) and boxes
+        boxes = self._levels[-1] if self._levels else numpy.zeros((0,4))
+        live = [i for i, (p, k) in enumerate(self._items)
+                if p not in self._removed]
+        items = [self._items[i] for i in live]+[(p, k) for p, k, b in
+                                                self._added]
+        added = numpy.array([b for p, k, b in self._added],
+                            dtype=float).reshape(-1, 4)
+        return items, numpy.concatenate([boxes[live], added])
+
+    def _pack(self):
+        if not self._added and not self._removed: return
+        items, boxes = self._entries()
+        order, self._levels = pack(boxes, self.NODE_SIZE)
+        self._items = [items[i] for i in order]
+        self._removed = set()
+        self._added = []
+        self._addedBoxes = None
+
+    def add(self, path, extents, stamp=None):
+        """
+        Add the extents of a file, replacing those indexed before
+
+        extents is a list of (key, bbox) as from readExtents(), stamp the
+        size and modification time of the file when read.
+        """
+        self.remove(path)
+        self._files[path] = stamp
+        for key, bbox in extents:
+            for part in _split(tuple(bbox)):
+                self._added.append((path, key, part))
+        self._addedBoxes = None
+        if len(self._added) > max(self.NODE_SIZE,
+                                  self.REPACK*len(self._items)):
+            self._pack()
+
+    def remove(self, path):
+        if path not in self._files: return
+        del self._files[path]
+        self._removed.add(path)
+        if any(p == path for p, k, b in self._added):
+            self._added = [e for e in self._added if e[0] != path]
+            self._addedBoxes = None
+        if len(self._removed) > max(self.NODE_SIZE,
+                                    self.REPACK*len(self._items)):
+            self._pack()
+
+    def update(self, paths, workers=None, pattern='*.apt', prune=True):
+        """
+        Index the files of paths that are new or changed, and save the
+        index if changed
+
+        paths, workers, pattern and prune are as for Catalog.update().
+        Returns a dict with the number of files 'added', 'updated',
+        'unchanged', 'failed' (could not be read) and 'removed'.
+        """
+        counts = dict.fromkeys(['added','updated','failed','removed'], 0)
+        changed, counts['unchanged'] = findChanged(paths, self._files, pattern)
+        chunks = chunked(changed, CHUNK_SIZE)
+        for path, stamp, extents, error in runChunks(_extentChunk, chunks,
+                                                     workers):
+            counts['updated' if path in self._files else 'added'] += 1
+            if error is not None: counts['failed'] += 1
+            self.add(path, extents, stamp)
+        if prune:
+            for path in [p for p in self._files if not os.path.exists(p)]:
+                self.remove(path)
+                counts['removed'] += 1
+        if changed or counts['removed']: self.save()
+        return counts
+
+    def _search(self, bbox):
+        # Indices of the entries of the tree and of those added since
+        parts = [self._searchPart(part) for part in _split(bbox)]
+        if len(parts) == 1: return parts[0]
+        return (sorted(set(i for found, added in parts for i in found)),
+                sorted(set(i for found, added in parts for i in added)))
+
+    def _searchPart(self, bbox):
+        found = []
+        if self._levels:
+            found = search(self._levels, self.NODE_SIZE, bbox).tolist()
+            if self._removed:
+                found = [i for i in found
+                         if self._items[i][0] not in self._removed]
+        if not self._added: return found, []
+        if self._addedBoxes is None:
+            self._addedBoxes = numpy.array([b for p, k, b in self._added],
+                                           dtype=float)
+        b = self._addedBoxes
+        minx, miny, maxx, maxy = bbox
+        return found, numpy.nonzero((b[:,0] <= maxx) & (b[:,2] >= minx) &
+                                    (b[:,1] <= maxy) & (b[:,3] >= miny)
+                                    )[0].tolist()
+
+    def queryEntries(self, bbox):
+        """
+        Return the entries intersecting bbox, as (path, key, bbox)
+
+        bbox is (minLongitude, minLatitude, maxLongitude, maxLatitude).
+        key is None for the extent of the file and the layer key for
+        the layers of assets.
+        """
+        found, added = self._search(bbox)
+        boxes = self._levels[-1][found].tolist() if found else []
+        return [self._items[i]+(tuple(b),) for i, b in zip(found, boxes)] + \
+            [self._added[i] for i in added]
+
+    def query(self, bbox):
+        """
+        Return the files with an extent intersecting bbox, sorted
+        """
+        found, added = self._search(bbox)
+        items, entries = self._items, self._added
+        return sorted(set([items[i][0] for i in found] +
+                          [entries[i][0] for i in added]))
+
+    def nearby(self, lon, lat, radius):
+        """
+        Return the files with an extent within radius meters of a point,
+        sorted, also across the antimeridian
+        """
+        dlat = math.degrees(radius/EARTH_RADIUS)
+        coslat = math.cos(math.radians(min(abs(lat)+dlat, 90)))
+        dlon = 180 if coslat < 1e-9 else min(dlat/coslat, 180)
+        minx, maxx = lon-dlon, lon+dlon
+        # Across the antimeridian, the box crosses it
+        wraps = minx < -180 or maxx > 180
+        if maxx-minx >= 360: minx, maxx = -180, 180
+        elif minx < -180: minx += 360
+        elif maxx > 180: maxx -= 360
+        entries = self.queryEntries((minx, lat-dlat, maxx, lat+dlat))
+        if not entries: return []
+        boxes = numpy.array([b for p, k, b in entries], dtype=float)
+        shifts = (-360, 0, 360) if wraps else (0,)
+        near = _distance(lon, lat, boxes, shifts) <= radius
+        return sorted(set(e[0] for e, n in zip(entries, near.tolist()) if n))
+
+    def __len__(self):
+        return len(self._files)
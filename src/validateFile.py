@@ -11,19 +11,68 @@
 ################################################################
 
 import argparse
+import json
+import sys
+import time
 
-from aptofile import Aptofile
-parser = argparse.ArgumentParser(description="Tool for validating Aptofiles")
-parser.add_argument('filename', help="name of aptofile to be validated")
-args = parser.parse_args()
+from validationcache import ValidationCache
+from scanner import validate
 
-f = args.filename
-print "Checking file '%s'... "%f,
-with Aptofile.open(f) as af:
-    if not af.validate():
-        print "failed!"
-        for test, msg in af.getFailedTests():
-            print "Test '%s' failed: %s"%(test,msg)
-    else: print "ok"
+# Exit codes
+VALID = 0
+INVALID = 1
+USAGE = 2
+UNREADABLE = 3
 
+EPILOG = """exit status: %d if all files are valid, %d if some file is invalid,
+%d on usage errors or when no files are found and %d if some file could
+not be opened"""%(VALID, INVALID, USAGE, UNREADABLE)
 
+def main():
+    parser = argparse.ArgumentParser(description="Tool for validating Aptofiles",
+                                     epilog=EPILOG)
+    parser.add_argument('paths', nargs='+', metavar='path',
+                        help="aptofile, directory or glob pattern")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="number of worker processes, 0 for one per core")
+    parser.add_argument('-p', '--pattern', default='*.apt',
+                        help="pattern of files searched in directories")
+    parser.add_argument('-c', '--cache',
+                        help="directory of a validation cache")
+    parser.add_argument('--jsonl', action='store_true',
+                        help="print a JSON object per file")
+    args = parser.parse_args()
+
+    cache = ValidationCache(args.cache) if args.cache else None
+    counts = {'valid':0, 'invalid':0, 'unreadable':0}
+    t0 = time.time()
+    for result in validate(args.paths, args.jobs, cache, args.pattern):
+        if not result.readable: counts['unreadable'] += 1
+        elif result.valid: counts['valid'] += 1
+        else: counts['invalid'] += 1
+        if args.jsonl:
+            print json.dumps(result.asDict())
+            sys.stdout.flush()
+            continue
+        print "Checking file '%s'... "%result.filename,
+        if result.valid: print "ok"
+        else:
+            print "failed!"
+            for test, tp, msg in result.failed:
+                print "Test '%s' failed: %s: %s"%(test,tp,msg)
+    dt = time.time()-t0
+    files = sum(counts.values())
+
+    # Keeps the JSON Lines on stdout parseable
+    out = sys.stderr if args.jsonl else sys.stdout
+    print >>out, "%d files in %.2f s: %d valid, %d invalid, %d unreadable"%(
+        files, dt, counts['valid'], counts['invalid'], counts['unreadable'])
+    if not files:
+        print >>sys.stderr, "No files found"
+        return USAGE
+    if counts['unreadable']: return UNREADABLE
+    if counts['invalid']: return INVALID
+    return VALID
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+################################################################
+#                                                              #
+# validationcache.py                                           #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Validation results of many Aptofiles, kept in SQLite         #
+#                                                              #
+################################################################
+
+import hashlib
+import json
+import os
+import threading
+import zipfile
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from aptofile import Aptofile, ValidatorRegistry
+import ziptools
+
+class CachedError(Exception):
+    """
+    Failed test from a ValidationCache, with the type name of the
+    exception raised by the test in type
+    """
+    def __init__(self, type, message):
+        Exception.__init__(self, message)
+        self.type = type
+
+class ValidationCache(object):
+    """
+    Validation results of files, kept in an SQLite database
+
+    A result is used while the path, size and modification time of the
+    file, a hash of its central directory and the hash of the schema are
+    unchanged. Results of other schemas are removed when the cache is
+    opened. The cache may be shared by threads and processes, each
+    process connects to the database when first used.
+
+    hits and misses count the lookups by get() since the cache was opened,
+    with those of worker processes of scanner.validate() added by count().
+    """
+
+    FILENAME = 'validation.sqlite'
+
+    def __init__(self, directory=None, schema=None):
+        """
+        directory is where the database is kept (default: the environment
+        variable APTOFILE_CACHE or ~/.cache/aptofile) and schema the schema
+        validated against (default: Aptofile.SCHEMA).
+        """
+        if sqlite3 is None:
+            raise ImportError("ValidationCache needs the sqlite3 module")
+        if directory is None:
+            directory = os.environ.get('APTOFILE_CACHE',
+                os.path.join(os.path.expanduser('~'),'.cache','aptofile'))
+        if not os.path.isdir(directory): os.makedirs(directory)
+        self.filename = os.path.join(directory, ValidationCache.FILENAME)
+        if schema is None: schema = Aptofile.SCHEMA
+        self.schemaHash = ValidatorRegistry.schemaHash(schema)
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute("""CREATE TABLE IF NOT EXISTS validation (
+                                  path TEXT, depth TEXT, size INTEGER,
+                                  mtime REAL, directory TEXT, schema TEXT,
+                                  valid INTEGER, failed TEXT,
+                                  PRIMARY KEY (path, depth))""")
+                db.execute("DELETE FROM validation WHERE schema != ?",
+                           (self.schemaHash,))
+
+    def __getstate__(self):
+        # For process pools, which connect on their own
+        return {'filename':self.filename, 'schemaHash':self.schemaHash}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # A connection per process, not shared with forked children
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.filename, timeout=60,
+                                       check_same_thread=False)
+            self._pid = os.getpid()
+        return self._db
+
+    @staticmethod
+    def fingerprint(filename):
+        """
+        Return the absolute path, size, modification time and central
+        directory hash of a file
+
+        The hash is empty for files that are not zip archives.
+        """
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        digest = ''
+        with open(path,'rb') as fp:
+            try:
+                start, size = ziptools.endRecord(fp)[:2]
+                fp.seek(start)
+                digest = hashlib.sha1(fp.read(size)).hexdigest()
+            except (zipfile.BadZipfile, IOError):
+                pass
+        return path, st.st_size, st.st_mtime, digest
+
+    def get(self, filename, depth='full', fingerprint=None):
+        """
+        Return the cached (valid, failedTests) of a file, None if not cached
+
+        failedTests is a list of (testname, CachedError). fingerprint is
+        as from fingerprint(), which is called if not given.
+        """
+        path, size, mtime, digest = fingerprint or self.fingerprint(filename)
+        with self._lock:
+            row = self._connect().execute(
+                """SELECT valid, failed FROM validation WHERE path=? AND
+                   depth=? AND size=? AND mtime=? AND directory=? AND
+                   schema=?""",
+                (path, depth, size, mtime, digest, self.schemaHash)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return bool(row[0]), [(test, CachedError(tp, msg))
+                              for test, tp, msg in json.loads(row[1])]
+
+    def put(self, filename, valid, failedTests, depth='full', fingerprint=None):
+        """
+        Store the result of validating a file
+
+        fingerprint should be taken before validating, so a file changed
+        meanwhile is validated again.
+        """
+        path, size, mtime, digest = fingerprint or self.fingerprint(filename)
+        failed = json.dumps([(test, getattr(e,'type',type(e).__name__),
+                              unicode(e)) for test, e in failedTests])
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute("""INSERT OR REPLACE INTO validation
+                              VALUES (?,?,?,?,?,?,?,?)""",
+                           (path, depth, size, mtime, digest, self.schemaHash,
+                            int(valid), failed))
+
+    def count(self, hit):
+        """
+        Count a lookup made by a copy of the cache in another process
+        """
+        with self._lock:
+            if hit: self.hits += 1
+            else: self.misses += 1
+
+    def getStatistics(self):
+        """
+        Return a dict with the hits and misses since the cache was opened
+        and the number of entries
+        """
+        with self._lock:
+            entries = self._connect().execute(
+                "SELECT COUNT(*) FROM validation").fetchone()[0]
+        return {'hits':self.hits, 'misses':self.misses, 'entries':entries}
+
+    def clear(self):
+        with self._lock:
+            db = self._connect()
+            with db: db.execute("DELETE FROM validation")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None and self._pid == os.getpid():
+                self._db.close()
+            self._db = None
@@ -0,0 +1,85 @@
+################################################################
+#                                                              #
+# worldfile.py                                                 #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Footprints of images from worldfiles and image headers       #
+#                                                              #
+################################################################
+
+import struct
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+# JPEG start of frame markers, which have the size of the image
+JPEG_SOF = set([0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb,
+                0xcd, 0xce, 0xcf])
+# JPEG markers without a length
+JPEG_STANDALONE = set([0x01]+range(0xd0, 0xd8))
+
+def readWorldfile(text):
+    """
+    Parse a worldfile, returning its parameters (A, D, B, E, C, F)
+
+    The centre of the pixel in column i and row j of the image is at
+    x = A*i + B*j + C and y = D*i + E*j + F, in the order of the lines
+    of the worldfile. Raises ValueError if not a worldfile.
+    """
+    values = text.split()
+    if len(values) != 6:
+        raise ValueError("Worldfile of %d values"%len(values))
+    try:
+        return tuple(float(v) for v in values)
+    except ValueError:
+        raise ValueError("Invalid worldfile: %r"%text[:40])
+
+def readImageSize(f):
+    """
+    Return the (width, height) in pixels of a PNG or JPEG image, read
+    from the header of the open file f without decoding the image
+
+    Only the header of PNG images and the markers before the start of
+    the frame of JPEG images are read, seeking past the other segments,
+    e.g. Exif data. Raises ValueError for other or truncated images.
+    """
+    start = f.read(24)
+    if start.startswith(PNG_SIGNATURE):
+        if len(start) < 24 or start[12:16] != 'IHDR':
+            raise ValueError("Invalid PNG header")
+        return struct.unpack('>2I', start[16:24])
+    if not start.startswith('\xff\xd8'):
+        raise ValueError("Not a PNG or JPEG image")
+    position = 2
+    while True:
+        f.seek(position)
+        segment = f.read(9)
+        if len(segment) < 4 or segment[0] != '\xff':
+            raise ValueError("Invalid JPEG marker at %d"%position)
+        marker = ord(segment[1])
+        if marker == 0xff:
+            # Fill byte
+            position += 1
+        elif marker in JPEG_STANDALONE:
+            position += 2
+        elif marker in JPEG_SOF:
+            if len(segment) < 9: raise ValueError("Truncated JPEG frame")
+            height, width = struct.unpack('>2H', segment[5:9])
+            if height == 0:
+                raise ValueError("JPEG height defined after the frame")
+            return width, height
+        elif marker in (0xd9, 0xda):
+            raise ValueError("JPEG image without a frame")
+        else:
+            position += 2+struct.unpack('>H', segment[2:4])[0]
+
+def footprint(parameters, size):
+    """
+    Return the corners of an image of size (width, height) placed by
+    the worldfile parameters, as the (x, y) of the upper left, upper
+    right, lower right and lower left corners of the image
+    """
+    a, d, b, e, c, f = parameters
+    width, height = size
+    # Pixel centres are at whole columns and rows
+    return [(a*i+b*j+c, d*i+e*j+f)
+            for i, j in [(-0.5, -0.5), (width-0.5, -0.5),
+                         (width-0.5, height-0.5), (-0.5, height-0.5)]]
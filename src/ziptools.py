@@ -0,0 +1,1050 @@
+################################################################
+#                                                              #
+# ziptools.py                                                  #
+# Copyright (c) 2013 Aptomar AS, All Rights Reserved           #
+#                                                              #
+# Low level tools for zip archives                             #
+#                                                              #
+################################################################
+
+import zipfile
+import zlib
+import struct
+import os
+import time
+import threading
+import multiprocessing
+import mmap
+import Queue
+
+# Local file header: signature, versions, flags, sizes and name/extra lengths
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_SIGNATURE = 'PK\003\004'
+
+CHUNK_SIZE = 2**20
+# Least amount of data read by one verifying task
+TASK_SIZE = 2**20
+
+class MemberCheck(object):
+    """
+    Result of verifying an archive member
+
+    name      name of the member
+    expected  CRC stored in the archive
+    actual    CRC of the data read, None if the data could not be read
+    size      number of bytes read from the archive
+    error     description of the problem, None if the member is ok
+    """
+
+    __slots__ = ['name','expected','actual','size','error']
+
+    def __init__(self, name, expected, actual=None, size=0, error=None):
+        self.name = name
+        self.expected = expected
+        self.actual = actual
+        self.size = size
+        self.error = error
+
+    @property
+    def ok(self): return self.error is None
+
+    def __repr__(self):
+        return "<MemberCheck %s %s>"%(self.name, self.error or 'ok')
+
+def dataOffset(fp, zinfo):
+    """
+    Return the offset of the data of a member, by reading its local header
+    """
+    fp.seek(zinfo.header_offset)
+    header = fp.read(LOCAL_HEADER.size)
+    if len(header) != LOCAL_HEADER.size:
+        raise zipfile.BadZipfile("Truncated file header: %s"%zinfo.filename)
+    fields = LOCAL_HEADER.unpack(header)
+    if fields[0] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipfile("Bad magic number for file header: %s"%
+                                 zinfo.filename)
+    return zinfo.header_offset + LOCAL_HEADER.size + fields[10] + fields[11]
+
+def _memberTuple(zinfo):
+    # The fields needed for verifying, picklable for process pools
+    return (zinfo.filename, zinfo.header_offset, zinfo.compress_type,
+            zinfo.compress_size, zinfo.file_size, zinfo.CRC, zinfo.flag_bits)
+
+class _Member(object):
+    def __init__(self, t):
+        (self.filename, self.header_offset, self.compress_type,
+         self.compress_size, self.file_size, self.CRC, self.flag_bits) = t
+
+def _verifyMember(fp, member, stop=None):
+    check = MemberCheck(member.filename, member.CRC)
+    try:
+        if member.flag_bits & 0x1:
+            raise zipfile.BadZipfile("Encrypted member")
+        if member.compress_type == zipfile.ZIP_DEFLATED:
+            decompressor = zlib.decompressobj(-15)
+        elif member.compress_type == zipfile.ZIP_STORED:
+            decompressor = None
+        else:
+            raise zipfile.BadZipfile("Unsupported compression method %d"%
+                                     member.compress_type)
+        fp.seek(dataOffset(fp, member))
+        crc = 0
+        fileSize = 0
+        left = member.compress_size
+        while left > 0:
+            if stop is not None and stop.is_set(): return None
+            data = fp.read(min(CHUNK_SIZE, left))
+            if not data:
+                raise zipfile.BadZipfile("Truncated member")
+            left -= len(data)
+            check.size += len(data)
+            if decompressor:
+                data = decompressor.decompress(data)
+            crc = zlib.crc32(data, crc)
+            fileSize += len(data)
+        if decompressor:
+            data = decompressor.flush()
+            crc = zlib.crc32(data, crc)
+            fileSize += len(data)
+        check.actual = crc & 0xffffffff
+        if check.actual != member.CRC:
+            check.error = "Bad CRC-32"
+        elif fileSize != member.file_size:
+            check.error = "Bad file size"
+    except (zipfile.BadZipfile, zlib.error, IOError, struct.error) as e:
+        check.error = str(e)
+    return check
+
+def _verifyChunk(args, stop=None):
+    filename, members, failFast = args
+    checks = []
+    with open(filename,'rb') as fp:
+        for t in members:
+            check = _verifyMember(fp, _Member(t), stop)
+            if check is None: break
+            checks.append(check)
+            if failFast and not check.ok: break
+    return checks
+
+def _chunks(infos, workers):
+    # Large members get a task of their own, small ones are grouped
+    # so each task reads about the same amount of data
+    total = sum(zinfo.compress_size for zinfo in infos)
+    target = max(total//(workers*4), TASK_SIZE)
+    chunk, size = [], 0
+    for zinfo in infos:
+        chunk.append(_memberTuple(zinfo))
+        size += zinfo.compress_size
+        if size >= target:
+            yield chunk
+            chunk, size = [], 0
+    if chunk: yield chunk
+
+def verifyMembers(zf, infos=None, workers=None, processes=False, failFast=False):
+    """
+    Verify the CRC of archive members in parallel
+
+    zf is an open zipfile.ZipFile, infos a list of its members to verify
+    (default all). Each worker reads from its own file handle. workers is
+    the number of workers (default the number of cores). With processes
+    the work is done by a process pool, otherwise by worker threads. Threads
+    are enough for I/O bound stored members, processes also spread the
+    decompression and CRC work of deflated members.
+
+    Returns a list of MemberCheck in the order of infos. With failFast,
+    verifying stops at the first bad member and the list may be incomplete.
+    """
+    if infos is None: infos = zf.infolist()
+    if not infos: return []
+    if workers is None: workers = multiprocessing.cpu_count()
+    filename = zf.filename if isinstance(zf.filename,basestring) else None
+    if zf.fp is not None and zf.mode in ('w','a'): zf.fp.flush()
+    if filename is None or getattr(zf,'_filePassed',0):
+        # Not a file on disk, read through the zipfile instance
+        return _verifySerial(zf, infos, failFast)
+
+    chunks = [(filename, chunk, failFast) for chunk in _chunks(infos, workers)]
+    if workers <= 1 or len(chunks) == 1:
+        checks = []
+        for chunk in chunks:
+            found = _verifyChunk(chunk)
+            checks.extend(found)
+            if failFast and [c for c in found if not c.ok]: break
+        return checks
+
+    order = dict((zinfo.filename,i) for i, zinfo in enumerate(infos))
+    if processes:
+        checks = _verifyProcesses(chunks, workers, failFast)
+    else:
+        checks = _verifyThreads(chunks, workers, failFast)
+    checks.sort(key=lambda c: order.get(c.name,0))
+    return checks
+
+def _verifyThreads(chunks, workers, failFast):
+    tasks = Queue.Queue()
+    for chunk in chunks: tasks.put(chunk)
+    stop = threading.Event()
+    checks = []
+    def work():
+        while not stop.is_set():
+            try: chunk = tasks.get_nowait()
+            except Queue.Empty: return
+            found = _verifyChunk(chunk, stop)
+            checks.extend(found)
+            if failFast and [c for c in found if not c.ok]: stop.set()
+    threads = [threading.Thread(target=work)
+               for i in range(min(workers,len(chunks)))]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return checks
+
+def _verifyProcesses(chunks, workers, failFast):
+    checks = []
+    pool = multiprocessing.Pool(min(workers,len(chunks)))
+    try:
+        for found in pool.imap_unordered(_verifyChunk, chunks):
+            checks.extend(found)
+            if failFast and [c for c in found if not c.ok]: break
+    finally:
+        pool.terminate()
+        pool.join()
+    return checks
+
+def _verifySerial(zf, infos, failFast):
+    checks = []
+    for zinfo in infos:
+        check = MemberCheck(zinfo.filename, zinfo.CRC)
+        try:
+            with zf.open(zinfo) as f:
+                crc = 0
+                while True:
+                    data = f.read(CHUNK_SIZE)
+                    if not data: break
+                    crc = zlib.crc32(data, crc)
+                check.actual = crc & 0xffffffff
+                check.size = zinfo.compress_size
+            if check.actual != zinfo.CRC: check.error = "Bad CRC-32"
+        except (zipfile.BadZipfile, zlib.error, IOError) as e:
+            check.error = str(e)
+        checks.append(check)
+        if failFast and not check.ok: break
+    return checks
+
+class MemberFile(object):
+    """
+    Read only, seekable file object for an archive member
+
+    Stored members are read directly from the archive, so seeking is
+    cheap. Deflated members are decompressed while reading; seeking
+    forward decompresses up to the new position, and seeking backward
+    restarts from the nearest checkpoint, which is saved every
+    CHECKPOINT_SIZE bytes of output. The CRC is not checked.
+    """
+
+    CHECKPOINT_SIZE = 2**22
+    # Compressed data read at a time, checkpoints are saved between reads
+    READ_SIZE = 2**16
+    # Least output decompressed at a time
+    MIN_INFLATE = 2**12
+
+    def __init__(self, zf, zinfo):
+        if zinfo.flag_bits & 0x1:
+            raise zipfile.BadZipfile("Encrypted member: %s"%zinfo.filename)
+        if zinfo.compress_type not in (zipfile.ZIP_STORED,zipfile.ZIP_DEFLATED):
+            raise zipfile.BadZipfile("Unsupported compression method %d"%
+                                     zinfo.compress_type)
+        self.name = zinfo.filename
+        self.size = zinfo.file_size
+        self.zinfo = zinfo
+        if zf.fp is not None and zf.mode in ('w','a'): zf.fp.flush()
+        if isinstance(zf.filename,basestring) and not getattr(zf,'_filePassed',0):
+            self._fp = open(zf.filename,'rb')
+            self._ownFp = True
+        else:
+            self._fp = zf.fp
+            self._ownFp = False
+        self._start = dataOffset(self._fp, zinfo)
+        self._pos = 0
+        self.closed = False
+        if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+            # Checkpoints of (output position, input position, decompressor)
+            self._checkpoints = [(0, 0, zlib.decompressobj(-15))]
+            self._restart(self._checkpoints[0])
+        else:
+            self._checkpoints = None
+
+    def _restart(self, checkpoint):
+        self._outPos, self._inPos, decompressor = checkpoint
+        self._decompressor = decompressor.copy()
+        self._buffer = ''
+
+    def _inflate(self, n):
+        # Decompress until n bytes are buffered or the member ends
+        while len(self._buffer) < n and self._outPos + len(self._buffer) < self.size:
+            tail = self._decompressor.unconsumed_tail
+            if tail:
+                data = tail
+            else:
+                left = self.zinfo.compress_size - self._inPos
+                if left <= 0:
+                    self._buffer += self._decompressor.flush()
+                    break
+                self._fp.seek(self._start + self._inPos)
+                data = self._fp.read(min(self.READ_SIZE, left))
+                if not data:
+                    raise zipfile.BadZipfile("Truncated member: %s"%self.name)
+                self._inPos += len(data)
+            # Small reads, e.g. of headers, decompress little more
+            need = max(n - len(self._buffer), self.MIN_INFLATE)
+            self._buffer += self._decompressor.decompress(data,
+                                                          min(need, CHUNK_SIZE))
+            if not self._decompressor.unconsumed_tail:
+                self._checkpoint()
+
+    def _checkpoint(self):
+        outPos = self._outPos + len(self._buffer)
+        if outPos - self._checkpoints[-1][0] >= self.CHECKPOINT_SIZE:
+            self._checkpoints.append((outPos, self._inPos,
+                                      self._decompressor.copy()))
+
+    def read(self, n=-1):
+        if self.closed: raise ValueError("I/O operation on closed file")
+        if n is None or n < 0: n = self.size - self._pos
+        n = max(0, min(n, self.size - self._pos))
+        if not n: return ''
+        if self._checkpoints is None:
+            self._fp.seek(self._start + self._pos)
+            data = self._fp.read(n)
+        else:
+            self._seekInflated(self._pos)
+            self._inflate(n)
+            data = self._buffer[:n]
+            self._buffer = self._buffer[len(data):]
+            self._outPos += len(data)
+        self._pos += len(data)
+        return data
+
+    def _seekInflated(self, pos):
+        if pos < self._outPos:
+            checkpoint = [c for c in self._checkpoints if c[0] <= pos][-1]
+            self._restart(checkpoint)
+        while self._outPos + len(self._buffer) < pos:
+            self._outPos += len(self._buffer)
+            self._buffer = ''
+            self._inflate(min(pos - self._outPos, CHUNK_SIZE))
+            if not self._buffer: break
+        skip = pos - self._outPos
+        self._buffer = self._buffer[skip:]
+        self._outPos = pos
+
+    def seek(self, offset, whence=0):
+        if self.closed: raise ValueError("I/O operation on closed file")
+        if whence == 1: offset += self._pos
+        elif whence == 2: offset += self.size
+        elif whence != 0: raise ValueError("Invalid whence: %s"%whence)
+        if offset < 0: raise IOError("Negative seek position %d"%offset)
+        self._pos = offset
+
+    def tell(self): return self._pos
+
+    def close(self):
+        if not self.closed and self._ownFp: self._fp.close()
+        self.closed = True
+
+    def __enter__(self): return self
+    def __exit__(self,type,value,tb): self.close()
+
+def view(obj, offset=0, size=None):
+    """
+    Return a read only view of size bytes of obj from offset, without copying
+
+    A buffer object on Python 2, where mmap does not support memoryview,
+    a memoryview otherwise.
+    """
+    if size is None: size = len(obj) - offset
+    try:
+        return buffer(obj, offset, size)
+    except NameError:
+        return memoryview(obj)[offset:offset+size]
+
+class ArchiveMap(object):
+    """
+    Memory map of an archive, giving views of members without copying
+
+    The archive is mapped when first used and mapped again if it has
+    grown past the map (archives open for writing). Views keep the map
+    alive, so they stay valid after close().
+    """
+
+    def __init__(self, zf):
+        self.zf = zf
+        self._map = None
+        self._offsets = {}
+
+    def _mapped(self, end):
+        if self._map is None or len(self._map) < end:
+            if self.zf.fp is not None and self.zf.mode in ('w','a'):
+                self.zf.fp.flush()
+            with open(self.zf.filename,'rb') as fp:
+                self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def _dataOffset(self, zinfo):
+        offset = self._offsets.get(zinfo.header_offset)
+        if offset is None:
+            m = self._mapped(zinfo.header_offset + LOCAL_HEADER.size)
+            fields = LOCAL_HEADER.unpack_from(m, zinfo.header_offset)
+            if fields[0] != LOCAL_HEADER_SIGNATURE:
+                raise zipfile.BadZipfile("Bad magic number for file header: %s"%
+                                         zinfo.filename)
+            offset = zinfo.header_offset + LOCAL_HEADER.size + \
+                fields[10] + fields[11]
+            self._offsets[zinfo.header_offset] = offset
+        return offset
+
+    def canMap(self, zinfo):
+        return (zinfo.compress_type == zipfile.ZIP_STORED and
+                not zinfo.flag_bits & 0x1 and
+                isinstance(self.zf.filename,basestring) and
+                not getattr(self.zf,'_filePassed',0))
+
+    def view(self, zinfo):
+        """
+        Return a view of the data of the member zinfo
+
+        Stored members are views of the map. Other members are read
+        and decompressed by the zipfile, and a view of the data returned.
+        """
+        if not self.canMap(zinfo) or not zinfo.file_size:
+            return view(self.zf.read(zinfo))
+        offset = self._dataOffset(zinfo)
+        m = self._mapped(offset + zinfo.file_size)
+        return view(m, offset, zinfo.file_size)
+
+    def close(self):
+        # Views hold references to the map, which is unmapped when
+        # the last of them is gone
+        self._map = None
+        self._offsets = {}
+
+# Central directory file header, as in zipfile
+CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+CENTRAL_HEADER_SIGNATURE = 'PK\001\002'
+# Least amount of the central directory read at a time when searching it
+SEARCH_SIZE = 2**16
+# Size of the end of the file read first when looking for the end record,
+# which is followed by the archive comment of up to 64 kB
+END_SEARCH_SIZE = 2**10
+
+def endRecord(fp):
+    """
+    Read the end of central directory record at the end of the file
+
+    Returns the offset, size and number of entries of the central
+    directory, the archive comment, and the offset of the archive in the
+    file, which is not 0 if data is prepended to it.
+    """
+    fp.seek(0, 2)
+    filesize = fp.tell()
+    endrec = None
+    for n in [END_SEARCH_SIZE, 2**16 + zipfile.sizeEndCentDir]:
+        start = max(filesize - n, 0)
+        fp.seek(start)
+        data = fp.read()
+        i = data.rfind(zipfile.stringEndArchive)
+        if i >= 0 and len(data) - i >= zipfile.sizeEndCentDir:
+            rec = list(struct.unpack(zipfile.structEndArchive,
+                                     data[i:i+zipfile.sizeEndCentDir]))
+            # The comment ends the file
+            if len(data) - i == zipfile.sizeEndCentDir + \
+                    rec[zipfile._ECD_COMMENT_SIZE]:
+                rec.append(data[i+zipfile.sizeEndCentDir:])
+                rec.append(start + i)
+                endrec = zipfile._EndRecData64(fp, start + i - filesize, rec)
+                break
+        if start == 0: break
+    if not endrec: raise zipfile.BadZipfile("File is not a zip file")
+    size = endrec[zipfile._ECD_SIZE]
+    offset = endrec[zipfile._ECD_OFFSET]
+    # Data prepended to the archive moves all offsets
+    concat = endrec[zipfile._ECD_LOCATION] - size - offset
+    if endrec[zipfile._ECD_SIGNATURE] == zipfile.stringEndArchive64:
+        concat -= zipfile.sizeEndCentDir64 + zipfile.sizeEndCentDir64Locator
+    return (offset + concat, size, endrec[zipfile._ECD_ENTRIES_TOTAL],
+            endrec[zipfile._ECD_COMMENT], concat)
+
+def _centralEntry(fp, pos, concat):
+    # The ZipInfo of the central directory entry at pos, as by zipfile
+    fp.seek(pos)
+    centdir = CENTRAL_HEADER.unpack(fp.read(CENTRAL_HEADER.size))
+    x = zipfile.ZipInfo(fp.read(centdir[12]))
+    x.extra = fp.read(centdir[13])
+    x.comment = fp.read(centdir[14])
+    (x.create_version, x.create_system, x.extract_version, x.reserved,
+     x.flag_bits, x.compress_type, t, d,
+     x.CRC, x.compress_size, x.file_size) = centdir[1:12]
+    x.volume, x.internal_attr, x.external_attr = centdir[15:18]
+    x.header_offset = centdir[18]
+    x._raw_time = t
+    x.date_time = ((d>>9)+1980, (d>>5)&0xF, d&0x1F,
+                   t>>11, (t>>5)&0x3F, (t&0x1F)*2)
+    x._decodeExtra()
+    x.header_offset += concat
+    return x
+
+def findMember(fp, name):
+    """
+    Return the ZipInfo of the member name, None if not found
+
+    Only the end of the file and the part of the central directory up
+    to the entry are read, not every entry as by zipfile.ZipFile. The
+    first entry is looked at first, then the directory is searched from
+    the end, where the members written last are.
+    """
+    start, size, entries, comment, concat = endRecord(fp)
+    fp.seek(start)
+    head = fp.read(min(size, CENTRAL_HEADER.size + len(name)))
+    if head[:4] == CENTRAL_HEADER_SIGNATURE and \
+            head[CENTRAL_HEADER.size:] == name and \
+            CENTRAL_HEADER.unpack(head[:CENTRAL_HEADER.size])[12] == len(name):
+        return _centralEntry(fp, start, concat)
+    pos = start + size
+    tail = ''
+    while pos > start:
+        n = min(SEARCH_SIZE, pos - start)
+        pos -= n
+        fp.seek(pos)
+        block = fp.read(n) + tail
+        i = len(block)
+        while True:
+            i = block.rfind(name, 0, i)
+            if i < 0: break
+            header = block[i-CENTRAL_HEADER.size:i]
+            if i >= CENTRAL_HEADER.size and \
+                    header[:4] == CENTRAL_HEADER_SIGNATURE and \
+                    CENTRAL_HEADER.unpack(header)[12] == len(name):
+                return _centralEntry(fp, pos + i - CENTRAL_HEADER.size,
+                                     concat)
+        # Keep enough for a header and name crossing the block boundary
+        tail = block[:CENTRAL_HEADER.size + len(name)]
+    return None
+
+def readMember(fp, zinfo):
+    """
+    Return the data of the member zinfo, found by findMember()
+    """
+    if zinfo.flag_bits & 0x1:
+        raise RuntimeError("File %s is encrypted"%zinfo.filename)
+    fp.seek(dataOffset(fp, zinfo))
+    data = fp.read(zinfo.compress_size)
+    if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+        data = zlib.decompress(data, -15)
+    elif zinfo.compress_type != zipfile.ZIP_STORED:
+        raise NotImplementedError("Compression method %d not supported"%
+                                  zinfo.compress_type)
+    if zlib.crc32(data) & 0xffffffff != zinfo.CRC:
+        raise zipfile.BadZipfile("Bad CRC-32 for file %s"%zinfo.filename)
+    return data
+
+class CompressionPolicy(object):
+    """
+    Choice of compression for files written to an archive
+
+    rules maps a manifest type (e.g. 'text/x-shapefile'), the major part
+    of a type (e.g. 'image'), or a file extension (e.g. '.dbf') to one of
+
+    'stored'    no compression
+    'deflated'  deflate at the default level
+    'auto'      deflate if a sample of the file compresses well
+    0-9         deflate level, 0 is no compression
+
+    'default' is used for files matching no rule. The rules are added to
+    DEFAULT_RULES. Files are looked up by type, major type and extension.
+    """
+
+    DEFAULT_RULES = {'text/x-shapefile': 'deflated',
+                     'text/x-sld': 9,
+                     'text/x-ewkt': 'deflated',
+                     'image': 'stored',
+                     'video': 'stored',
+                     '.shp': 'deflated', '.shx': 'deflated', '.dbf': 'deflated',
+                     '.prj': 'deflated', '.xml': 9, '.json': 9,
+                     '.jpg': 'stored', '.jpeg': 'stored', '.png': 'stored',
+                     '.gif': 'stored', '.tif': 'auto', '.tiff': 'auto',
+                     '.avi': 'stored', '.mp4': 'stored', '.mpg': 'stored',
+                     '.mov': 'stored', '.zip': 'stored', '.gz': 'stored',
+                     'default': 'auto'}
+    DEFAULT_LEVEL = 6
+    # Sample compressed when deciding automatically, and the largest
+    # compressed to uncompressed ratio for deflating
+    SAMPLE_SIZE = 2**16
+    SAMPLE_RATIO = 0.9
+
+    def __init__(self, rules=None):
+        self.rules = dict(CompressionPolicy.DEFAULT_RULES)
+        if rules: self.rules.update(rules)
+        for key, rule in self.rules.items():
+            if rule not in ('stored','deflated','auto') and \
+                    rule not in range(10):
+                raise Exception("Invalid compression for %s: %s"%(key,rule))
+
+    def rule(self, arcname, mimetype=None):
+        """
+        Return the rule for the file arcname with the manifest type mimetype
+        """
+        keys = []
+        if mimetype:
+            keys.extend([mimetype, mimetype.split('/')[0]])
+        keys.extend([os.path.splitext(arcname)[1].lower(), 'default'])
+        for key in keys:
+            if key in self.rules: return self.rules[key]
+        return 'stored'
+
+    def level(self, arcname, mimetype=None, sample=None):
+        """
+        Return the deflate level for the file arcname, 0 for no compression
+
+        sample is a function returning the start of the file, used for
+        deciding automatically.
+        """
+        rule = self.rule(arcname, mimetype)
+        if rule == 'stored': return 0
+        if rule == 'deflated': return self.DEFAULT_LEVEL
+        if rule == 'auto':
+            data = sample() if sample else ''
+            if not data: return 0
+            ratio = len(zlib.compress(data,1))/float(len(data))
+            return self.DEFAULT_LEVEL if ratio < self.SAMPLE_RATIO else 0
+        return rule
+
+def _deflateBlock(args):
+    data, level, last = args
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    # Sync flushed blocks end on a byte boundary and may be concatenated
+    return compressor.compress(data) + \
+        compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+BLOCK_SIZE = 2**20
+
+def _writeBlocks(zf, zinfo, read, level, pool, zip64=None):
+    # Write a member deflated at level (0 is stored), reading data with
+    # read(n). With a pool, blocks are compressed separately in parallel,
+    # as pigz does. zip64 tells if the header needs ZIP64 extensions,
+    # by default decided from zinfo.file_size.
+    window = 2*multiprocessing.cpu_count() if pool is not None else 1
+    if level: zinfo.compress_type = zipfile.ZIP_DEFLATED
+    else: zinfo.compress_type = zipfile.ZIP_STORED
+    zinfo.flag_bits = 0x00
+    zinfo.header_offset = zf.fp.tell()
+    zf._writecheck(zinfo)
+    zf._didModify = True
+    zinfo.CRC = crc = 0
+    zinfo.compress_size = compressSize = 0
+    fileSize = 0
+    if zip64 is None:
+        # Compressed size can be larger than uncompressed size
+        zip64 = zf._allowZip64 and zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+    zf.fp.write(zinfo.FileHeader(zip64))
+    try:
+        block = read(BLOCK_SIZE)
+        last = False
+        while not last:
+            # Read a window of blocks, one ahead to know the last one
+            blocks = []
+            while len(blocks) < window and not last:
+                following = read(BLOCK_SIZE)
+                last = not following
+                blocks.append((block, level, last))
+                block = following
+            for b in blocks:
+                crc = zlib.crc32(b[0], crc)
+                fileSize += len(b[0])
+            if not level:
+                compressed = [b[0] for b in blocks]
+            elif pool is not None and len(blocks) > 1:
+                compressed = pool.map(_deflateBlock, blocks)
+            else:
+                compressed = [_deflateBlock(b) for b in blocks]
+            for data in compressed:
+                compressSize += len(data)
+                zf.fp.write(data)
+    except:
+        # Nothing of the member is left in the archive
+        zf.fp.seek(zinfo.header_offset, 0)
+        zf.fp.truncate()
+        raise
+    zinfo.CRC = crc & 0xffffffff
+    zinfo.compress_size = compressSize
+    zinfo.file_size = fileSize
+    if not zip64 and (fileSize > zipfile.ZIP64_LIMIT or
+                      compressSize > zipfile.ZIP64_LIMIT):
+        if zf._allowZip64:
+            raise RuntimeError('File size has increased during compressing')
+        raise zipfile.LargeZipFile("Filesize would require ZIP64 extensions")
+    # Seek backwards and write the header with the CRC and sizes
+    position = zf.fp.tell()
+    zf.fp.seek(zinfo.header_offset, 0)
+    zf.fp.write(zinfo.FileHeader(zip64))
+    zf.fp.seek(position, 0)
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+
+def archiveName(arcname):
+    """
+    Return arcname normalized as by ZipFile.write()
+    """
+    arcname = os.path.normpath(os.path.splitdrive(arcname)[1])
+    while arcname[0] in (os.sep, os.altsep):
+        arcname = arcname[1:]
+    return arcname
+
+def writeDeflated(zf, filename, arcname=None, level=6, pool=None):
+    """
+    Write the file filename to zf as arcname, deflated at level
+
+    Like ZipFile.write(), but with a deflate level and parallel
+    compression of 1 MB blocks when pool is a thread pool.
+    """
+    st = os.stat(filename)
+    zinfo = zipfile.ZipInfo(archiveName(arcname or filename),
+                            time.localtime(st.st_mtime)[0:6])
+    zinfo.external_attr = (st[0] & 0xFFFF) << 16L
+    zinfo.file_size = st.st_size
+    with open(filename,'rb') as fp:
+        _writeBlocks(zf, zinfo, fp.read, level, pool)
+
+def writestrDeflated(zf, arcname, data, level=6, pool=None):
+    """
+    Write the string data to zf as arcname, deflated at level
+
+    Like ZipFile.writestr(), but with a deflate level and parallel
+    compression of 1 MB blocks when pool is a thread pool.
+    """
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(time.time())[:6])
+    zinfo.external_attr = 0o600 << 16
+    zinfo.file_size = len(data)
+    position = [0]
+    def read(n):
+        chunk = data[position[0]:position[0]+n]
+        position[0] += len(chunk)
+        return chunk
+    _writeBlocks(zf, zinfo, read, level, pool)
+
+def _writeRawHeader(zf, zinfo):
+    zinfo.header_offset = zf.fp.tell()
+    zf._writecheck(zinfo)
+    zf._didModify = True
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or \
+        zinfo.compress_size > zipfile.ZIP64_LIMIT
+    if zip64 and not zf._allowZip64:
+        raise zipfile.LargeZipFile("Filesize would require ZIP64 extensions")
+    zf.fp.write(zinfo.FileHeader(zip64))
+
+def writeRaw(zf, zinfo, data):
+    """
+    Write a member with data already compressed as zinfo.compress_type
+
+    zinfo must have the CRC and sizes set, so the header is written once.
+    """
+    _writeRawHeader(zf, zinfo)
+    zf.fp.write(data)
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+
+def _stripZip64(extra):
+    # Remove the ZIP64 field, which FileHeader() adds when needed
+    fields = []
+    while len(extra) >= 4:
+        tp, ln = struct.unpack('<HH', extra[:4])
+        if tp != 1: fields.append(extra[:ln+4])
+        extra = extra[ln+4:]
+    return ''.join(fields)
+
+def copyMember(zf, src, zinfo):
+    """
+    Copy the member zinfo of the archive src to zf without decompressing
+
+    The data is copied in blocks of CHUNK_SIZE. A data descriptor is not
+    copied, since the CRC and sizes are written in the header.
+    """
+    offset = dataOffset(src.fp, zinfo)
+    info = zipfile.ZipInfo(zinfo.filename, zinfo.date_time)
+    for attr in ['compress_type','comment','create_system','create_version',
+                 'extract_version','flag_bits','volume','internal_attr',
+                 'external_attr','CRC','compress_size','file_size']:
+        setattr(info, attr, getattr(zinfo, attr))
+    info.extra = _stripZip64(zinfo.extra)
+    info.flag_bits &= ~0x08
+    _writeRawHeader(zf, info)
+    src.fp.seek(offset)
+    left = info.compress_size
+    while left > 0:
+        data = src.fp.read(min(left, CHUNK_SIZE))
+        if not data:
+            raise zipfile.BadZipfile("Truncated file: %s"%zinfo.filename)
+        zf.fp.write(data)
+        left -= len(data)
+    zf.filelist.append(info)
+    zf.NameToInfo[info.filename] = info
+    return info
+
+def reserveMember(zf, arcname, size):
+    """
+    Write an uncompressed member of size spaces, to be filled later
+
+    Returns the ZipInfo of the member, which is not in the archive until
+    filled by fillMember().
+    """
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(time.time())[:6])
+    zinfo.external_attr = 0o600 << 16
+    zinfo.file_size = zinfo.compress_size = size
+    zinfo.CRC = zlib.crc32(' '*size) & 0xffffffff
+    _writeRawHeader(zf, zinfo)
+    zf.fp.write(' '*size)
+    return zinfo
+
+def fillMember(zf, zinfo, data):
+    """
+    Write data in the member reserved by reserveMember(), padded with
+    spaces, and add it to the archive
+
+    Returns False without writing if data is larger than the member.
+    """
+    if len(data) > zinfo.file_size: return False
+    data += ' '*(zinfo.file_size-len(data))
+    zinfo.date_time = time.localtime(time.time())[:6]
+    zinfo.CRC = zlib.crc32(data) & 0xffffffff
+    end = zf.fp.tell()
+    zf.fp.seek(zinfo.header_offset)
+    zf.fp.write(zinfo.FileHeader(False))
+    zf.fp.write(data)
+    zf.fp.seek(end)
+    # In the central directory in the order of the file
+    i = sum(1 for z in zf.filelist if z.header_offset < zinfo.header_offset)
+    zf.filelist.insert(i, zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+    return True
+
+class AsyncWriter(object):
+    """
+    Pipeline writing local files to an archive
+
+    Files are added from any thread with add(). Worker threads read them
+    and compute the CRC and compressed data, and one writer thread
+    appends the members to the archive in the order they were added.
+    Files larger than STREAM_SIZE are not read ahead, but streamed to the
+    archive by the writer thread. At most 2*workers+2 files are in the
+    pipeline, add() blocks until there is room.
+
+    Errors are collected as (name, exception) in errors. No other writes
+    should be done to the archive until the writer is flushed or closed.
+    """
+
+    STREAM_SIZE = 2**23
+
+    def __init__(self, zf, workers=None, pool=None):
+        """
+        zf is a zipfile.ZipFile open for writing, workers the number of
+        worker threads (default one per core) and pool an optional thread
+        pool for compressing streamed files.
+        """
+        self.zf = zf
+        self.pool = pool
+        self.errors = []
+        workers = workers or multiprocessing.cpu_count()
+        self._jobs = Queue.Queue()
+        self._done = {}
+        self._names = {}
+        self._added = 0
+        self._written = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._slots = threading.Semaphore(2*workers+2)
+        self._workers = [threading.Thread(target=self._work)
+                         for i in range(workers)]
+        self._writer = threading.Thread(target=self._writeAll)
+        for t in self._workers + [self._writer]:
+            t.daemon = True
+            t.start()
+
+    def add(self, filename, arcname=None, level=0):
+        """
+        Add the file filename as arcname, deflated at level (0 is stored)
+
+        level may be a function returning the level, which is called by
+        a worker thread.
+        """
+        self._slots.acquire()
+        with self._cond:
+            if self._closed:
+                self._slots.release()
+                raise ValueError("Writer is closed")
+            seq = self._added
+            self._added += 1
+            self._names[seq] = archiveName(arcname or filename)
+        self._jobs.put((seq, filename, arcname, level))
+
+    def pending(self):
+        """
+        Return the archive names of the files added but not yet written
+        """
+        with self._cond: return self._names.values()
+
+    def _prepare(self, filename, arcname, level):
+        if callable(level): level = level()
+        st = os.stat(filename)
+        zinfo = zipfile.ZipInfo(archiveName(arcname or filename),
+                                time.localtime(st.st_mtime)[0:6])
+        zinfo.external_attr = (st[0] & 0xFFFF) << 16L
+        if st.st_size > self.STREAM_SIZE:
+            return (None, filename, arcname, level)
+        with open(filename,'rb') as fid: data = fid.read()
+        zinfo.file_size = len(data)
+        zinfo.CRC = zlib.crc32(data) & 0xffffffff
+        if level:
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            data = _deflateBlock((data, level, True))
+        zinfo.compress_size = len(data)
+        return (zinfo, data)
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None: return
+            try:
+                result = self._prepare(*job[1:])
+            except Exception as e:
+                result = e
+            with self._cond:
+                self._done[job[0]] = result
+                self._cond.notify_all()
+
+    def _writeAll(self):
+        while True:
+            with self._cond:
+                while self._written not in self._done:
+                    if self._closed and self._written == self._added: return
+                    self._cond.wait()
+                result = self._done.pop(self._written)
+                name = self._names[self._written]
+            try:
+                if isinstance(result, Exception): raise result
+                if result[0] is not None:
+                    writeRaw(self.zf, *result)
+                elif result[3]:
+                    writeDeflated(self.zf, result[1], result[2], result[3],
+                                  self.pool)
+                else:
+                    self.zf.write(result[1], result[2], zipfile.ZIP_STORED)
+            except Exception as e:
+                self.errors.append((name, e))
+            with self._cond:
+                # Written members are in the archive before leaving pending
+                del self._names[self._written]
+                self._written += 1
+                self._cond.notify_all()
+            self._slots.release()
+
+    def flush(self):
+        """
+        Wait until all added files are written, returns the errors
+        """
+        with self._cond:
+            while self._written < self._added: self._cond.wait()
+        return list(self.errors)
+
+    def close(self):
+        """
+        Write the pending files and stop the threads, returns the errors
+        """
+        errors = self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for t in self._workers: self._jobs.put(None)
+        for t in self._workers + [self._writer]: t.join()
+        return errors
+
+def isStream(source):
+    """
+    Tell if source is data to write rather than the name of a file
+
+    Data is a file object, bytes given as a bytearray, buffer or
+    memoryview, or an iterable of strings.
+    """
+    if isinstance(source, basestring): return False
+    return hasattr(source,'read') or hasattr(source,'__iter__') or \
+        isinstance(source, (bytearray, buffer, memoryview))
+
+def _chunk(data):
+    if isinstance(data, memoryview): return data.tobytes()
+    return str(data)
+
+class StreamReader(object):
+    """
+    Reads a source accepted by isStream() in chunks of the size asked for
+
+    Only the data asked for is held, except when an iterable gives larger
+    chunks. peek() returns data without consuming it.
+    """
+
+    def __init__(self, source):
+        self.size = None
+        if isinstance(source, (bytearray, buffer, memoryview)):
+            self._source, self._pos = source, 0
+            self.size = len(source)
+            self._next = self._slice
+        elif hasattr(source,'read'):
+            self._next = source.read
+            try:
+                self.size = os.fstat(source.fileno()).st_size - source.tell()
+            except (AttributeError, IOError, OSError, ValueError):
+                pass
+        else:
+            iterator = iter(source)
+            self._next = lambda n: next(iterator, '')
+        self._buffer = []
+        self._buffered = 0
+
+    def _slice(self, n):
+        data = self._source[self._pos:self._pos+n]
+        self._pos += len(data)
+        return data
+
+    def _fill(self, n):
+        while self._buffered < n:
+            data = self._next(n - self._buffered)
+            if not data: break
+            data = _chunk(data)
+            self._buffer.append(data)
+            self._buffered += len(data)
+
+    def peek(self, n):
+        self._fill(n)
+        data = ''.join(self._buffer)
+        self._buffer = [data] if data else []
+        return data[:n]
+
+    def read(self, n):
+        self._fill(n)
+        data = ''.join(self._buffer)
+        rest = data[n:]
+        self._buffer = [rest] if rest else []
+        self._buffered = len(rest)
+        return data[:n]
+
+def writeStream(zf, arcname, source, level=0, pool=None):
+    """
+    Write data from source (see isStream()) to zf as arcname
+
+    The data is read and written in 1 MB blocks, deflated at level
+    (0 is stored), with parallel compression when pool is a thread pool.
+    Sources of unknown size get ZIP64 headers if zf allows ZIP64.
+    """
+    if not isinstance(source, StreamReader): source = StreamReader(source)
+    zinfo = zipfile.ZipInfo(archiveName(arcname), time.localtime(time.time())[:6])
+    zinfo.external_attr = 0o600 << 16
+    zip64 = None
+    zinfo.file_size = source.size or 0
+    if source.size is None: zip64 = zf._allowZip64
+    _writeBlocks(zf, zinfo, source.read, level, pool, zip64)
@@ -12,9 +12,32 @@
 import unittest
 import sys
 import json
+import glob
+import copy
+import os
+import shutil
+import tempfile
+import zipfile
+import threading
+import multiprocessing.pool
+import subprocess
+import struct
+import StringIO
+import urllib
 
 sys.path.append('../src')
-from aptofile import Aptofile
+from aptofile import Aptofile, Assetfile
+from validationcache import ValidationCache
+import ziptools
+import scanner
+import geometry
+import spatial
+from spatial import SpatialIndex
+import shapefile
+import worldfile
+from geometry import numpy
+from catalog import Catalog
+from datetime import datetime
 import jsonschema
 
 class TestManifest(unittest.TestCase):
@@ -62,6 +85,1760 @@ class TestManifest(unittest.TestCase):
         self.inst["extra"] = "large"
         self.assertFalse(self.validate())
 
+class TestValidatorRegistry(unittest.TestCase):
+
+    def setUp(self):
+        with open('tests/header.json') as fid:
+            self.inst = json.load(fid)
+
+    def test_validator_is_reused(self):
+        self.assertTrue(Aptofile.getValidator() is Aptofile.getValidator())
+
+    def test_validator_keyed_by_content(self):
+        schema = json.loads(json.dumps(Aptofile.SCHEMA))
+        self.assertTrue(Aptofile.getValidator(schema) is
+                        Aptofile.getValidator())
+
+    def test_invalid_schema(self):
+        self.assertRaises(jsonschema.SchemaError, Aptofile.getValidator,
+                          {'type':12})
+
+    def test_validates(self):
+        validator = Aptofile.getValidator()
+        self.assertTrue(validator.is_valid(self.inst))
+        self.inst["date"] = "tomorrow"
+        self.assertFalse(validator.is_valid(self.inst))
+
+class TestCompiledValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.manifests = []
+        for fn in ['tests/header.json']+sorted(glob.glob('../extras/tests/valid/*.json')):
+            with open(fn) as fid:
+                self.manifests.append(json.load(fid))
+        self.reference = Aptofile.VALIDATOR(Aptofile.SCHEMA,
+                                            format_checker=jsonschema.FormatChecker())
+        self.compiled = jsonschema.compile_validator(Aptofile.SCHEMA,
+                                                     format_checker=jsonschema.FormatChecker())
+
+    def errors(self, validator, inst):
+        return [(e.message, e.validator, list(e.path))
+                for e in validator.iter_errors(inst)]
+
+    def assertSameErrors(self, inst):
+        self.assertEqual(self.errors(self.reference, inst),
+                         self.errors(self.compiled, inst))
+
+    def mutations(self, inst, path=()):
+        # Yield copies of inst with one element removed or replaced
+        items = inst.items() if isinstance(inst,dict) else enumerate(inst)
+        for k, v in items:
+            for replacement in [None, 1, "x", [], {}]:
+                m = copy.deepcopy(inst)
+                m[k] = replacement
+                yield m
+            m = copy.deepcopy(inst)
+            del m[k]
+            yield m
+            if isinstance(v,(dict,list)):
+                for sub in self.mutations(v):
+                    m = copy.deepcopy(inst)
+                    m[k] = sub
+                    yield m
+
+    def test_valid_corpus(self):
+        for inst in self.manifests:
+            self.assertTrue(self.compiled.is_valid(inst))
+            self.assertSameErrors(inst)
+
+    def test_mutated_corpus(self):
+        for inst in self.manifests:
+            for m in self.mutations(inst):
+                self.assertSameErrors(m)
+
+    def test_meta_schemas(self):
+        for cls in [jsonschema.Draft3Validator, jsonschema.Draft4Validator]:
+            self.reference = cls(cls.META_SCHEMA)
+            self.compiled = jsonschema.CompiledValidator(cls.META_SCHEMA, cls)
+            for inst in [Aptofile.SCHEMA, {'type':12}, {'required':True},
+                         {'properties':{'a':{'type':'bogus'}}}]:
+                self.assertSameErrors(inst)
+
+class TestOpen(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.f = os.path.join(self.dir,'asset.apt')
+        with Aptofile.create(self.f,'asset') as af:
+            af.setDescription("This is a description of the asset.")
+            af.setGenerator("aptfile.py", "Aptomar AS")
+            af.addLayer('layer1',
+                        geometry_data=[('tests/asset/layers/layer1.shp',
+                                        'layers/layer1.shp')],
+                        style_data=[('tests/asset/styles/layer1.xml',
+                                     'styles/layer1.xml')])
+            af.addFile2Layer('resource1.png','layer1','resources',
+                             writeFile=False)
+            af.addGroup('group1',layers=['layer1'])
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testNoValidation(self):
+        with Aptofile.open('tests/geotest.apt',validate='none') as af:
+            self.assertEqual(af.getMemberChecks(),[])
+            self.assertTrue(af.getDescription())
+
+    def testLazyValid(self):
+        with Aptofile.open(self.f,validate='none') as af:
+            self.assertEqual(af.getFailedTests(),[])
+            self.assertFalse(af.valid)
+            self.assertEqual([t for t,e in af.getFailedTests()],['assetFiles'])
+
+    def testDepths(self):
+        with Aptofile.open(self.f,validate='manifest') as af:
+            self.assertTrue(af.valid)
+            self.assertFalse(af.validate('structure'))
+        with Aptofile.open(self.f,validate='structure') as af:
+            self.assertFalse(af.valid)
+        with Aptofile.open(self.f) as af:
+            self.assertFalse(af.valid)
+
+    def testManifestDepthSkipsZipTest(self):
+        with Aptofile.open('tests/geotest.apt',validate='manifest') as af:
+            af.validate()
+            self.assertEqual(af.getMemberChecks(),[])
+            af.validate('full')
+            self.assertTrue(af.getMemberChecks())
+
+    def testInvalidDepth(self):
+        self.assertRaises(Exception, Aptofile.open, self.f, validate='most')
+
+class TestVerifyMembers(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.f = os.path.join(self.dir,'members.zip')
+        self.taskSize = ziptools.TASK_SIZE
+        ziptools.TASK_SIZE = 10000
+        with zipfile.ZipFile(self.f,'w') as zf:
+            for i in range(20):
+                zf.writestr('stored%d'%i, os.urandom(5000), zipfile.ZIP_STORED)
+                zf.writestr('deflated%d'%i, 'data%d'%i*1000,
+                            zipfile.ZIP_DEFLATED)
+    def tearDown(self):
+        ziptools.TASK_SIZE = self.taskSize
+        shutil.rmtree(self.dir)
+
+    def corrupt(self, name):
+        with zipfile.ZipFile(self.f) as zf:
+            zinfo = zf.getinfo(name)
+            with open(self.f,'rb') as fp:
+                offset = ziptools.dataOffset(fp, zinfo)
+        with open(self.f,'r+b') as fp:
+            fp.seek(offset+10)
+            c = fp.read(1)
+            fp.seek(offset+10)
+            fp.write(chr(ord(c)^0xff))
+
+    def testAllMembers(self):
+        with zipfile.ZipFile(self.f) as zf:
+            for workers in [1,4]:
+                checks = ziptools.verifyMembers(zf, workers=workers)
+                self.assertEqual([c.name for c in checks], zf.namelist())
+                self.assertTrue(all(c.ok for c in checks))
+                self.assertEqual([c.actual for c in checks],
+                                 [i.CRC for i in zf.infolist()])
+                self.assertEqual([c.size for c in checks],
+                                 [i.compress_size for i in zf.infolist()])
+
+    def testBadMembers(self):
+        self.corrupt('stored3')
+        self.corrupt('deflated7')
+        with zipfile.ZipFile(self.f) as zf:
+            for processes in [False,True]:
+                checks = ziptools.verifyMembers(zf, workers=4,
+                                                processes=processes)
+                self.assertEqual(len(checks), 40)
+                self.assertEqual([c.name for c in checks if not c.ok],
+                                 ['stored3','deflated7'])
+            self.assertEqual(zf.testzip(), 'stored3')
+
+    def testFailFast(self):
+        self.corrupt('stored0')
+        with zipfile.ZipFile(self.f) as zf:
+            checks = ziptools.verifyMembers(zf, workers=1, failFast=True)
+            self.assertFalse(checks[-1].ok)
+            self.assertEqual(checks[-1].name, 'stored0')
+
+    def testWriteMode(self):
+        with zipfile.ZipFile(os.path.join(self.dir,'w.zip'),'w') as zf:
+            zf.writestr('a', 'a'*1000, zipfile.ZIP_DEFLATED)
+            zf.write('tests/header.json', 'header.json')
+            checks = ziptools.verifyMembers(zf, workers=2)
+            self.assertTrue(all(c.ok for c in checks))
+
+    def testValidate(self):
+        f = os.path.join(self.dir,'asset.apt')
+        shp = os.path.join(self.dir,'layer1.shp')
+        with open(shp,'wb') as fid: fid.write(os.urandom(1000))
+        with Aptofile.create(f,'asset') as af:
+            af.setDescription("This is a description of the asset.")
+            af.setGenerator("aptfile.py", "Aptomar AS")
+            af.addLayer('layer1', geometry_data=[(shp,'layers/layer1.shp')],
+                        style_data=[('tests/asset/styles/layer1.xml',
+                                     'styles/layer1.xml')])
+            self.assertEqual([c.name for c in af.getMemberChecks()],
+                             ['layers/layer1.shp','styles/layer1.xml'])
+            af.addGroup('group1',layers=['layer1'])
+        self.f = f
+        self.corrupt('layers/layer1.shp')
+        with Aptofile.open(f) as af:
+            self.assertFalse(af.valid)
+            self.assertEqual([t for t,e in af.getFailedTests()],['testZip'])
+            self.assertEqual([c.name for c in af.getMemberChecks()
+                              if not c.ok], ['layers/layer1.shp'])
+
+class TestNameIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.f = os.path.join(self.dir,'asset.apt')
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testLookup(self):
+        with Aptofile.create(self.f,'asset') as af:
+            af.zipfile.writestr('/layers/a.shp','a')
+            af.zipfile.writestr('styles\\b.xml','b')
+            self.assertEqual(af.namelist(),['layers/a.shp','styles\\b.xml'])
+            for fn in ['layers/a.shp','file:/layers/a.shp','layers\\a.shp',
+                       '\\layers\\a.shp']:
+                self.assertEqual(af.readfile(fn),'a')
+            self.assertEqual(af.readfile('file://styles/b.xml'),'b')
+            af._checkFiles(['file:layers/a.shp','styles/b.xml',
+                            'http://www.aptomar.com/c.png'])
+            self.assertRaises(IOError, af._checkFiles, ['layers/c.shp'])
+            self.assertRaises(Exception, af.readfile, 'layers/c.shp')
+
+    def testUpdatedOnWrite(self):
+        with Aptofile.create(self.f,'asset') as af:
+            self.assertEqual(af.namelist(),[])
+            af.writefile(('tests/header.json','header.json'))
+            self.assertEqual(af.namelist(),['header.json'])
+            af.zipfile.writestr('data\\other.json','{}')
+            self.assertEqual(af.readfile('data/other.json'),'{}')
+            self.assertEqual(af.namelist(),['header.json','data\\other.json'])
+
+class TestOpenfile(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.f = os.path.join(self.dir,'asset.apt')
+        self.data = ''.join(os.urandom(i%50+1)*(i%100+1) for i in range(3000))
+        self.checkpointSize = ziptools.MemberFile.CHECKPOINT_SIZE
+        ziptools.MemberFile.CHECKPOINT_SIZE = 10000
+        with Aptofile.create(self.f,'asset',validate='on_close') as af:
+            af.zipfile.writestr('stored.bin', self.data, zipfile.ZIP_STORED)
+            af.zipfile.writestr('deflated.bin', self.data, zipfile.ZIP_DEFLATED)
+    def tearDown(self):
+        ziptools.MemberFile.CHECKPOINT_SIZE = self.checkpointSize
+        shutil.rmtree(self.dir)
+
+    def testRead(self):
+        with Aptofile.open(self.f,validate='none') as af:
+            for fn in ['stored.bin','file:/deflated.bin']:
+                with af.openfile(fn) as f:
+                    self.assertEqual(f.size, len(self.data))
+                    self.assertEqual(f.read(1000), self.data[:1000])
+                    self.assertEqual(f.tell(), 1000)
+                    self.assertEqual(f.read(), self.data[1000:])
+                    self.assertEqual(f.read(), '')
+            self.assertRaises(Exception, af.openfile, 'missing.bin')
+
+    def testSeek(self):
+        with Aptofile.open(self.f,validate='none') as af:
+            for fn in ['stored.bin','deflated.bin']:
+                with af.openfile(fn) as f:
+                    for offset in [50000, 10, 90000, 20000, len(self.data)-5]:
+                        f.seek(offset)
+                        self.assertEqual(f.read(3000),
+                                         self.data[offset:offset+3000])
+                    f.seek(-100,2)
+                    self.assertEqual(f.read(), self.data[-100:])
+                    f.seek(0)
+                    f.seek(10,1)
+                    self.assertEqual(f.read(10), self.data[10:20])
+
+    def testReadrange(self):
+        with Aptofile.open(self.f,validate='none') as af:
+            for fn in ['stored.bin','deflated.bin']:
+                self.assertEqual(af.readrange(fn,12345,678),
+                                 self.data[12345:12345+678])
+                self.assertEqual(af.readrange(fn,len(self.data),10),'')
+
+    def testWriteMode(self):
+        with Aptofile.create(os.path.join(self.dir,'w.apt'),'asset',
+                             validate='on_close') as af:
+            af.zipfile.writestr('a.bin', self.data, zipfile.ZIP_DEFLATED)
+            self.assertEqual(af.readrange('a.bin',100,10), self.data[100:110])
+            self.assertEqual(str(af.readview('a.bin')), self.data)
+            af.zipfile.writestr('b.bin', self.data[:1000], zipfile.ZIP_STORED)
+            self.assertEqual(str(af.readview('b.bin')), self.data[:1000])
+
+    def testReadview(self):
+        with Aptofile.open(self.f,validate='none') as af:
+            stored = af.readview('file:/stored.bin')
+            deflated = af.readview('deflated.bin')
+            self.assertRaises(Exception, af.readview, 'missing.bin')
+        # Views of the archive map stay valid after closing
+        self.assertTrue(isinstance(stored, buffer))
+        self.assertEqual(len(stored), len(self.data))
+        self.assertEqual(str(stored), self.data)
+        self.assertEqual(stored[100:200], self.data[100:200])
+        self.assertEqual(str(deflated), self.data)
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.f = os.path.join(self.dir,'asset.apt')
+        self.dbf = os.path.join(self.dir,'layer1.dbf')
+        with open(self.dbf,'wb') as fid:
+            fid.write(''.join('%10d%-20s'%(i,'name%d'%(i%7)) for i in range(100000)))
+        self.png = os.path.join(self.dir,'resource1.png')
+        with open(self.png,'wb') as fid: fid.write(os.urandom(10000))
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testPolicy(self):
+        policy = ziptools.CompressionPolicy({'.dbf':9, 'image':'auto'})
+        self.assertEqual(policy.rule('layers/a.dbf','text/x-shapefile'),
+                         'deflated')
+        self.assertEqual(policy.rule('layers/a.dbf'), 9)
+        self.assertEqual(policy.rule('a.jpg','image/jpeg'), 'auto')
+        self.assertEqual(policy.rule('a.JPG'), 'stored')
+        self.assertEqual(policy.rule('a.bin'), 'auto')
+        self.assertEqual(policy.level('a.bin', sample=lambda: 'a'*1000), 6)
+        self.assertEqual(policy.level('a.bin', sample=lambda: os.urandom(1000)), 0)
+        self.assertEqual(policy.level('a.bin', sample=lambda: ''), 0)
+        self.assertEqual(policy.level('a.png'), 0)
+        self.assertRaises(Exception, ziptools.CompressionPolicy, {'.dbf':10})
+
+    def createAsset(self, compression):
+        with Aptofile.create(self.f,'asset',compression=compression) as af:
+            af.setDescription("This is a description of the asset.")
+            af.setGenerator("aptfile.py", "Aptomar AS")
+            af.addLayer('layer1',
+                        geometry_data=[(self.dbf,'layers/layer1.dbf')],
+                        style_data=[('tests/asset/styles/layer1.xml',
+                                     'styles/layer1.xml')],
+                        resources_data=[(self.png,'resources/resource1.png')])
+            af.addGroup('group1',layers=['layer1'])
+            self.assertTrue(af.valid)
+        with zipfile.ZipFile(self.f) as zf:
+            return dict((i.filename,i.compress_type) for i in zf.infolist())
+
+    def testCreate(self):
+        self.assertEqual(set(self.createAsset(None).values()),
+                         set([zipfile.ZIP_STORED]))
+        types = self.createAsset('auto')
+        self.assertEqual(types['layers/layer1.dbf'], zipfile.ZIP_DEFLATED)
+        self.assertEqual(types['styles/layer1.xml'], zipfile.ZIP_DEFLATED)
+        self.assertEqual(types['manifest.json'], zipfile.ZIP_DEFLATED)
+        self.assertEqual(types['resources/resource1.png'], zipfile.ZIP_STORED)
+        self.assertTrue(Aptofile.validateFile(self.f))
+        with Aptofile.open(self.f) as af:
+            with open(self.dbf,'rb') as fid:
+                self.assertEqual(af.readfile('layers/layer1.dbf'), fid.read())
+        types = self.createAsset({'text/x-shapefile':'stored'})
+        self.assertEqual(types['layers/layer1.dbf'], zipfile.ZIP_STORED)
+
+    def testBlocks(self):
+        # Blocks compressed separately must form one deflate stream
+        data = ''.join(os.urandom(i%30+1)*(i%90+1) for i in range(20000))
+        pool = multiprocessing.pool.ThreadPool(3)
+        try:
+            with zipfile.ZipFile(self.f,'w') as zf:
+                ziptools.writestrDeflated(zf, 'a.bin', data, 1, pool)
+                ziptools.writeDeflated(zf, self.dbf, '/b/b.dbf', 9, pool)
+                ziptools.writestrDeflated(zf, 'empty.bin', '')
+        finally:
+            pool.close()
+        with zipfile.ZipFile(self.f) as zf:
+            self.assertEqual(zf.testzip(), None)
+            self.assertEqual(zf.read('a.bin'), data)
+            self.assertEqual(zf.read('empty.bin'), '')
+            self.assertEqual(zf.namelist()[1], 'b/b.dbf')
+
+class TestAsyncWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.f = os.path.join(self.dir,'asset.apt')
+        self.files = []
+        for i in range(40):
+            fn = os.path.join(self.dir,'layer%d.shp'%i)
+            with open(fn,'wb') as fid: fid.write('layer%d'%i*(i*100+1))
+            self.files.append(fn)
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def addLayer(self, af, i):
+        return af.addLayer('layer%d'%i,
+                           geometry_data=[(self.files[i],
+                                           'layers/layer%d.shp'%i)],
+                           style_data=[(self.files[i],'styles/layer%d.xml'%i)])
+
+    def testOrderAndContent(self):
+        with Aptofile.create(self.f,'asset',compression='auto',
+                             writeWorkers=4) as af:
+            af.setDescription("This is a description of the asset.")
+            af.setGenerator("aptfile.py", "Aptomar AS")
+            af.addGroup('group1',layers=['layer0'])
+            for i in range(len(self.files)):
+                # Files still being written count as found
+                self.assertTrue(self.addLayer(af, i))
+            self.assertEqual(af.readfile('styles/layer3.xml'),'layer3'*301)
+            self.assertEqual(af.flush(), [])
+        self.assertTrue(Aptofile.validateFile(self.f))
+        with Aptofile.open(self.f) as af:
+            self.assertEqual(af.namelist(),
+                             [n%i for i in range(len(self.files))
+                              for n in ['layers/layer%d.shp','styles/layer%d.xml']]
+                             +['manifest.json'])
+            for i in range(len(self.files)):
+                with open(self.files[i],'rb') as fid:
+                    self.assertEqual(af.readfile('layers/layer%d.shp'%i),
+                                     fid.read())
+
+    def testThreads(self):
+        with Aptofile.create(self.f,'asset',writeWorkers=2) as af:
+            af.setDescription("This is a description of the asset.")
+            af.setGenerator("aptfile.py", "Aptomar AS")
+            def add(start):
+                for i in range(start,len(self.files),4): self.addLayer(af, i)
+            threads = [threading.Thread(target=add,args=(i,)) for i in range(4)]
+            for t in threads: t.start()
+            for t in threads: t.join()
+            af.addGroup('group1',layers=['layer0'])
+        with Aptofile.open(self.f) as af:
+            self.assertTrue(af.valid)
+            self.assertEqual(len(af.manifest['asset']['layers']),len(self.files))
+            self.assertEqual(len(af.namelist()),2*len(self.files)+1)
+
+    def testErrors(self):
+        af = Aptofile.create(self.f,'asset',writeWorkers=2)
+        af.setDescription("This is a description of the asset.")
+        af.setGenerator("aptfile.py", "Aptomar AS")
+        self.addLayer(af, 0)
+        af.addLayer('layer1',
+                    geometry_data=[(os.path.join(self.dir,'missing.shp'),
+                                    'layers/missing.shp')],
+                    style_data=[(self.files[1],'styles/layer1.xml')])
+        af.addGroup('group1',layers=['layer0','layer1'])
+        self.assertEqual([n for n,e in af.flush()],['layers/missing.shp'])
+        self.assertRaises(IOError, af.close)
+        with Aptofile.open(self.f) as af:
+            self.assertFalse(af.valid)
+            self.assertTrue('layers/layer0.shp' in af.namelist())
+
+class TestStreamWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.f = os.path.join(self.dir,'file.apt')
+        self.data = ''.join(os.urandom(i%30+1)*(i%90+1) for i in range(3000))
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def chunks(self, size=10000):
+        for i in range(0,len(self.data),size):
+            yield self.data[i:i+size]
+
+    def testSources(self):
+        src = os.path.join(self.dir,'src.bin')
+        with open(src,'wb') as fid: fid.write(self.data)
+        with Aptofile.create(self.f,'asset') as af:
+            with open(src,'rb') as fid:
+                self.assertTrue(af.writefile((fid,'file.bin')))
+            self.assertTrue(af.writefile((self.chunks(),'/gen.bin')))
+            self.assertTrue(af.writefile((bytearray(self.data),'bytes.bin')))
+            self.assertTrue(af.writefile((buffer(self.data),'buffer.bin')))
+            self.assertTrue(af.writefile((memoryview(self.data),'view.bin')))
+            self.assertTrue(af.writefile(([],'empty.bin')))
+            self.assertEqual(af.readfile('gen.bin'), self.data)
+        with zipfile.ZipFile(self.f) as zf:
+            self.assertEqual(zf.testzip(), None)
+            for fn in ['file.bin','gen.bin','bytes.bin','buffer.bin','view.bin']:
+                self.assertEqual(zf.read(fn), self.data)
+            self.assertEqual(zf.read('empty.bin'), '')
+
+    def testCompression(self):
+        with Aptofile.create(self.f,'asset',compression='auto') as af:
+            af.writefile((self.chunks(),'gen.bin'))
+            af.writefile(((os.urandom(1000) for i in range(100)),'random.bin'))
+        with zipfile.ZipFile(self.f) as zf:
+            self.assertEqual(zf.getinfo('gen.bin').compress_type,
+                             zipfile.ZIP_DEFLATED)
+            self.assertEqual(zf.getinfo('random.bin').compress_type,
+                             zipfile.ZIP_STORED)
+            self.assertEqual(zf.read('gen.bin'), self.data)
+
+    def testReader(self):
+        reader = ziptools.StreamReader(self.chunks(1000))
+        self.assertEqual(reader.size, None)
+        self.assertEqual(reader.peek(1500), self.data[:1500])
+        self.assertEqual(reader.read(10), self.data[:10])
+        self.assertEqual(reader.read(2500), self.data[10:2510])
+        # Only the chunks needed are taken from the source
+        self.assertEqual(reader._buffered, 490)
+        self.assertEqual(ziptools.StreamReader(bytearray(10)).size, 10)
+
+    def testHelpers(self):
+        with Aptofile.create(self.f,'video',writeWorkers=2) as af:
+            af.setGenerator(program='aptfile.py',creator='Aptomar AS')
+            af.setDescription('This is a description of the video')
+            af.setVideoName('The video name')
+            af.setVideoDescription('A video of something')
+            af.setVideoGeoreference( 10.4344, 63.4181, 150.60)
+            af.addVideoFile((self.chunks(),'video.avi'))
+            self.assertTrue(af.validate())
+        with Aptofile.open(self.f) as af:
+            self.assertTrue(af.valid)
+            self.assertEqual(af.readfile('video.avi'), self.data)
+        with Aptofile.create(self.f,'point') as af:
+            af.setGenerator('aptfile.py','Aptomar AS')
+            af.setDescription('This is a description of the point.')
+            af.setPointName('The Point')
+            af.setPointDescription('This is a description of a point.')
+            af.setPointType('boat')
+            af.setPointGeometry((['SRID=4326;','POINT(10.4 63.4)'],'point.ewkt'))
+            self.assertTrue(af.validate())
+            self.assertEqual(af.readfile('point.ewkt'),'SRID=4326;POINT(10.4 63.4)')
+        with Aptofile.create(self.f,'asset') as af:
+            af.setDescription("This is a description of the asset.")
+            af.setGenerator("aptfile.py", "Aptomar AS")
+            af.addLayer('layer1',
+                        geometry_data=[(self.chunks(),'layers/layer1.shp')],
+                        style_data=[(bytearray('<sld/>'),'styles/layer1.xml')])
+            af.addGroup('group1',layers=['layer1'])
+            self.assertTrue(af.valid)
+
+    def testMissingName(self):
+        with Aptofile.create(self.f,'asset') as af:
+            self.assertRaises(Exception, af.writefile, (self.chunks(),''))
+
+    def testFailingSource(self):
+        # Raising after the first blocks are written
+        def chunks():
+            for chunk in self.chunks(2**20): yield chunk
+            raise IOError("Connection lost")
+        self.data *= 4
+        for compression in [None, 'auto']:
+            with Aptofile.create(self.f,'point',compression=compression) as af:
+                af.setGenerator('testAptofile.py','Aptomar AS')
+                af.setDescription('Point')
+                af.setPointName('Point')
+                af.setPointType('boat')
+                self.assertRaises(IOError, af.setPointGeometry,
+                                  (chunks(),'g.ewkt'))
+                self.assertEqual(af.getGeometry(), None)
+                af.setPointGeometry((bytearray('POINT(10 63)'),'p.ewkt'))
+            with zipfile.ZipFile(self.f) as zf:
+                self.assertEqual(zf.testzip(), None)
+                self.assertEqual(sorted(zf.namelist()),
+                                 ['manifest.json','p.ewkt'])
+            with Aptofile.open(self.f) as af:
+                self.assertTrue(af.valid)
+
+class TestZip64(unittest.TestCase):
+    """
+    ZIP64 archives, with the limits lowered as in the zipfile tests
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.f = os.path.join(self.dir,'asset.apt')
+        self.limits = zipfile.ZIP64_LIMIT, zipfile.ZIP_FILECOUNT_LIMIT
+        zipfile.ZIP64_LIMIT = 1000
+        zipfile.ZIP_FILECOUNT_LIMIT = 9
+        self.data = ''.join(os.urandom(i%30+1)*(i%9+1) for i in range(300))
+        self.src = os.path.join(self.dir,'layer.shp')
+        with open(self.src,'wb') as fid: fid.write(self.data)
+    def tearDown(self):
+        zipfile.ZIP64_LIMIT, zipfile.ZIP_FILECOUNT_LIMIT = self.limits
+        shutil.rmtree(self.dir)
+
+    def create(self, **args):
+        with Aptofile.create(self.f,'asset',**args) as af:
+            af.setDescription("This is a description of the asset.")
+            af.setGenerator("aptfile.py", "Aptomar AS")
+            af.addGroup('group1',layers=['layer0'])
+            for i in range(10):
+                af.addLayer('layer%d'%i,
+                            geometry_data=[(self.src,'layers/layer%d.shp'%i)],
+                            style_data=[((c for c in [self.data]),
+                                         'styles/layer%d.xml'%i)])
+
+    def testLimits(self):
+        with zipfile.ZipFile(os.path.join(self.dir,'plain.zip'),'w') as zf:
+            self.assertRaises(zipfile.LargeZipFile, zf.write, self.src)
+
+    def testArchive(self):
+        for args in [{}, {'compression':'auto'}, {'writeWorkers':2}]:
+            self.create(**args)
+            with open(self.f,'rb') as fid:
+                self.assertTrue('PK\x06\x06' in fid.read())
+            self.assertTrue(Aptofile.validateFile(self.f))
+            with Aptofile.open(self.f) as af:
+                self.assertTrue(af.valid)
+                self.assertEqual(len(af.getMemberChecks()), 21)
+                self.assertEqual(len(af.namelist()), 21)
+                self.assertEqual(af.readfile('layers/layer9.shp'), self.data)
+                self.assertEqual(str(af.readview('styles/layer9.xml')),
+                                 self.data)
+                self.assertEqual(af.readrange('layers/layer5.shp',100,50),
+                                 self.data[100:150])
+            self.assertEqual(Aptofile.getManifestFromFile(self.f)['asset'],
+                             af.getManifest()['asset'])
+            # Members with ZIP64 headers copied as they are
+            with Aptofile.update(self.f) as af:
+                af.setDescription("Updated")
+            with Aptofile.open(self.f) as af:
+                self.assertTrue(af.valid)
+                self.assertEqual(af.getDescription(),"Updated")
+                self.assertEqual(af.readfile('layers/layer9.shp'), self.data)
+
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.f = os.path.join(self.dir,'asset.apt')
+        self.style = os.path.join(self.dir,'style.xml')
+        with open(self.style,'w') as fid: fid.write('<sld/>'*100)
+        self.shp = os.path.join(self.dir,'layer.shp')
+        with open(self.shp,'wb') as fid: fid.write(os.urandom(1000))
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def create(self, **args):
+        with Aptofile.create(self.f,'asset',**args) as af:
+            af.setDescription("This is a description of the asset.")
+            af.setGenerator("aptfile.py", "Aptomar AS")
+            af.addGroup('group1',layers=['layer0'])
+            for i in range(5):
+                af.addLayer('layer%d'%i,
+                            geometry_data=[(self.shp,'layers/layer%d.shp'%i)],
+                            style_data=[(self.style,'styles/layer%d.xml'%i)],
+                            resources_data=[(bytearray('icon'),
+                                             'icons/layer%d.png'%i)])
+                af.addFile2Layer((iter([os.urandom(10)]),
+                                  'layers/layer%d.dbf'%i),
+                                 'layer%d'%i,'geometry')
+            return af
+
+    def testDedup(self):
+        af = self.create(dedup=True)
+        self.assertTrue(Aptofile.validateFile(self.f))
+        self.assertEqual(af.getDedupSummary(),
+                         {'files':3,'bytes':1604,'duplicates':12,'saved':6416})
+        with Aptofile.open(self.f) as af:
+            self.assertTrue(af.valid)
+            layer = af.getManifest()['asset']['layers']['layer4']
+            self.assertEqual(layer['geometry']['data'][0],'layers/layer0.shp')
+            self.assertEqual(layer['style']['data'],['styles/layer0.xml'])
+            self.assertEqual(layer['resources']['data'],['icons/layer0.png'])
+            self.assertEqual(af.readfile(layer['resources']['data'][0]),'icon')
+            # Other data is written as it is
+            self.assertEqual(layer['geometry']['data'][1],'layers/layer4.dbf')
+            self.assertEqual(len(af.namelist()), 9)
+
+    def testWithoutDedup(self):
+        self.create()
+        with Aptofile.open(self.f) as af:
+            self.assertTrue(af.valid)
+            self.assertEqual(len(af.namelist()), 21)
+
+    def testAsyncWrite(self):
+        self.create(dedup=True,writeWorkers=2,compression='auto')
+        with Aptofile.open(self.f) as af:
+            self.assertTrue(af.valid)
+            self.assertEqual(len(af.namelist()), 9)
+
+    def testSameSize(self):
+        # Files of the same size are compared from the archive, so the
+        # earlier one may be gone
+        other = os.path.join(self.dir,'other.shp')
+        with open(other,'wb') as fid: fid.write(os.urandom(1000))
+        data = bytearray(open(other,'rb').read())
+        with Aptofile.create(self.f,'asset',dedup=True) as af:
+            af.setDescription("This is a description of the asset.")
+            af.setGenerator("aptfile.py", "Aptomar AS")
+            af.addLayer('layer1',
+                        geometry_data=[(self.shp,'layers/layer1.shp'),
+                                       (other,'layers/layer1.dbf')],
+                        style_data=[(self.style,'styles/layer1.xml')])
+            os.remove(other)
+            af.addLayer('layer2',geometry_data=[(data,'layers/layer2.shp')],
+                        style_data=[(self.style,'styles/layer2.xml')])
+            af.addGroup('group1',layers=['layer1','layer2'])
+            self.assertEqual(af.getDedupSummary()['duplicates'], 2)
+        with Aptofile.open(self.f) as af:
+            self.assertTrue(af.valid)
+            layer = af.getManifest()['asset']['layers']['layer2']
+            self.assertEqual(layer['geometry']['data'],['layers/layer1.dbf'])
+
+    def testOnlyAssets(self):
+        self.assertRaises(Exception, Aptofile.create,
+                          os.path.join(self.dir,'video.apt'),'video',dedup=True)
+
+class TestUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.f = os.path.join(self.dir,'asset.apt')
+        self.shp = os.path.join(self.dir,'layer.shp')
+        with open(self.shp,'w') as fid: fid.write('1.0 2.0\n'*10000)
+        self.style = os.path.join(self.dir,'style.xml')
+        with open(self.style,'w') as fid: fid.write('<sld/>')
+        with Aptofile.create(self.f,'asset',compression='auto') as af:
+            af.setDescription("This is a description of the asset.")
+            af.setGenerator("aptfile.py", "Aptomar AS")
+            af.addLayer('layer1',geometry_data=[(self.shp,'layers/layer1.shp')],
+                        style_data=[(self.style,'styles/layer1.xml')])
+            af.addGroup('group1',layers=['layer1'])
+        self.infos = self.members(self.f)
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def members(self, fn):
+        with zipfile.ZipFile(fn) as zf:
+            return dict((i.filename,(i.compress_type,i.compress_size,i.CRC))
+                        for i in zf.infolist())
+
+    def testDescription(self):
+        with Aptofile.update(self.f) as af:
+            self.assertTrue(af.valid)
+            af.setDescription("New description")
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['asset.apt','layer.shp','style.xml'])
+        with Aptofile.open(self.f) as af:
+            self.assertTrue(af.valid)
+            self.assertEqual(af.getDescription(),"New description")
+            self.assertEqual(af.readfile('layers/layer1.shp'),
+                             open(self.shp).read())
+        infos = self.members(self.f)
+        self.assertEqual(infos['layers/layer1.shp'][0],zipfile.ZIP_DEFLATED)
+        del infos['manifest.json'], self.infos['manifest.json']
+        self.assertEqual(infos,self.infos)
+
+    def testSameDestination(self):
+        # Written to a temporary file, not truncating the source first,
+        # which has more than is buffered when it is opened
+        data = bytearray(os.urandom(2**20))
+        with Aptofile.update(self.f) as af:
+            af.writefile((data,'data.bin'),'data')
+        link = os.path.join(self.dir,'link.apt')
+        os.symlink(self.f, link)
+        for dst in [self.f, os.path.join(self.dir,'..',
+                                         os.path.basename(self.dir),
+                                         'asset.apt'), link]:
+            with Aptofile.update(self.f,dst) as af:
+                af.setDescription("New description")
+            with Aptofile.open(self.f) as af:
+                self.assertTrue(af.valid)
+                self.assertEqual(af.getDescription(),"New description")
+                self.assertEqual(af.readfile('layers/layer1.shp'),
+                                 open(self.shp).read())
+                self.assertEqual(af.readfile('data.bin'),data)
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['asset.apt','layer.shp','link.apt','style.xml'])
+
+    def testAddAndReplace(self):
+        dst = os.path.join(self.dir,'new.apt')
+        with Aptofile.update(self.f,dst,writeWorkers=2) as af:
+            self.assertEqual(af.readfile('styles/layer1.xml'),'<sld/>')
+            self.assertEqual(str(af.readview('styles/layer1.xml')),'<sld/>')
+            af.writefile((bytearray('<new/>'),'styles/layer1.xml'))
+            af.addLayer('layer2',geometry_data=[(self.shp,'layers/layer2.shp')])
+            af.addFile2Layer('styles/layer1.xml','layer2','style',False)
+            self.assertTrue(af.valid)
+            self.assertEqual(af.readfile('styles/layer1.xml'),'<new/>')
+            af.flush()
+            self.assertEqual(sorted(af.namelist()),
+                             ['layers/layer1.shp','layers/layer2.shp',
+                              'styles/layer1.xml'])
+        with Aptofile.open(dst) as af:
+            self.assertTrue(af.valid)
+            self.assertEqual(sorted(af.namelist()),
+                             ['layers/layer1.shp','layers/layer2.shp',
+                              'manifest.json','styles/layer1.xml'])
+            self.assertEqual(af.readfile('styles/layer1.xml'),'<new/>')
+            self.assertTrue('layer2' in af.getManifest()['asset']['layers'])
+        # The original is unchanged
+        self.assertEqual(self.members(self.f),self.infos)
+
+    def testValidation(self):
+        with Aptofile.update(self.f) as af:
+            af.addLayer('layer2')
+            af.addFile2Layer('styles/layer1.xml','layer2','style',False)
+            af.addFile2Layer('layers/missing.shp','layer2','geometry',False)
+            self.assertFalse(af.valid)
+            af.addLayer('layer2')
+            af.addFile2Layer('styles/layer1.xml','layer2','style',False)
+            af.addFile2Layer('layers/layer1.shp','layer2','geometry',False)
+            self.assertTrue(af.valid)
+
+    def testFailedKeepsOriginal(self):
+        af = Aptofile.update(self.f,writeWorkers=2)
+        af.setDescription("New description")
+        af.writefile((os.path.join(self.dir,'missing.xml'),'styles/missing.xml'))
+        self.assertRaises(IOError, af.close)
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['asset.apt','layer.shp','style.xml'])
+        self.assertEqual(Aptofile.getManifestFromFile(self.f)['description'],
+                         "This is a description of the asset.")
+
+    def testValidationFailsOnClose(self):
+        with open(self.f,'rb') as fid: original = fid.read()
+        af = Aptofile.update(self.f,validate='on_close',compression='auto',
+                             writeWorkers=2)
+        af.setDescription("New description")
+        af.writefile((self.style,'styles/layer2.xml'))
+        af.readview('layers/layer1.shp')
+        def validate(depth=None): raise RuntimeError("Validation failed")
+        af.validate = validate
+        self.assertRaises(RuntimeError, af.close)
+        self.assertEqual(af.zipfile.fp, None)
+        self.assertEqual((af._compressPool, af._archiveMaps), (None, {}))
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['asset.apt','layer.shp','style.xml'])
+        with open(self.f,'rb') as fid: self.assertEqual(fid.read(), original)
+
+    def testConstructorFails(self):
+        init = Assetfile.__dict__['__init__']
+        def failing(self, *args): raise RuntimeError("Constructor failed")
+        Assetfile.__init__ = failing
+        try:
+            self.assertRaises(RuntimeError, Aptofile.update, self.f)
+        finally:
+            Assetfile.__init__ = init
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['asset.apt','layer.shp','style.xml'])
+
+    def testInvalidArguments(self):
+        self.assertRaises(Exception, Aptofile.update, self.f, validate='never')
+        self.assertEqual(len(os.listdir(self.dir)),3)
+
+class TestManifestRead(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.f = os.path.join(self.dir,'asset.apt')
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def create(self, files=100, **args):
+        with Aptofile.create(self.f,'asset',validate='on_close',**args) as af:
+            af.setDescription("This is a description of the asset.")
+            af.setGenerator("aptfile.py", "Aptomar AS")
+            names = ['tiles/%d.png'%i for i in range(files)]
+            for name in names: af.writefile((bytearray(name),name))
+            af.addLayer('layer1',resources={'data':names})
+            af.addFile2Layer(names[0],'layer1','geometry',writeFile=False)
+            af.addFile2Layer(names[1],'layer1','style',writeFile=False)
+            af.addGroup('group1',layers=['layer1'])
+            return af.getManifest()
+
+    def readManifest(self):
+        # Without building a ZipFile
+        ZipFile = zipfile.ZipFile
+        def fail(*args): raise Exception("Central directory read")
+        zipfile.ZipFile = fail
+        try:
+            return Aptofile.getManifestFromFile(self.f)
+        finally:
+            zipfile.ZipFile = ZipFile
+
+    def testFastRead(self):
+        for args in [{}, {'compression':'auto'}]:
+            manifest = self.create(**args)
+            self.assertEqual(self.readManifest(), manifest)
+            with zipfile.ZipFile(self.f) as zf:
+                self.assertEqual(zf.infolist()[-1].filename,'manifest.json')
+        self.assertRaises(zipfile.BadZipfile, Aptofile.getManifestFromFile,
+                          'tests/asset/styles/layer1.xml')
+        with zipfile.ZipFile(self.f,'w') as zf: zf.writestr('a.txt','a')
+        self.assertRaises(KeyError, Aptofile.getManifestFromFile, self.f)
+
+    def testFindMember(self):
+        self.create(files=5000)
+        with open(self.f,'rb') as fp:
+            for name in ['tiles/0.png','tiles/2345.png','tiles/4999.png']:
+                zinfo = ziptools.findMember(fp, name)
+                self.assertEqual(ziptools.readMember(fp, zinfo), name)
+            self.assertEqual(ziptools.findMember(fp, 'tiles/1.pn'), None)
+            self.assertEqual(ziptools.findMember(fp, 'iles/1.png'), None)
+
+    def testDecoyFirstMember(self):
+        # A first member whose name starts with the name looked for
+        with zipfile.ZipFile(self.f,'w') as zf:
+            zf.writestr('manifest.json.orig','{"old": 1}')
+            zf.writestr('a.txt','a')
+            zf.writestr('manifest.json','{"new": 1}')
+        self.assertEqual(self.readManifest(), {'new':1})
+        with open(self.f,'rb') as fp:
+            self.assertEqual(ziptools.findMember(fp, 'manifest.json.orig')
+                             .filename, 'manifest.json.orig')
+
+    def testManifestFirst(self):
+        manifest = self.create(manifestFirst=True, writeWorkers=2)
+        with zipfile.ZipFile(self.f) as zf:
+            zinfo = zf.infolist()[0]
+            self.assertEqual((zinfo.filename,zinfo.header_offset),
+                             ('manifest.json',0))
+            self.assertEqual(len(zf.namelist()), 101)
+            self.assertEqual(zf.testzip(), None)
+        self.assertEqual(self.readManifest(), manifest)
+        with Aptofile.open(self.f) as af:
+            self.assertTrue(af.valid)
+            self.assertEqual(af.getManifest(), manifest)
+        # Too large for the space, written last
+        manifest = self.create(manifestFirst=100)
+        with zipfile.ZipFile(self.f) as zf:
+            self.assertEqual(zf.infolist()[-1].filename,'manifest.json')
+            self.assertEqual(zf.namelist().count('manifest.json'), 1)
+        self.assertEqual(self.readManifest(), manifest)
+        self.assertTrue(Aptofile.validateFile(self.f))
+        # Moved first by an update
+        with Aptofile.update(self.f,manifestFirst=True) as af:
+            af.setDescription("Updated")
+        with zipfile.ZipFile(self.f) as zf:
+            self.assertEqual(zf.infolist()[0].filename,'manifest.json')
+        self.assertEqual(self.readManifest()['description'],"Updated")
+
+    def testSummary(self):
+        manifest = self.create()
+        self.assertEqual(Aptofile.getSummaryFromFile(self.f), None)
+        with zipfile.ZipFile(self.f) as zf: self.assertEqual(zf.comment, '')
+        manifest = self.create(manifestFirst=True)
+        summary = {'type':'asset','date':manifest['date'],
+                   'manifest_version':1}
+        self.assertEqual(Aptofile.getSummaryFromFile(self.f), summary)
+        # Kept by updates
+        with Aptofile.update(self.f) as af: af.setDescription("Updated")
+        self.assertEqual(Aptofile.getSummaryFromFile(self.f), summary)
+        with zipfile.ZipFile(self.f,'a') as zf: zf.comment = 'A comment'
+        with Aptofile.update(self.f) as af: af.setDescription("Again")
+        with zipfile.ZipFile(self.f) as zf:
+            self.assertEqual(zf.comment, 'A comment')
+        with zipfile.ZipFile(self.f,'w') as zf:
+            zf.writestr('a.txt','a')
+            zf.comment = 'Not a summary'
+        self.assertEqual(Aptofile.getSummaryFromFile(self.f), None)
+
+class TestScan(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir,'sub'))
+        self.files = []
+        for i in range(20):
+            fn = os.path.join(self.dir,'sub' if i%2 else '','%02d.apt'%i)
+            with Aptofile.create(fn,'point') as af:
+                af.setGenerator('aptfile.py','Aptomar AS')
+                af.setDescription('Point %d'%i)
+            self.files.append(fn)
+        self.bad = os.path.join(self.dir,'bad.apt')
+        with open(self.bad,'w') as fid: fid.write('Not a zip file')
+        with open(os.path.join(self.dir,'notes.txt'),'w') as fid: fid.write('')
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testScan(self):
+        expected = sorted(self.files[::2]+[self.bad])+sorted(self.files[1::2])
+        for workers in [1, 2]:
+            results = list(scanner.scan([self.dir], workers))
+            self.assertEqual([r.filename for r in results], expected)
+            bad = results[expected.index(self.bad)]
+            self.assertFalse(bad.ok)
+            self.assertTrue(bad.error.startswith('BadZipfile'))
+            self.assertEqual(bad.asDict(), {'file':self.bad,'error':bad.error})
+            self.assertEqual(results[0].data,
+                             Aptofile.getManifestFromFile(self.files[0]))
+            self.assertEqual(sum(r.ok for r in results), 20)
+
+    def testFields(self):
+        results = list(scanner.scan([os.path.join(self.dir,'sub','*.apt')],
+                                    2, ['type','description',
+                                        'generator.creator','missing']))
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[0].asDict(['type']),
+                         {'file':self.files[1],'type':'point',
+                          'description':'Point 1',
+                          'generator.creator':'Aptomar AS','missing':None})
+
+    def testSummaryFields(self):
+        for i, fn in enumerate(self.files[:2]):
+            with Aptofile.create(fn,'point',manifestFirst=True) as af:
+                af.setDescription('Point %d'%i)
+        # Read without the manifest
+        getManifestFromFile = Aptofile.__dict__['getManifestFromFile']
+        Aptofile.getManifestFromFile = None
+        try:
+            results = list(scanner.scan(self.files[:2], 1, ['type','date']))
+        finally:
+            Aptofile.getManifestFromFile = getManifestFromFile
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(results[1].data['type'], 'point')
+
+    def testClose(self):
+        scanner.CHUNK_SIZE, chunkSize = 1, scanner.CHUNK_SIZE
+        try:
+            results = scanner.scan([self.dir], 2, window=2)
+            self.assertEqual(results.next().filename, self.files[0])
+            results.close()
+        finally:
+            scanner.CHUNK_SIZE = chunkSize
+
+class TestValidationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.f = os.path.join(self.dir,'point.apt')
+        self.create('Point')
+        self.cache = ValidationCache(os.path.join(self.dir,'cache'))
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.dir)
+
+    def create(self, description, fn=None):
+        with Aptofile.create(fn or self.f,'point') as af:
+            af.setGenerator('aptfile.py','Aptomar AS')
+            af.setDescription(description)
+            af.setPointName('The Point')
+            af.setPointType('boat')
+            af.setPointGeometry('data:data_describing_the_point')
+
+    def validations(self):
+        calls = []
+        open = Aptofile.__dict__['open']
+        def counting(*args, **args2):
+            calls.append(args[0])
+            return open.__func__(*args, **args2)
+        Aptofile.open = staticmethod(counting)
+        self.addCleanup(setattr, Aptofile, 'open', open)
+        return calls
+
+    def testHit(self):
+        calls = self.validations()
+        self.assertTrue(Aptofile.validateFile(self.f, self.cache))
+        self.assertTrue(Aptofile.validateFile(self.f, self.cache))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.cache.getStatistics(),
+                         {'hits':1,'misses':1,'entries':1})
+        # Kept when reopened
+        cache = ValidationCache(os.path.join(self.dir,'cache'))
+        self.assertEqual(cache.get(self.f), (True,[]))
+        cache.close()
+
+    def testChanged(self):
+        calls = self.validations()
+        self.assertTrue(Aptofile.validateFile(self.f, self.cache))
+        # Same size, and possibly the same modification time
+        self.create('Tnoip')
+        self.assertNotEqual(self.cache.get(self.f), (True,[]))
+        self.assertTrue(Aptofile.validateFile(self.f, self.cache))
+        self.assertEqual(len(calls), 2)
+
+    def testFailedTests(self):
+        bad = os.path.join(self.dir,'bad.apt')
+        with open(bad,'w') as fid: fid.write('Not a zip file')
+        invalid = 'tests/point_invalid_type.apt'
+        for i in range(2):
+            self.assertFalse(Aptofile.validateFile(bad, self.cache))
+            self.assertFalse(Aptofile.validateFile(invalid, self.cache))
+        valid, failed = self.cache.get(bad)
+        self.assertEqual(failed[0][0], 'open')
+        self.assertEqual(failed[0][1].type, 'BadZipfile')
+        valid, failed = self.cache.get(invalid)
+        with Aptofile.open(invalid) as af:
+            self.assertEqual([(t,str(e)) for t,e in failed],
+                             [(t,str(e)) for t,e in af.getFailedTests()])
+        self.assertEqual(self.cache.hits, 4)
+        self.assertFalse(Aptofile.validateFile(
+            os.path.join(self.dir,'missing.apt'), self.cache))
+
+    def testSchemaChanged(self):
+        Aptofile.validateFile(self.f, self.cache)
+        schema = copy.deepcopy(Aptofile.SCHEMA)
+        schema['description'] = 'Changed'
+        cache = ValidationCache(os.path.join(self.dir,'cache'), schema)
+        self.assertEqual(cache.getStatistics()['entries'], 0)
+        self.assertEqual(cache.get(self.f), None)
+        cache.close()
+
+    def testProcesses(self):
+        pool = multiprocessing.Pool(2)
+        files = [os.path.join(self.dir,'%d.apt'%i) for i in range(4)]
+        for fn in files: self.create('Point', fn)
+        Aptofile.validateFile(files[0], self.cache)
+        self.assertEqual(pool.map(_validateCached,
+                                  [(fn,self.cache) for fn in files]),
+                         [True]*4)
+        pool.close()
+        pool.join()
+        self.assertEqual(self.cache.getStatistics()['entries'], 4)
+
+def _validateCached(args):
+    return Aptofile.validateFile(*args)
+
+class TestValidateFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.valid = os.path.join(self.dir,'valid.apt')
+        with Aptofile.create(self.valid,'point') as af:
+            af.setGenerator('aptfile.py','Aptomar AS')
+            af.setDescription('Point')
+            af.setPointName('The Point')
+            af.setPointType('boat')
+            af.setPointGeometry('data:data_describing_the_point')
+        self.invalid = os.path.join(self.dir,'invalid.apt')
+        shutil.copy('tests/point_invalid_type.apt', self.invalid)
+        self.bad = os.path.join(self.dir,'bad.apt')
+        with open(self.bad,'w') as fid: fid.write('Not a zip file')
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testValidate(self):
+        cache = ValidationCache(os.path.join(self.dir,'cache'))
+        for workers, c in [(1,None), (2,None), (2,cache), (2,cache)]:
+            results = list(scanner.validate([self.dir], workers, c))
+            self.assertEqual([r.filename for r in results],
+                             [self.bad, self.invalid, self.valid])
+            bad, invalid, valid = results
+            self.assertFalse(bad.readable)
+            self.assertEqual(bad.failed[0][:2], ('open','BadZipfile'))
+            self.assertTrue(invalid.readable)
+            self.assertFalse(invalid.valid)
+            self.assertTrue(valid.valid)
+            self.assertEqual(valid.asDict()['failed'], [])
+            d = invalid.asDict()
+            self.assertEqual(sorted(d), ['failed','file','time','valid'])
+            self.assertTrue(d['time'] >= 0)
+            self.assertEqual(sorted(d['failed'][0]), ['message','test','type'])
+            json.dumps(d)
+        self.assertEqual(cache.getStatistics()['entries'], 3)
+        cache.close()
+
+    def testCacheCounts(self):
+        cache = ValidationCache(os.path.join(self.dir,'cache'))
+        for workers, cached, hits, misses in [(2,False,0,3), (2,True,3,3),
+                                              (1,True,6,3)]:
+            results = list(scanner.validate([self.dir], workers, cache))
+            self.assertEqual([r.cached for r in results], [cached]*3)
+            self.assertEqual((cache.hits, cache.misses), (hits, misses))
+        results = list(scanner.validate([self.dir], 2))
+        self.assertEqual([r.cached for r in results], [None]*3)
+        cache.close()
+
+    def runTool(self, *args):
+        proc = subprocess.Popen([sys.executable,'../src/validateFile.py']+
+                                list(args), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        return proc.returncode, out, err
+
+    def testExitCodes(self):
+        self.assertEqual(self.runTool(self.valid)[0], 0)
+        self.assertEqual(self.runTool(self.valid, self.invalid)[0], 1)
+        self.assertEqual(self.runTool('-j', '2', self.dir)[0], 3)
+        self.assertEqual(self.runTool(os.path.join(self.dir,'*.none'))[0], 2)
+        self.assertEqual(self.runTool()[0], 2)
+
+    def testJsonl(self):
+        code, out, err = self.runTool('--jsonl', self.valid, self.invalid)
+        lines = [json.loads(l) for l in out.splitlines()]
+        self.assertEqual([(l['file'],l['valid']) for l in lines],
+                         [(self.valid,True),(self.invalid,False)])
+        self.assertTrue('2 files' in err)
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.images = [self.createImage(i) for i in range(6)]
+        self.point = os.path.join(self.dir,'point.apt')
+        with Aptofile.create(self.point,'point') as af:
+            af.setGenerator('aptfile.py','Aptomar AS')
+            af.setDescription('Point')
+            af.setPointName('Oil slick')
+            af.setPointType('oil')
+            af.setPointGeometry('data:data_describing_the_point')
+        self.bad = os.path.join(self.dir,'bad.apt')
+        with open(self.bad,'w') as fid: fid.write('Not a zip file')
+        self.catalog = Catalog(os.path.join(self.dir,'catalog.sqlite'))
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.dir)
+
+    def createImage(self, i, description='Image'):
+        fn = os.path.join(self.dir,'image%d.apt'%i)
+        with Aptofile.create(fn,'image',validate='on_close') as af:
+            af.setGenerator('aptfile.py','Vessel %d'%(i%2))
+            af.setDescription(description)
+            af.setImageName('Oil spill %d'%i)
+            af.setImageDescription('Seen from the bridge')
+            af.setImageCreated('2013-07-%02dT12:00:00Z'%(10+i))
+            af.setImageGeoreference(10.0+i, 63.0, 10.0)
+            af.addImageFile((iter(['image%d'%i]),'image.jpg'))
+        return fn
+
+    def testUpdate(self):
+        counts = self.catalog.update([self.dir], 2)
+        self.assertEqual(counts, {'added':8,'updated':0,'unchanged':0,
+                                  'failed':1,'removed':0})
+        self.assertEqual(len(self.catalog), 8)
+        entry = self.catalog.get(self.images[1])
+        self.assertEqual(entry['type'], 'image')
+        self.assertEqual(entry['creator'], 'Vessel 1')
+        self.assertEqual(entry['name'], 'Oil spill 1')
+        self.assertEqual(entry['time'], '2013-07-11T12:00:00Z')
+        self.assertEqual(entry['members'], 2)
+        self.assertEqual(entry['longitude'], 11.0)
+        self.assertEqual(entry['size'], os.path.getsize(self.images[1]))
+        self.assertTrue(self.catalog.get(self.bad)['error']
+                        .startswith('BadZipfile'))
+        # Incremental
+        self.createImage(2, 'Changed image')
+        os.remove(self.images[3])
+        counts = self.catalog.update([self.dir], 1)
+        self.assertEqual(counts, {'added':0,'updated':1,'unchanged':6,
+                                  'failed':0,'removed':1})
+        self.assertEqual(self.catalog.get(self.images[2])['description'],
+                         'Changed image')
+        self.assertEqual(self.catalog.get(self.images[3]), None)
+
+    def testQuery(self):
+        self.catalog.update([self.dir], 1)
+        paths = lambda entries: [e['path'] for e in entries]
+        self.assertEqual(paths(self.catalog.query(type='image',
+                                                  creator='Vessel 1',
+                                                  since='2013-07-12')),
+                         self.images[3::2])
+        self.assertEqual(paths(self.catalog.query(
+                             until=datetime(2013,7,11,12))), self.images[:2])
+        self.assertEqual(paths(self.catalog.query(name='Oil*', limit=2,
+                                                  order='name')),
+                         [self.point]+self.images[:1])
+        self.assertEqual(paths(self.catalog.query(text='BRIDGE')), self.images)
+        self.assertEqual(self.catalog.query(text='%'), [])
+        self.assertEqual(self.catalog.query(text='spill_'), [])
+        self.createImage(1, '100% of the oil_spill')
+        self.catalog.update([self.dir], 1)
+        for text in ['0%', '%', 'oil_', '_']:
+            self.assertEqual(paths(self.catalog.query(text=text)),
+                             self.images[1:2])
+        self.assertEqual(paths(self.catalog.query(bbox=(11.5,62,13,64))),
+                         self.images[2:4])
+        self.assertEqual(paths(self.catalog.query(errors=True)), [self.bad])
+        self.assertRaises(ValueError, self.catalog.query, order='path;')
+        # Answered without the files
+        os.remove(self.images[0])
+        self.assertEqual(len(self.catalog.query(type='image')), 6)
+
+@unittest.skipIf(geometry.numpy is None, "numpy not installed")
+class TestGeometry(unittest.TestCase):
+
+    def testPoint(self):
+        g = geometry.parse('SRID=4326;POINT(10.4344 63.4181)')
+        self.assertEqual((g.type, g.srid, g.zm), ('POINT', 4326, ''))
+        self.assertEqual(g.coords.tolist(), [[10.4344, 63.4181]])
+        self.assertEqual(g.bbox, (10.4344, 63.4181, 10.4344, 63.4181))
+        self.assertEqual(g.toEWKT(), 'SRID=4326;POINT(10.4344 63.4181)')
+
+    def testTypes(self):
+        for text, vertices, rings, parts in [
+                ('LINESTRING(0 0, 1 1, 2 0.5)', 3, [0,3], [0,1]),
+                ('POLYGON((0 0, 4 0, 4 4, 0 0), (1 1, 2 1, 2 2, 1 1))',
+                 8, [0,4,8], [0,2]),
+                ('MULTIPOINT((0 0), (1 1))', 2, [0,1,2], [0,1,2]),
+                ('MULTIPOINT(0 0, 1 1)', 2, [0,1,2], [0,1,2]),
+                ('MULTIPOINT( (0 0), (1 1))', 2, [0,1,2], [0,1,2]),
+                ('MULTIPOINT(\n  (0 0),\n  (1 1)\n)', 2, [0,1,2], [0,1,2]),
+                ('MULTIPOINT( 0 0, 1 1)', 2, [0,1,2], [0,1,2]),
+                ('MULTILINESTRING((0 0, 1 1), (2 2, 3 3, 4 4))',
+                 5, [0,2,5], [0,1,2]),
+                ('MULTIPOLYGON(((0 0, 1 0, 1 1, 0 0)), '
+                 '((5 5, 6 5, 6 6, 5 5), (5.2 5.2, 5.4 5.2, 5.4 5.4, 5.2 5.2)))',
+                 12, [0,4,8,12], [0,1,3]),
+                ('multilinestring ((1e-3 -2E+2,3 4))', 2, [0,2], [0,1])]:
+            g = geometry.parse(text)
+            self.assertEqual(g.vertexCount, vertices)
+            self.assertEqual(g.rings.tolist(), rings)
+            self.assertEqual(g.parts.tolist(), parts)
+            self.assertEqual(geometry.parse(g.toEWKT()), g)
+        self.assertEqual(len(g.getParts()[0][0]), 2)
+        self.assertEqual(g.bbox, (0.001, -200.0, 3.0, 4.0))
+
+    def testDimensions(self):
+        g = geometry.parse('LINESTRING Z (0 0 1, 1 1 2)')
+        self.assertEqual((g.zm, g.coords.shape), ('Z', (2,3)))
+        self.assertEqual(geometry.parse('LINESTRING(0 0 1, 1 1 2)'), g)
+        g = geometry.parse('POINTM(1 2 3)')
+        self.assertEqual((g.zm, g.toEWKT()), ('M', 'POINT M(1.0 2.0 3.0)'))
+        g = geometry.parse('POLYGON EMPTY')
+        self.assertEqual((g.vertexCount, g.bbox), (0, None))
+        self.assertEqual(g.toEWKT(), 'POLYGON EMPTY')
+
+    def testInvalid(self):
+        for text in ['CIRCLE(0 0)', 'POINT(0 0', 'POINT(0 0))',
+                     'LINESTRING((0 0, 1 1))', 'POINT()', 'POINT(0 x)',
+                     'LINESTRING(0 0, 1 1 1)', 'POINT(0 0, 1 1)',
+                     'POLYGON((0 0, 1 1)) x', 'LINESTRING(0 0)(1 1)',
+                     'LINESTRING(1 2, 3 4 5, 6)', 'LINESTRING(1 2,, 3 4)',
+                     'POLYGON((0 0, 1 0, 1 1, 0 0), (0 0 0, 1))',
+                     'data_describing_the_point']:
+            self.assertRaises(ValueError, geometry.parse, text)
+
+    def testArrays(self):
+        coords = numpy.random.uniform(-180, 180, (1000, 2))
+        g = geometry.Geometry('linestring', coords, srid=4326)
+        self.assertEqual(geometry.parse(g.toEWKT()), g)
+        geometry.EWKT_CHUNK, chunk = 100, geometry.EWKT_CHUNK
+        try:
+            self.assertEqual(len(list(g.iterEWKT())), 13)
+            self.assertEqual(geometry.parse(g.toEWKT()), g)
+        finally:
+            geometry.EWKT_CHUNK = chunk
+
+    def testGetGeometry(self):
+        f = 'tests/route_geometry.apt'
+        g = geometry.Geometry('LINESTRING', [(10,63),(10.5,63.2),(11,63)],
+                              srid=4326)
+        with Aptofile.create(f,'route') as af:
+            af.setGenerator('aptfile.py','Aptomar AS')
+            af.setDescription('Route')
+            af.setRouteName('The Route')
+            af.setRouteGeometry((g.iterEWKT(),'route.ewkt'))
+            self.assertEqual(af.getGeometry(), g)
+        with Aptofile.open(f) as af:
+            self.assertEqual(af.getGeometry(), g)
+        os.remove(f)
+        with Aptofile.create(f,'point') as af:
+            af.setPointGeometry('data:text/x-ewkt,SRID=4326;POINT(10 63)')
+            self.assertEqual(af.getGeometry().bbox, (10,63,10,63))
+            af.setPointGeometry('data:POINT(10 63)')
+            self.assertEqual(af.getGeometry().srid, None)
+        os.remove(f)
+        with Aptofile.open('tests/point.apt') as af:
+            self.assertRaises(ValueError, af.getGeometry)
+        with Aptofile.open('tests/image.apt') as af:
+            self.assertEqual(af.getGeometry(), None)
+
+def shapefileHeader(shapeType, bbox, length=100):
+    # The 100 bytes of the header of a .shp or .shx file
+    return struct.pack('>7i', 9994, 0, 0, 0, 0, 0, length//2) + \
+        struct.pack('<2i', 1000, shapeType) + \
+        struct.pack('<8d', *(tuple(bbox)+(0,0,0,0)))
+
+def shapefileData(shapeType, shapes, fields, records):
+    """
+    Return the .shp, .shx and .dbf files of shapes of shapeType 1 (points,
+    each an (x, y)) or 3 or 5 (lines or polygons, each a list of parts of
+    (x, y)), or None for null shapes, with fields of (name, type, length,
+    decimals) and records of values
+    """
+    contents = []
+    for shape in shapes:
+        if shape is None:
+            contents.append(struct.pack('<i', 0))
+            continue
+        if shapeType == 1:
+            contents.append(struct.pack('<i2d', 1, *shape))
+            continue
+        points = [p for part in shape for p in part]
+        xs, ys = [p[0] for p in points], [p[1] for p in points]
+        starts = [0]
+        for part in shape[:-1]: starts.append(starts[-1]+len(part))
+        contents.append(struct.pack('<i4d2i', shapeType, min(xs), min(ys),
+                                    max(xs), max(ys), len(shape),
+                                    len(points)) +
+                        struct.pack('<%di'%len(shape), *starts) +
+                        struct.pack('<%dd'%(2*len(points)),
+                                    *[c for p in points for c in p]))
+    shapes = [s for s in shapes if s is not None]
+    allPoints = shapes if shapeType == 1 else \
+        [p for shape in shapes for part in shape for p in part]
+    bbox = (min(p[0] for p in allPoints), min(p[1] for p in allPoints),
+            max(p[0] for p in allPoints), max(p[1] for p in allPoints))
+    shp, shx, offset = [], [], 100
+    for i, content in enumerate(contents):
+        shp.append(struct.pack('>2i', i+1, len(content)//2)+content)
+        shx.append(struct.pack('>2i', offset//2, len(content)//2))
+        offset += 8+len(content)
+    shp = shapefileHeader(shapeType, bbox, offset)+''.join(shp)
+    shx = shapefileHeader(shapeType, bbox, 100+8*len(shx))+''.join(shx)
+    headerLength = 32+32*len(fields)+1
+    dbf = [struct.pack('<4BI2H20x', 3, 113, 7, 30, len(records), headerLength,
+                       1+sum(f[2] for f in fields))]
+    for name, tp, length, decimals in fields:
+        dbf.append(struct.pack('<11sc4x2B14x', name, tp, length, decimals))
+    dbf.append('\r')
+    for record in records:
+        dbf.append(' ')
+        for (name, tp, length, decimals), value in zip(fields, record):
+            if tp == 'N': dbf.append(('%*.*f'%(length, decimals, value))[:length])
+            else: dbf.append(str(value).ljust(length)[:length])
+    dbf.append('\x1a')
+    return shp, shx, ''.join(dbf)
+
+@unittest.skipIf(geometry.numpy is None, "numpy not installed")
+class TestShapefile(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testLayerInfo(self):
+        fields = [('NAME','C',20,0), ('DEPTH','N',10,2)]
+        shp, shx, dbf = shapefileData(
+            3, [[[(5,60),(6,61)]], [[(6,61),(7,61.5)],[(7,62),(8,62)]]],
+            fields, [('Pipe 1',105.5), ('Pipe 2',98.25)])
+        fn = os.path.join(self.dir,'pipes.apt')
+        for compression in [None, 'auto']:
+            with Aptofile.create(fn,'asset',validate='on_close',
+                                 compression=compression) as af:
+                af.addLayer('pipes',
+                            geometry_data=[(bytearray(shp),'pipes.shp'),
+                                           (bytearray(shx),'pipes.shx'),
+                                           (bytearray(dbf),'pipes.dbf')])
+                af.addLayer('point', geometry_type='text/x-ewkt',
+                            geometry_data=['data:MULTIPOINT(1 2, 3 4)'])
+            with Aptofile.open(fn,validate='none') as af:
+                info = af.getLayerInfo('pipes')
+                self.assertEqual(info, {
+                    'type':'text/x-shapefile', 'shapeType':'PolyLine',
+                    'bbox':(5,60,8,62), 'zRange':(0,0), 'mRange':(0,0),
+                    'features':2, 'fields':fields,
+                    'files':{'shp':'pipes.shp','shx':'pipes.shx',
+                             'dbf':'pipes.dbf'}})
+                self.assertTrue(af.getLayerInfo('pipes') is info)
+                info = af.getLayerInfo('point')
+                self.assertEqual((info['shapeType'], info['bbox'],
+                                  info['features']),
+                                 ('MULTIPOINT', (1,2,3,4), 2))
+                self.assertEqual(af.getExtent(), (1,2,8,62))
+        header = shapefile.readDbfHeader(dbf)
+        self.assertEqual((header['records'], header['lastUpdate']),
+                         (2, '2013-07-30'))
+        self.assertRaises(ValueError, shapefile.readHeader, dbf[:100])
+
+    def testFeatures(self):
+        fields = [('NAME','C',20,0), ('DEPTH','N',10,2), ('ID','N',5,0)]
+        shapes = [[[(5,60),(6,61)]], None,
+                  [[(6,61),(7,61.5),(7,62)],[(7,62),(8,62)]], [[(9,63),(9,64)]]]
+        shp, shx, dbf = shapefileData(3, shapes, fields,
+                                      [('Pipe 1',105.5,1), ('',0,2),
+                                       ('Pipe 3',98.25,3), ('Pipe 4',1,4)])
+        wells = [bytearray(d) for d in shapefileData(
+            1, [(5,60),(6,61),(7,62)], [('OK','L',1,0)],
+            [('T',), ('F',), ('?',)])]
+        fn = os.path.join(self.dir,'pipes.apt')
+        for compression in [None, 'auto']:
+            with Aptofile.create(fn,'asset',validate='on_close',
+                                 compression=compression) as af:
+                af.addLayer('pipes',
+                            geometry_data=[(bytearray(shp),'pipes.shp'),
+                                           (bytearray(shx),'pipes.shx'),
+                                           (bytearray(dbf),'pipes.dbf')])
+                af.addLayer('wells',
+                            geometry_data=zip(wells, ['wells.shp','wells.shx',
+                                                      'wells.dbf']))
+                af.addLayer('nodbf',
+                            geometry_data=[(bytearray(shp),'nodbf.shp'),
+                                           (bytearray(shx),'nodbf.shx')])
+                af.addLayer('noshx',
+                            geometry_data=[(bytearray(shp),'noshx.shp')])
+            with Aptofile.open(fn,validate='none') as af:
+                batches = list(af.iterFeatures('pipes', batch=3))
+                self.assertEqual([b.ids.tolist() for b in batches],
+                                 [[0,1,2],[3]])
+                first = batches[0]
+                self.assertEqual(first.features.tolist(), [0,1,1,3])
+                self.assertEqual(first.rings.tolist(), [0,2,5,7])
+                self.assertEqual(first.coords.shape, (7,2))
+                self.assertEqual(first.bboxes[2].tolist(), [6,61,8,62])
+                self.assertTrue(numpy.isnan(first.bboxes[1]).all())
+                self.assertEqual(first.attributes['NAME'].tolist(),
+                                 ['Pipe 1','','Pipe 3'])
+                self.assertEqual(first.attributes['DEPTH'].tolist(),
+                                 [105.5,0,98.25])
+                self.assertEqual(first.attributes['ID'].dtype, numpy.int64)
+                self.assertEqual(first.getGeometry(1), None)
+                self.assertEqual(first.getGeometry(2), geometry.parse(
+                    'MULTILINESTRING((6 61, 7 61.5, 7 62), (7 62, 8 62))'))
+                self.assertEqual(first.getGeometry(0).toEWKT(),
+                                 'LINESTRING(5.0 60.0, 6.0 61.0)')
+                batches = list(af.iterFeatures('pipes', bbox=(7.5,61.5,9,63)))
+                self.assertEqual([b.ids.tolist() for b in batches], [[2,3]])
+                self.assertEqual(batches[0].attributes['ID'].tolist(), [3,4])
+                batches = list(af.iterFeatures('pipes', bbox=(8.5,63.5,9,70),
+                                               batch=2))
+                self.assertEqual([b.ids.tolist() for b in batches], [[3]])
+                batches = list(af.iterFeatures('nodbf', start=1, stop=3))
+                self.assertEqual((batches[0].ids.tolist(),
+                                  batches[0].attributes), ([1,2], {}))
+                points = list(af.iterFeatures('wells'))[0]
+                self.assertEqual(points.coords.tolist(),
+                                 [[5,60],[6,61],[7,62]])
+                self.assertEqual(points.attributes['OK'].tolist(),
+                                 [True, False, False])
+                self.assertEqual(points.getGeometry(2).toEWKT(),
+                                 'POINT(7.0 62.0)')
+                self.assertRaises(ValueError, list, af.iterFeatures('noshx'))
+
+def jpegHeader(width, height):
+    """
+    Return the start of a JPEG image, with an Exif segment before the
+    start of the frame
+    """
+    return '\xff\xd8' + '\xff\xe1' + struct.pack('>H', 1002) + '\0'*1000 + \
+        '\xff\xff\xc0' + struct.pack('>HB2HB', 17, 8, height, width, 3) + \
+        '\0'*9 + '\xff\xda'
+
+class TestImageFootprint(unittest.TestCase):
+
+    # Pixels of 0.25 by 0.125 degrees, the upper left one centred at
+    # (10.125, 63.0625)
+    WORLDFILE = '0.25\n0\n0\n-0.125\n10.125\n63.0625\n'
+    CORNERS = [(10.0,63.125), (12.0,63.125), (12.0,62.625), (10.0,62.625)]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def createImage(self, name, image, bounds, imageName='image.jpg',
+                    compression=None):
+        fn = os.path.join(self.dir,'%s.apt'%name)
+        with Aptofile.create(fn,'image',validate='on_close',
+                             compression=compression) as af:
+            af.setImageGeoreference(11.0, 63.0, 10.0)
+            af.addImageFile((bytearray(image),imageName))
+            if bounds is None: return fn
+            if not bounds.startswith('data:'):
+                af.writefile((bytearray(self.WORLDFILE),bounds),'image')
+            af.setImageBounds([bounds])
+        return fn
+
+    def testImageSize(self):
+        png = worldfile.PNG_SIGNATURE + struct.pack('>I4s2I', 13, 'IHDR',
+                                                    640, 480)
+        for data, size in [(png, (640, 480)), (jpegHeader(8, 4), (8, 4))]:
+            self.assertEqual(worldfile.readImageSize(StringIO.StringIO(data)),
+                             size)
+        for data in ['GIF89a', jpegHeader(8, 4)[:1010], png[:20]]:
+            self.assertRaises(ValueError, worldfile.readImageSize,
+                              StringIO.StringIO(data))
+        self.assertRaises(ValueError, worldfile.readWorldfile, '1 2 3')
+
+    def testFootprint(self):
+        url = 'data:,'+urllib.quote(self.WORLDFILE)
+        images = {
+            'url':self.createImage('url', jpegHeader(8, 4), url),
+            'member':self.createImage('member', jpegHeader(8, 4), 'image.jgw',
+                                      compression='auto'),
+            'png':self.createImage('png', worldfile.PNG_SIGNATURE +
+                                   struct.pack('>I4s2I', 13, 'IHDR', 8, 4),
+                                   url, 'image.png'),
+            'nobounds':self.createImage('nobounds', jpegHeader(8, 4), None),
+            'invalid':self.createImage('invalid', 'Not an image', url)}
+        for name in ['url', 'member', 'png']:
+            with Aptofile.open(images[name],validate='none') as af:
+                footprint = af.getImageFootprint()
+                self.assertEqual(footprint, {'corners':self.CORNERS,
+                                             'bbox':(10,62.625,12,63.125),
+                                             'size':(8, 4)})
+                self.assertTrue(af.getImageFootprint() is footprint)
+                self.assertEqual(af.getExtent(), (10,62.625,12,63.125))
+        with Aptofile.open(images['nobounds'],validate='none') as af:
+            self.assertEqual(af.getImageFootprint(), None)
+            self.assertEqual(af.getExtent(), (11,63,11,63))
+        with Aptofile.open(images['invalid'],validate='none') as af:
+            self.assertRaises(ValueError, af.getImageFootprint)
+            self.assertEqual(af.getExtent(), (11,63,11,63))
+        self.assertEqual(spatial.readExtents(images['url']),
+                         [(None, (10,62.625,12,63.125))])
+
+        with Catalog(os.path.join(self.dir,'catalog.sqlite')) as catalog:
+            # From the archive opened for the entry, not opened again
+            open_ = Aptofile.__dict__['open']
+            def fail(*args, **kwargs): raise Exception("Opened again")
+            Aptofile.open = staticmethod(fail)
+            try:
+                catalog.update([self.dir], 1)
+            finally:
+                Aptofile.open = open_
+            entry = catalog.get(images['url'])
+            self.assertEqual(json.loads(entry['footprint']),
+                             [list(c) for c in self.CORNERS])
+            self.assertEqual([entry[c] for c in ['minLongitude','minLatitude',
+                                                 'maxLongitude','maxLatitude']],
+                             [10,62.625,12,63.125])
+            self.assertEqual(catalog.get(images['invalid'])['error'], None)
+            found = catalog.query(bbox=(11.5,62,13,62.7))
+            self.assertEqual(sorted(e['path'] for e in found),
+                             sorted([images['url'], images['member'],
+                                     images['png']]))
+            found = catalog.query(bbox=(10.9,62.9,11.1,63.1))
+            self.assertEqual(len(found), 5)
+
+@unittest.skipIf(geometry.numpy is None, "numpy not installed")
+class TestSpatialIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.files = {}
+        self.createRoute('route', [(10,63),(10.5,63.5)])
+        fn = self.files['image'] = os.path.join(self.dir,'image.apt')
+        with Aptofile.create(fn,'image',validate='on_close') as af:
+            af.setImageGeoreference(12.0, 65.0, 10.0)
+        fn = self.files['asset'] = os.path.join(self.dir,'asset.apt')
+        with Aptofile.create(fn,'asset',validate='on_close') as af:
+            af.addLayer('wells',
+                        geometry_data=[(bytearray(shapefileHeader(
+                            1, (5,60,6,61))),'wells.shp')])
+            af.addLayer('pipes',
+                        geometry_data=[(bytearray(shapefileHeader(
+                            3, (6,61,8,62))),'pipes.shp')])
+            af.addLayer('empty',
+                        geometry_data=[(bytearray(shapefileHeader(
+                            0, (0,0,0,0))),'empty.shp')])
+        self.index = SpatialIndex(os.path.join(self.dir,'spatial.npz'))
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def createRoute(self, name, coords):
+        fn = self.files[name] = os.path.join(self.dir,'%s.apt'%name)
+        g = geometry.Geometry('LINESTRING', coords)
+        with Aptofile.create(fn,'route',validate='on_close') as af:
+            af.setRouteGeometry((g.iterEWKT(),'route.ewkt'))
+        return fn
+
+    def testPack(self):
+        numpy.random.seed(1)
+        for n in [1, 5, 33, 1000, 5000]:
+            lo = numpy.random.uniform(0, 100, (n, 2))
+            boxes = numpy.hstack([lo, lo+numpy.random.uniform(0, 2, (n, 2))])
+            order, levels = spatial.pack(boxes, 8)
+            self.assertEqual(sorted(order.tolist()), range(n))
+            self.assertEqual(len(levels[0]), 1)
+            for q in numpy.random.uniform(0, 100, (20, 2)):
+                bbox = (q[0], q[1], q[0]+5, q[1]+5)
+                found = order[spatial.search(levels, 8, bbox)]
+                expected = numpy.nonzero(
+                    (boxes[:,0] <= bbox[2]) & (boxes[:,2] >= bbox[0]) &
+                    (boxes[:,1] <= bbox[3]) & (boxes[:,3] >= bbox[1]))[0]
+                self.assertEqual(sorted(found.tolist()), expected.tolist())
+
+    def testExtents(self):
+        self.assertEqual(spatial.readExtents(self.files['route']),
+                         [(None, (10,63,10.5,63.5))])
+        self.assertEqual(spatial.readExtents(self.files['image']),
+                         [(None, (12,65,12,65))])
+        self.assertEqual(spatial.readExtents(self.files['asset']),
+                         [('pipes', (6,61,8,62)), ('wells', (5,60,6,61)),
+                          (None, (5,60,8,62))])
+        with Aptofile.open('tests/asset.apt') as af:
+            self.assertRaises(ValueError, af.getLayerExtent, 'layer1')
+
+    def testUpdate(self):
+        shutil.copy('tests/point.apt', self.dir)
+        counts = self.index.update([self.dir], 2)
+        self.assertEqual(counts, {'added':4,'updated':0,'unchanged':0,
+                                  'failed':1,'removed':0})
+        self.assertEqual(self.index.query((9,62,10.2,63.2)),
+                         [self.files['route']])
+        self.assertEqual(self.index.query((7,61.5,12,65)),
+                         sorted([self.files['asset'],self.files['route'],
+                                 self.files['image']]))
+        self.assertEqual(sorted(k for p, k, b in
+                                self.index.queryEntries((5.5,60.5,5.6,60.6))),
+                         [None, 'wells'])
+        self.assertEqual(self.index.nearby(12.0, 65.01, 1200),
+                         [self.files['image']])
+        self.assertEqual(self.index.nearby(12.0, 65.02, 1200), [])
+        self.assertEqual(self.index.nearby(10.25, 62.99, 2000),
+                         [self.files['route']])
+        # Incremental, and saved
+        self.createRoute('route', [(20,70),(21,71)])
+        os.remove(self.files['image'])
+        counts = self.index.update([self.dir], 1)
+        self.assertEqual(counts, {'added':0,'updated':1,'unchanged':2,
+                                  'failed':0,'removed':1})
+        index = SpatialIndex(self.index.filename)
+        for i in [self.index, index]:
+            self.assertEqual(i.query((0,0,90,90)),
+                             [self.files['asset'],self.files['route']])
+            self.assertEqual(i.query((9,62,10.2,63.2)), [])
+            self.assertEqual(len(i), 3)
+        self.assertEqual(index.update([self.dir])['unchanged'], 3)
+
+    def testAntimeridian(self):
+        # Extents crossing it cover the longitudes between
+        route = self.createRoute('dateline', [(179.5,10),(-179.5,10.5)])
+        self.assertEqual(spatial.readExtents(route),
+                         [(None, (179.5,10,-179.5,10.5))])
+        self.assertEqual(spatial.lonLatBbox(numpy.array([(-170,0),(170,1)])),
+                         (170,0,-170,1))
+        self.assertEqual(spatial.lonLatBbox(numpy.array([(-100,0),(0,0),
+                                                         (100,1)])),
+                         (-100,0,100,1))
+        self.assertEqual(spatial.lonLatBbox(numpy.array([(5e5,6e6),(6e5,7e6)])),
+                         (5e5,6e6,6e5,7e6))
+        self.index.update([self.dir], 1)
+        for bbox in [(179.6,10,179.8,11), (-179.8,10,-179.6,11),
+                     (179,10,-179,11)]:
+            self.assertEqual(self.index.query(bbox), [route])
+        self.assertEqual(self.index.query((0,10,1,11)), [])
+        self.assertEqual(sorted(b for p, k, b in
+                                self.index.queryEntries((179,10,-179,11))),
+                         [(-180,10,-179.5,10.5), (179.5,10,180,10.5)])
+        self.index.save()
+        self.assertEqual(SpatialIndex(self.index.filename).query(
+                         (-179.8,10,-179.6,11)), [route])
+        # Searched across it, to the nearest side of boxes
+        self.index.add('a.apt', [(None, (179.999,0,179.999,0))])
+        self.index.add('b.apt', [(None, (-179.99,0,-179.9,0.1))])
+        self.assertEqual(self.index.nearby(-179.999, 0, 1000), ['a.apt'])
+        self.assertEqual(self.index.nearby(-179.999, 0, 100), [])
+        self.assertEqual(self.index.nearby(179.99, 0, 3000),
+                         ['a.apt', 'b.apt'])
+        self.assertEqual(self.index.nearby(179.99, 0, 2000), ['a.apt'])
+        # Not longitudes, as projected layers
+        self.index.add('c.apt', [(None, (500000,6e6,600000,7e6))])
+        self.assertEqual(self.index.query((550000,6.5e6,550001,6.5e6)),
+                         ['c.apt'])
+
+    def testUnpacked(self):
+        # Entries added and removed before the tree is packed again
+        self.index.update([self.dir], 1)
+        self.index.add('a.apt', [(None, (0,0,1,1))])
+        self.index.add('b.apt', [(None, (0,0,2,2))])
+        self.index.remove('a.apt')
+        self.index.add(self.files['route'], [(None, (0.5,0.5,3,3))])
+        self.assertEqual(self.index.query((0,0,1,1)),
+                         sorted(['b.apt', self.files['route']]))
+        self.index.save()
+        self.assertEqual(self.index.query((0,0,1,1)),
+                         sorted(['b.apt', self.files['route']]))
+        self.assertEqual(SpatialIndex(self.index.filename).query((0,0,1,1)),
+                         sorted(['b.apt', self.files['route']]))
+
 class TestAsset(unittest.TestCase):
 
     def testCreateAsset(self):
@@ -273,6 +2050,142 @@ class TestAsset(unittest.TestCase):
         #Validate after write and open
         self.assertFalse(Aptofile.validateFile(f))
 
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def addLayers(self, af):
+        af.setDescription("This is a description of the asset.")
+        af.setGenerator("aptfile.py", "Aptomar AS")
+        af.addLayer('layer1', name='layer1-name',
+                    geometry_data=[('tests/asset/layers/layer1.dbf',
+                                    'layers/layer1.dbf'),
+                                   ('tests/asset/layers/layer1.shp',
+                                    'layers/layer1.shp'),
+                                   ('tests/asset/layers/layer1.shx',
+                                    'layers/layer1.shx')],
+                    style_data=[('tests/asset/styles/layer1.xml',
+                                 'styles/layer1.xml')])
+        af.addGroup('group1','group1-name',['layer1'])
+
+    def countValidations(self, af):
+        calls = []
+        validate = af.validate
+        def counting():
+            calls.append(1)
+            return validate()
+        af.validate = counting
+        return calls
+
+    def testBatch(self):
+        f = os.path.join(self.dir,'asset_batch.apt')
+        with Aptofile.create(f,'asset') as af:
+            calls = self.countValidations(af)
+            with af.batch():
+                self.addLayers(af)
+                self.assertFalse(af.valid)
+                self.assertEqual(len(calls),0)
+            self.assertEqual(len(calls),1)
+            self.assertTrue(af.valid)
+            af.setDescription("Changed")
+            self.assertEqual(len(calls),2)
+        self.assertTrue(Aptofile.validateFile(f))
+
+    def testNestedWritingMethods(self):
+        f = os.path.join(self.dir,'asset_batch.apt')
+        with Aptofile.create(f,'asset') as af:
+            calls = self.countValidations(af)
+            self.addLayers(af)
+            # One validation per call, not per file added to the layer
+            self.assertEqual(len(calls),4)
+            self.assertTrue(af.valid)
+
+    def testValidateOnClose(self):
+        f = os.path.join(self.dir,'asset_batch.apt')
+        with Aptofile.create(f,'asset',validate='on_close') as af:
+            calls = self.countValidations(af)
+            self.addLayers(af)
+            self.assertEqual(len(calls),0)
+        self.assertEqual(len(calls),1)
+        self.assertTrue(af.valid)
+        self.assertTrue(Aptofile.validateFile(f))
+
+    def testInvalidValidateMode(self):
+        self.assertRaises(Exception, Aptofile.create,
+                          os.path.join(self.dir,'asset_batch.apt'),
+                          'asset',validate='never')
+
+class TestIncrementalValidation(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.af = Aptofile.create(os.path.join(self.dir,'asset.apt'),'asset')
+        self.af.setDescription("This is a description of the asset.")
+        self.af.setGenerator("aptfile.py", "Aptomar AS")
+    def tearDown(self):
+        self.af.close()
+        shutil.rmtree(self.dir)
+
+    def addLayer(self, key, version='', **args):
+        return self.af.addLayer(key,
+                                geometry_data=[('tests/asset/layers/layer1.shp',
+                                                'layers/%s%s.shp'%(key,version))],
+                                style_data=[('tests/asset/styles/layer1.xml',
+                                             'styles/%s%s.xml'%(key,version))],
+                                **args)
+
+    def assertSameAsFull(self, incremental):
+        failed = sorted(name for name, e in self.af.getFailedTests())
+        full = Assetfile(self.af.zipfile, self.af.manifest)
+        self.assertEqual(incremental, full.valid)
+        self.assertEqual(failed, sorted(name for name, e in full.getFailedTests()))
+
+    def testLayersAndGroups(self):
+        self.assertSameAsFull(self.addLayer('layer1'))
+        self.assertSameAsFull(self.af.addGroup('group1',layers=['layer1']))
+        self.assertTrue(self.af.valid)
+        self.assertSameAsFull(self.af.addGroup('group2',layers=['layer2']))
+        self.assertFalse(self.af.valid)
+        self.assertSameAsFull(self.addLayer('layer2'))
+        self.assertTrue(self.af.valid)
+
+    def testSchemaErrors(self):
+        self.assertSameAsFull(self.addLayer('layer1'))
+        self.assertSameAsFull(self.af.addGroup('group1',layers=['layer1']))
+        self.assertSameAsFull(self.addLayer('layer2',geometry_type='text/plain'))
+        self.assertFalse(self.af.valid)
+        self.assertSameAsFull(self.af.setDescription('Still invalid'))
+        self.assertFalse(self.af.valid)
+        self.assertSameAsFull(self.addLayer('layer2',version='-2'))
+        self.assertTrue(self.af.valid)
+        self.assertSameAsFull(self.af.setDate('tomorrow'))
+        self.assertFalse(self.af.valid)
+
+    def testFilesAddedLater(self):
+        self.assertSameAsFull(self.addLayer('layer1'))
+        self.assertSameAsFull(self.af.addGroup('group1',layers=['layer1']))
+        self.assertSameAsFull(self.af.addFile2Layer('resource1.png','layer1',
+                                                    'resources',writeFile=False))
+        self.assertFalse(self.af.valid)
+        self.af.writefile(('tests/asset/resource1.png','resource1.png'))
+        self.assertSameAsFull(self.af.setDescription('Resource added'))
+        self.assertTrue(self.af.valid)
+
+    def testOnlyChangedLayersChecked(self):
+        self.addLayer('layer1')
+        self.addLayer('layer2')
+        checked = []
+        check = self.af._checkLayerFiles
+        def counting(v):
+            checked.append(v['name'])
+            return check(v)
+        self.af._checkLayerFiles = counting
+        self.addLayer('layer3')
+        self.assertEqual(checked,['layer3'])
+
 class TestImage(unittest.TestCase):
 
     def testImage(self):
@@ -434,6 +2347,23 @@ class TestPoint(unittest.TestCase):
             af.manifest['point']['object-type'] = 'UFO'
         self.assertFalse(Aptofile.validateFile(f))
 
+    def testPointName(self):
+        d = tempfile.mkdtemp()
+        try:
+            f = os.path.join(d,'point.apt')
+            with Aptofile.create(f,'point') as af:
+                af.setGenerator('aptfile.py','Aptomar AS')
+                af.setDescription('This is a description of the point.')
+                af.setPointName('The Point')
+                af.setPointType('boat')
+                af.setPointGeometry('data:data_describing_the_point')
+            with Aptofile.open(f) as af:
+                self.assertTrue(af.valid)
+                self.assertEqual(af.getManifest()['point']['name'],
+                                 'The Point')
+        finally:
+            shutil.rmtree(d)
+
 
     def testRoute(self):
         f = 'tests/route.apt'